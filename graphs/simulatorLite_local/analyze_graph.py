@@ -3,7 +3,6 @@
 import os
 import pickle
 from datetime import datetime
-from struct import unpack
 import argparse
 from redis import Redis
 import json
@@ -11,7 +10,8 @@ import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 
-from analysis_utils import timeval_to_datetime, timespec_to_timestamp
+from brand_simulator.alignment import align, previous_ts_end
+from brand_simulator.streams import Field, read_stream
 
 # parse input arguments
 argp = argparse.ArgumentParser()
@@ -53,95 +53,51 @@ print(f'[{PROCESS}] # of neurons: {n_neurons}')
 # %%
 # Load entries from mouse_vel
 
-replies = r.xrange(b'mouse_vel')
+mouse = read_stream(r, b'mouse_vel', {
+    'i': Field(np.int32, key=b'index'),
+    'ts_mouse': Field(kind='timespec', key=b'timestamps'),
+    'samples': Field(np.int16, (3, )),
+})
 
-print(f'[{PROCESS}] {len(replies)} replies in [mouse_vel]')
+print(f'[{PROCESS}] {mouse["i"].shape[0]} replies in [mouse_vel]')
 
-entries = []
-for i, reply in enumerate(replies):
-    entry_id, entry_dict = reply
-    mouse_dict = {
-        'i': int.from_bytes(entry_dict[b'index'], "little", signed=True),
-        'mouse_data': unpack('3h', entry_dict[b'samples'])
-    }
-    entry = {
-        'i': mouse_dict['i'],
-        'ts_mouse': timespec_to_timestamp(entry_dict[b'timestamps']),
-        'mouse_vel_x': mouse_dict['mouse_data'][0],
-        'mouse_vel_y': mouse_dict['mouse_data'][1],
-    }
-    entries.append(entry)
-
-graph_data = pd.DataFrame(entries)
-graph_data.set_index('i', inplace=True)
-
-print(graph_data)
+mouse['mouse_vel_x'] = mouse['samples'][:, 0]
+mouse['mouse_vel_y'] = mouse['samples'][:, 1]
+mouse['mouse_pos_x'] = np.cumsum(mouse['mouse_vel_x'])
+mouse['mouse_pos_y'] = np.cumsum(mouse['mouse_vel_y'])
+del mouse['samples']
 
 # %%
 # Load entries from firing_rates
-replies = r.xrange(b'firing_rates')
-
-print(f'[{PROCESS}] {len(replies)} replies in [firing_rates]')
-
-entries = []
-for i, reply in enumerate(replies):
-    entry_id, entry_dict = reply
-    entry = {
-        'ts_start_fr': float(entry_dict[b'ts_start']),
-        'ts_fr': float(entry_dict[b'ts']),
-        'ts_end_fr': float(entry_dict[b'ts_end']),
-        'i_in_fr': int(float(entry_dict[b'i_in'])),
-        'i_fr': np.frombuffer(entry_dict[b'i'], dtype=np.uint32).item(),
-        'rates': np.frombuffer(entry_dict[b'rates'], dtype=np.float32),
-        'prep_subspace': np.frombuffer(entry_dict[b'prep_subspace'], dtype=np.float),
-        'move_subspace': np.frombuffer(entry_dict[b'move_subspace'], dtype=np.float),
-        'target_state': int(float(entry_dict[b'target_state'])),
-        'moving': int(float(entry_dict[b'moving'])),
-        't_t': int(float(entry_dict[b't_t']))
-    }
-    entries.append(entry)
-
-fr_df = pd.DataFrame(entries)
-fr_df.set_index('i_in_fr', inplace=True)
-
-print(fr_df)
-
-graph_data = graph_data.join(fr_df)
+fr = read_stream(r, b'firing_rates', {
+    'ts_start_fr': Field(kind='text', key=b'ts_start'),
+    'ts_fr': Field(kind='text', key=b'ts'),
+    'ts_end_fr': Field(kind='text', key=b'ts_end'),
+    'i_in_fr': Field(np.int64, kind='text', key=b'i_in'),
+    'i_fr': Field(np.uint32, key=b'i'),
+    'rates': Field(np.float32, (n_neurons, )),
+    'prep_subspace': Field(np.float64, (-1, )),
+    'move_subspace': Field(np.float64, (-1, )),
+    'target_state': Field(np.int32),
+    'moving': Field(np.int64, kind='text'),
+    't_t': Field(np.int64, kind='text'),
+})
+
+print(f'[{PROCESS}] {fr["i_fr"].shape[0]} replies in [firing_rates]')
 
 # %%
 # Load entries from thresholdValues
-replies = r.xrange(b'threshold_values')
-
-print(f'[{PROCESS}] {len(replies)} replies in [threshold_values]')
-
-entries = []
-for i, reply in enumerate(replies):
-    entry_id, entry_dict = reply
-
-    entry = {
-        'ts_start_thres': float(entry_dict[b'ts_start']),
-        'ts_in_thres': float(entry_dict[b'ts_in']),
-        'ts_thres': float(entry_dict[b'ts']),
-        'ts_end_thres': float(entry_dict[b'ts_end']),
-        'i_in_thres': int(float(entry_dict[b'i_in'])),
-        'i_thres': int(float(entry_dict[b'i'])),
-        'thresholds': np.frombuffer(entry_dict[b'thresholds'], dtype=np.int8),
-        #'continuous1': np.frombuffer(entry_dict[b'continuous'], dtype=np.int16).reshape((-1,int(n_neurons/2)))
-        #'thresholds_30k': np.frombuffer(entry_dict[b'thresholds_30k'], dtype=np.float).reshape((-1,n_neurons)),
-    }
-    entries.append(entry)
-
-thres_df = pd.DataFrame(entries)
-# index is the input stream's index
-#thres_df.set_index('i_in_thres', inplace=True)
-#graph_data = graph_data.join(thres_df, on='i_fr')
-
-
-thres_df.set_index('i_in_thres', inplace=True)
-
-print(thres_df)
-
-graph_data = graph_data.join(thres_df, on='i_fr')
+thres = read_stream(r, b'threshold_values', {
+    'ts_start_thres': Field(kind='text', key=b'ts_start'),
+    'ts_in_thres': Field(kind='text', key=b'ts_in'),
+    'ts_thres': Field(kind='text', key=b'ts'),
+    'ts_end_thres': Field(kind='text', key=b'ts_end'),
+    'i_in_thres': Field(np.int64, kind='text', key=b'i_in'),
+    'i_thres': Field(np.int64, kind='text', key=b'i'),
+    'thresholds': Field(np.int8, (n_neurons, )),
+})
+
+print(f'[{PROCESS}] {thres["i_thres"].shape[0]} replies in [threshold_values]')
 
 print(f'[{PROCESS}] All stream data loaded from Redis')
 
@@ -149,21 +105,24 @@ print(f'[{PROCESS}] All stream data loaded from Redis')
 # close the Redis connection
 r.close()
 
-gdf = graph_data
-
-# shift ts_end (fr and thres) up by one iteration
-gdf['ts_end_fr'][:-5] = gdf['ts_end_fr'][5:]
-gdf['ts_end_thres'][:-5] = gdf['ts_end_thres'][5:]
+# ts_end is published with the next entry of each stream
+fr['ts_end_fr'] = previous_ts_end(fr['ts_end_fr'])
+thres['ts_end_thres'] = previous_ts_end(thres['ts_end_thres'])
 
 # %%
-# Calculate position
-gdf['mouse_pos_x'] = np.cumsum(gdf['mouse_vel_x'])
-gdf['mouse_pos_y'] = np.cumsum(gdf['mouse_vel_y'])
-
-gdf.dropna(inplace=True)
-gdf.drop(gdf.tail(1000).index,
-        inplace = True)
-
+# Trace each threshold sample to its firing rates and mouse sample
+graph = align(thres,
+              ('i_in_thres', fr, 'i_fr'),
+              ('i_in_fr', mouse, 'i'))
+# leave out the last 1000 samples
+graph = {name: col[:-1000] for name, col in graph.items()}
+
+# scalar columns, for plotting and ISIs
+gdf = pd.DataFrame({name: col for name, col in graph.items() if col.ndim == 1})
+rates_all = graph['rates']
+prep_subspace = graph['prep_subspace']
+move_subspace = graph['move_subspace']
+thresholds_all = graph['thresholds']
 
 #i_max = (gdf['i_thres'].iloc[-1]+1) - (gdf['i_thres'].iloc[-1]+1)%5
 #print(i_max)
@@ -202,7 +161,7 @@ plt.savefig(f'{data_id}_mouse_position.{FORMAT}')
 # %%
 # Plot simulated data
 
-thresholds = np.stack(gdf['thresholds'])
+thresholds = thresholds_all
 #thresholds2 = np.stack(gdf['thresholds2'])
 #thresholds = np.hstack((thresholds1, thresholds2))
 
@@ -217,7 +176,7 @@ for i, dim in enumerate(['x', 'y']):
     axes[0].plot(gdf['i_thres'], gdf[f'mouse_vel_{dim}'], label=f'{dim}-velocity')
 axes[0].legend()
 axes[1].set_title('Simulated Firing Rates')
-axes[1].imshow(np.stack(gdf['rates']).T, aspect='auto', interpolation=None)
+axes[1].imshow(rates_all.T, aspect='auto', interpolation=None)
 axes[1].set_ylabel('channels')
 axes[2].set_title('Simulated Spikes')
 axes[2].imshow(1-thresholds.T, aspect='auto',vmin=0,vmax=1,cmap='gray', interpolation=None)
@@ -239,13 +198,13 @@ axes[0].set_title('Mouse Velocity')
 for i, dim in enumerate(['x', 'y']):
     axes[0].plot(gdf['i_thres'].to_numpy()[:T], gdf[f'mouse_vel_{dim}'].to_numpy()[:T], label=f'{dim}-velocity')
 axes[1].set_title('Sample firing rates')
-rates = np.stack(gdf['rates']).T
+rates = rates_all.T
 for i in range(0, N_channels):
     axes[1].plot(gdf['i_thres'].to_numpy()[:T], rates[i,:T], label=f'Channel {i}')
 axes[1].set_ylabel(f'Firing rates [Hz]')
 axes[1].legend()
 axes[2].set_title('Sample spikes')
-thresholds = np.stack(gdf['thresholds']).T
+thresholds = thresholds_all.T
 for i in range(0, N_channels):
     axes[2].plot(gdf['i_thres'].to_numpy()[:T], 0.9*thresholds[i,:T]+i, label=f'Channel {i}')
 axes[2].set_ylabel(f'Spikes')
@@ -261,21 +220,21 @@ dim_move = 2
 fig, axes = plt.subplots(ncols=1, nrows=3, figsize=(8, 12), sharex=True)
 
 axes[0].set_title('Preparatory subspace')
-rates = np.stack(gdf['prep_subspace']).T
+rates = prep_subspace.T
 for i in range(0, dim_prep):
     axes[0].plot(gdf['i_thres'], rates[i,:], label=f'Dim {i}')
 axes[0].set_ylabel(f'Subspace activity [AU]')
 axes[0].legend()
 
 axes[1].set_title('Movement subspace')
-rates = np.stack(gdf['move_subspace']).T
+rates = move_subspace.T
 for i in range(0, dim_move):
     axes[1].plot(gdf['i_thres'], rates[i,:], label=f'Dim {i}')
 axes[1].set_ylabel(f'Subspace activity [AU]')
 axes[1].legend()
 
 axes[2].set_title('Sample firing rates')
-rates = np.stack(gdf['rates']).T
+rates = rates_all.T
 for i in range(0, N_channels):
     axes[2].plot(gdf['i_thres'], rates[i,:], label=f'Channel {i}')
 axes[2].set_ylabel(f'Firing rates [Hz]')
@@ -284,10 +243,10 @@ axes[2].legend()
 i_move_start = []
 i_target_change = []
 
-i_thres = np.stack(gdf['i_thres'])
-moving = np.stack(gdf['moving'])
-target_state = np.stack(gdf['target_state'])
-t_t = np.stack(gdf['t_t'])
+i_thres = gdf['i_thres'].to_numpy()
+moving = gdf['moving'].to_numpy()
+target_state = gdf['target_state'].to_numpy()
+t_t = gdf['t_t'].to_numpy()
 
 for i in i_thres[1:-1]:
     if moving[int(i)] != moving[int(i)-1] and moving[int(i)] == 1:
@@ -370,7 +329,7 @@ plt.savefig(f'{data_id}_per_node_isi_over_time.{FORMAT}')
 
 
 
-thresholds = np.stack(gdf['thresholds']).T
+thresholds = thresholds_all.T
 #thresholds = np.stack(gdf['thresholds2']).T
 #hresholds = np.vstack((thresholds1, thresholds2))
 
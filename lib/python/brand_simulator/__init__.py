@@ -0,0 +1,3 @@
+"""
+Shared building blocks for the brand-simulator nodes and analysis scripts
+"""
@@ -0,0 +1,349 @@
+import asyncio
+import logging
+import queue
+import threading
+
+from redis.asyncio import Redis
+
+
+def client_kwargs(r):
+    """
+    Arguments of ``redis.asyncio.Redis`` for the server of a synchronous
+    client
+
+    Parameters
+    ----------
+    r : redis.Redis
+        Synchronous client (e.g. a node's ``self.r``)
+
+    Returns
+    -------
+    kwargs : dict
+    """
+    kwargs = r.connection_pool.connection_kwargs
+    if 'path' in kwargs:
+        out = {'unix_socket_path': kwargs['path']}
+    else:
+        out = {
+            'host': kwargs.get('host', 'localhost'),
+            'port': kwargs.get('port', 6379)
+        }
+    for key in ('db', 'username', 'password'):
+        if kwargs.get(key) is not None:
+            out[key] = kwargs[key]
+    return out
+
+
+def snapshot(fields):
+    """
+    Copy of an entry whose buffer values (memoryviews of preallocated
+    arrays) are frozen into bytes, so the caller can reuse its buffers
+    before the entry is sent
+    """
+    return {
+        name: bytes(value) if isinstance(value,
+                                         (memoryview, bytearray)) else value
+        for name, value in fields.items()
+    }
+
+
+class QueuedPipeline:
+    """
+    Stand-in for a ``redis.Redis`` pipeline whose commands are queued to an
+    ``OverlappedIO`` writer on ``execute``, instead of being sent and
+    waited for
+    """
+
+    def __init__(self, io, transaction=True):
+        self.io = io
+        self.transaction = transaction
+        self.commands = []
+
+    def xadd(self, name, fields, maxlen=None, approximate=True):
+        self.commands.append((name, snapshot(fields), maxlen, approximate))
+        return self
+
+    def execute(self):
+        commands, self.commands = self.commands, []
+        if commands:
+            self.io.send(self.transaction, commands)
+
+
+class OverlappedIO:
+    """
+    Stream I/O of a node on two ``redis.asyncio`` connections, driven by an
+    event loop in a background thread, so round trips overlap with the
+    node's computation:
+
+    - the XREAD of the next input is issued as soon as the current one
+      returns, and its reply waits in a queue until ``read`` is called
+    - XADDs (``xadd``, or a ``pipeline`` on ``execute``) are queued and
+      return at once. Entries are copied when queued, so the caller may
+      reuse its buffers. Queued writes are sent in order, each batch of
+      pending writes in a single round trip.
+
+    A node loop of read, compute and write then takes about max(compute,
+    round trip) instead of compute plus two round trips. ``read`` waits for
+    the writes queued before the previous ``read``, so at most one
+    iteration of writes is in flight. Errors of the background connections
+    are raised by the next ``read``, ``xadd`` or ``flush``.
+
+    At most ``max_pending`` replies wait in the queue (``inbox``). When it
+    is full, no further XREAD is issued until ``read`` takes a reply: new
+    entries stay in the input stream and are read later, so a node that
+    falls behind lags the stream instead of buffering it without limit.
+
+    The writer has the ``xadd`` and ``pipeline`` methods of ``redis.Redis``
+    used by the nodes and by ``BlockPublisher``, and can stand in for the
+    node's connection on the output side. Return values (entry IDs) are not
+    available.
+
+    Parameters
+    ----------
+    reader : dict
+        ``redis.asyncio.Redis`` arguments of the input connection (see
+        ``client_kwargs``)
+    writer : dict
+        ``redis.asyncio.Redis`` arguments of the output connection
+    stream : str
+        Input stream
+    last_id : str or bytes, optional
+        Read entries after this ID, by default '$' (new entries only)
+    count : int, optional
+        Max. number of entries per read, by default 1
+    block : int, optional
+        XREAD timeout (ms), by default 0 (wait forever)
+    max_pending : int, optional
+        Max. number of XREAD replies read ahead of ``read``, by default 8
+    """
+
+    def __init__(self,
+                 reader,
+                 writer,
+                 stream,
+                 last_id='$',
+                 count=1,
+                 block=0,
+                 max_pending=8):
+        self.reader = reader
+        self.writer = writer
+        self.stream = stream
+        self.last_id = last_id
+        self.count = count
+        self.block = block
+        self.max_pending = max_pending
+
+        # one more slot for the error sentinel (see _fail)
+        self.inbox = queue.Queue(maxsize=max_pending + 1)
+        self.written = threading.Condition()
+        self.n_queued = 0  # write batches queued
+        self.n_written = 0  # write batches sent
+        self.mark = 0  # writes queued before the last read
+        self.error = None
+
+        self.loop = None
+        self.thread = None
+        self.task = None
+
+    @classmethod
+    def from_client(cls, r, stream, **kwargs):
+        """
+        Overlapped I/O with both connections to the server of a synchronous
+        client
+
+        Parameters
+        ----------
+        r : redis.Redis
+            Synchronous client (e.g. a node's ``self.r``)
+        stream : str
+            Input stream
+        **kwargs
+            Other arguments of ``OverlappedIO``
+
+        Returns
+        -------
+        io : OverlappedIO
+        """
+        return cls(client_kwargs(r), client_kwargs(r), stream, **kwargs)
+
+    def start(self):
+        """
+        Open the connections and issue the first read
+        """
+        self.loop = asyncio.new_event_loop()
+        started = threading.Event()
+        self.thread = threading.Thread(target=self._serve,
+                                       args=(started, ),
+                                       name='overlapped_io',
+                                       daemon=True)
+        self.thread.start()
+        started.wait()
+        logging.info(f'Overlapping reads of {self.stream} with computation '
+                     'and writes')
+
+    def _serve(self, started):
+        asyncio.set_event_loop(self.loop)
+        self.task = self.loop.create_task(self._main(started))
+        self.loop.run_until_complete(self.task)
+        self.loop.close()
+
+    async def _main(self, started):
+        # created in the loop's thread (asyncio objects bind to it), before
+        # start() returns and the caller may queue writes
+        self.outbox = asyncio.Queue()
+        self.slots = asyncio.Semaphore(self.max_pending)
+        started.set()
+
+        r_in = Redis(**self.reader)
+        r_out = Redis(**self.writer)
+        tasks = [
+            asyncio.ensure_future(self._read_loop(r_in)),
+            asyncio.ensure_future(self._write_loop(r_out)),
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            self._fail(e)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await r_in.connection_pool.disconnect()
+            await r_out.connection_pool.disconnect()
+
+    async def _read_loop(self, r):
+        last_id = self.last_id
+        while True:
+            # a slot in the inbox, released when read() takes a reply
+            await self.slots.acquire()
+            reply = await r.xread({self.stream: last_id},
+                                  count=self.count,
+                                  block=self.block)
+            if not reply:
+                self.slots.release()
+                continue
+            last_id = reply[0][1][-1][0]
+            self.inbox.put_nowait(reply)
+
+    async def _write_loop(self, r):
+        while True:
+            batches = [await self.outbox.get()]
+            while not self.outbox.empty():
+                batches.append(self.outbox.get_nowait())
+
+            # non-transactional batches share one pipeline; transactions keep
+            # their own MULTI/EXEC
+            pipe = r.pipeline(transaction=False)
+            for transaction, commands in batches:
+                if transaction:
+                    if len(pipe):
+                        await pipe.execute()
+                    await self._pipeline(r, True, commands).execute()
+                else:
+                    for command in commands:
+                        self._xadd(pipe, command)
+            if len(pipe):
+                await pipe.execute()
+
+            with self.written:
+                self.n_written += len(batches)
+                self.written.notify_all()
+
+    def _pipeline(self, r, transaction, commands):
+        pipe = r.pipeline(transaction=transaction)
+        for command in commands:
+            self._xadd(pipe, command)
+        return pipe
+
+    @staticmethod
+    def _xadd(pipe, command):
+        name, fields, maxlen, approximate = command
+        pipe.xadd(name, fields, maxlen=maxlen, approximate=approximate)
+
+    def _fail(self, error):
+        self.error = error
+        # wake up the caller, wherever it waits
+        self.inbox.put_nowait(None)
+        with self.written:
+            self.written.notify_all()
+
+    def _check(self):
+        if self.error is not None:
+            raise self.error
+
+    def _wait_written(self, n):
+        with self.written:
+            while self.n_written < n and self.error is None:
+                self.written.wait()
+        self._check()
+
+    def read(self):
+        """
+        Next reply of XREAD on the input stream, as returned by
+        ``redis.Redis.xread``: ``[[stream, [(id, fields), ...]]]``. Waits
+        for the writes queued before the previous call.
+
+        Returns
+        -------
+        reply : list
+        """
+        self._wait_written(self.mark)
+        self.mark = self.n_queued
+        reply = self.inbox.get()
+        self._check()
+        self.loop.call_soon_threadsafe(self.slots.release)
+        return reply
+
+    def send(self, transaction, commands):
+        """
+        Queue a batch of XADDs
+
+        Parameters
+        ----------
+        transaction : bool
+            Whether the batch is applied atomically (MULTI/EXEC)
+        commands : list of tuple
+            (stream, fields, maxlen, approximate) of each XADD. Fields must
+            not be modified afterwards (see ``snapshot``).
+        """
+        self._check()
+        self.n_queued += 1
+        self.loop.call_soon_threadsafe(self.outbox.put_nowait,
+                                       (transaction, commands))
+
+    def xadd(self, name, fields, maxlen=None, approximate=True):
+        """
+        Queue an XADD, as ``redis.Redis.xadd``
+        """
+        self.send(False, [(name, snapshot(fields), maxlen, approximate)])
+
+    def pipeline(self, transaction=True):
+        """
+        Pipeline whose XADDs are queued on ``execute``, as
+        ``redis.Redis.pipeline``
+
+        Returns
+        -------
+        pipe : QueuedPipeline
+        """
+        return QueuedPipeline(self, transaction)
+
+    def flush(self):
+        """
+        Wait until all queued writes are sent
+        """
+        self._wait_written(self.n_queued)
+
+    def stop(self):
+        """
+        Send the queued writes and close the connections
+        """
+        if self.thread is None:
+            return
+        if self.error is None:
+            self.flush()
+        if self.thread.is_alive():
+            self.loop.call_soon_threadsafe(self.task.cancel)
+        self.thread.join()
+        self.thread = None
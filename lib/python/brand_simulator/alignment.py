@@ -0,0 +1,115 @@
+import numpy as np
+
+
+def match(index, keys):
+    """
+    Find the row of each key in an index column, e.g. the ``firing_rates``
+    entry that each ``threshold_values`` entry was computed from
+
+    Parameters
+    ----------
+    index : int array of shape (n, )
+        Index column of the upstream stream (e.g. its 'i'). If a value is
+        repeated, the first row holding it is returned.
+    keys : int array of shape (m, )
+        Values to look up (e.g. the 'i_in' of the downstream stream)
+
+    Returns
+    -------
+    rows : int64 array of shape (m, )
+        Row of ``index`` holding each key, or -1 if the key is missing
+    """
+    index = np.asarray(index)
+    keys = np.asarray(keys)
+    if index.shape[0] == 0:
+        return np.full(keys.shape[0], -1, dtype=np.int64)
+    order = np.argsort(index, kind='stable')
+    sorted_index = index[order]
+    pos = np.searchsorted(sorted_index, keys)
+    pos = np.minimum(pos, sorted_index.shape[0] - 1)
+    found = sorted_index[pos] == keys
+    return np.where(found, order[pos], -1).astype(np.int64)
+
+
+def previous_ts_end(ts_end):
+    """
+    Move 'ts_end' timestamps to the entry they belong to. The nodes set
+    'ts_end' after each XADD, so it is only published with the next entry
+    of the same stream.
+
+    Parameters
+    ----------
+    ts_end : array of shape (n, )
+        'ts_end' column of a stream
+
+    Returns
+    -------
+    ts_end : float64 array of shape (n, )
+        End time of each entry's write (NaN for the last entry)
+    """
+    shifted = np.full(ts_end.shape[0], np.nan)
+    shifted[:-1] = ts_end[1:]
+    return shifted
+
+
+def align(base, *links, dropna=True):
+    """
+    Trace each entry of a downstream stream back through its upstream
+    streams, and gather all their columns on the downstream entries. Each
+    link follows the 'i_in' of one stream to the 'i' of its input, with
+    ``match`` and a gather, so no per-entry objects are built.
+
+    For example, to trace each threshold sample to its firing rates and
+    mouse sample::
+
+        graph = align(thres,
+                      ('i_in_thres', fr, 'i_fr'),
+                      ('i_in_fr', mouse, 'i'))
+
+    Parameters
+    ----------
+    base : dict
+        Columns of the downstream stream (e.g. from ``read_stream``)
+    *links : tuple
+        (key, columns, index) tuples: the ``key`` column of the previous
+        stream holds values of the ``index`` column of ``columns``
+    dropna : bool, optional
+        Drop the downstream entries whose lineage is incomplete, by default
+        True. Otherwise, their upstream rows are gathered from row -1 and
+        flagged in the 'valid' column.
+
+    Returns
+    -------
+    graph : dict
+        All columns of all streams, one row per kept downstream entry, with
+        the 'valid' mask and the 'rows' of each entry in the input columns
+        (shape (n, 1 + len(links)), downstream stream first)
+    """
+    n = next(iter(base.values())).shape[0] if base else 0
+    rows = [np.arange(n, dtype=np.int64)]
+    valid = np.ones(n, dtype=bool)
+    streams = [base]
+
+    prev = base
+    for key, columns, index in links:
+        keys = prev[key][np.maximum(rows[-1], 0)]
+        link_rows = match(columns[index], keys)
+        link_rows[rows[-1] < 0] = -1
+        valid &= link_rows >= 0
+        rows.append(link_rows)
+        streams.append(columns)
+        prev = columns
+
+    if dropna:
+        rows = [r[valid] for r in rows]
+        valid = valid[valid]
+
+    graph = {}
+    for columns, stream_rows in zip(streams, rows):
+        for name, column in columns.items():
+            if name in graph:
+                raise ValueError(f'Column {name} is in several streams')
+            graph[name] = column[stream_rows]
+    graph['rows'] = np.stack(rows, axis=1)
+    graph['valid'] = valid
+    return graph
@@ -0,0 +1,122 @@
+import numpy as np
+
+
+class ThresholdDetector:
+    """
+    Threshold crossing detector for blocks of continuous data. Thresholds
+    are set per channel as a multiple of the RMS over a rolling window.
+    The window is kept as a ring of per-block sums of squares, so each call
+    only adds the new block and drops the oldest one. A crossing is counted
+    when the signal goes from at or above the threshold to below it
+    (negative-going, for a negative ``thresh_mult``), including across
+    block boundaries.
+
+    Parameters
+    ----------
+    n_channels : int
+        Number of channels
+    block_len : int
+        Number of samples per block passed to ``detect``
+    bin_len : int
+        Number of samples per output bin, must divide ``block_len``
+    thresh_mult : float, optional
+        Threshold as a multiple of the channel RMS, by default -4.5
+    rms_window : int, optional
+        Length of the RMS window in samples, rounded up to whole blocks, by
+        default 30000
+    """
+
+    def __init__(self,
+                 n_channels,
+                 block_len,
+                 bin_len,
+                 thresh_mult=-4.5,
+                 rms_window=30000):
+        if block_len % bin_len:
+            raise ValueError('bin_len must divide block_len')
+
+        self.n_channels = n_channels
+        self.block_len = block_len
+        self.bin_len = bin_len
+        self.n_bins = block_len // bin_len
+        self.thresh_mult = thresh_mult
+        self.n_window = max(1, -(-rms_window // block_len))
+
+        # rolling sums of squares, one row per block in the window
+        self.block_ss = np.zeros((self.n_window, n_channels))
+        self.total_ss = np.zeros(n_channels)
+        self.n_filled = 0
+        self.window_pos = 0
+
+        self.rms = np.zeros(n_channels)
+        self.thresholds = np.zeros(n_channels)
+
+        self.x = np.zeros((block_len, n_channels))
+        self.below = np.zeros((block_len + 1, n_channels), dtype=bool)
+        self.crossings = np.zeros((block_len, n_channels), dtype=bool)
+        self.counts = np.zeros((self.n_bins, n_channels), dtype=np.int8)
+
+    def reset(self):
+        """
+        Clear the RMS window and the carried-over sample
+        """
+        self.block_ss[:] = 0
+        self.total_ss[:] = 0
+        self.n_filled = 0
+        self.window_pos = 0
+        self.below[:] = False
+
+    def update(self, block):
+        """
+        Add a block to the RMS window and update the thresholds
+
+        Parameters
+        ----------
+        block : array of shape (block_len, n_channels)
+            Continuous data
+        """
+        np.copyto(self.x, block, casting='unsafe')
+        new_ss = self.block_ss[self.window_pos]
+        self.total_ss -= new_ss
+        np.einsum('ij,ij->j', self.x, self.x, out=new_ss)
+        self.total_ss += new_ss
+
+        self.window_pos = (self.window_pos + 1) % self.n_window
+        self.n_filled = min(self.n_filled + 1, self.n_window)
+
+        np.divide(self.total_ss, self.n_filled * self.block_len, out=self.rms)
+        np.sqrt(self.rms, out=self.rms)
+        np.multiply(self.rms, self.thresh_mult, out=self.thresholds)
+
+    def detect(self, block):
+        """
+        Detect threshold crossings in one block
+
+        Parameters
+        ----------
+        block : array of shape (block_len, n_channels)
+            Continuous data
+
+        Returns
+        -------
+        counts : int8 array of shape (n_bins, n_channels)
+            Number of crossings per bin and channel. This is the detector's
+            own buffer and is overwritten by the next call.
+        """
+        self.update(block)
+
+        # below[t] marks samples past the threshold; row 0 holds the last
+        # sample of the previous block
+        self.below[0] = self.below[-1]
+        if self.thresh_mult < 0:
+            np.less(self.x, self.thresholds, out=self.below[1:])
+        else:
+            np.greater(self.x, self.thresholds, out=self.below[1:])
+        np.greater(self.below[1:], self.below[:-1], out=self.crossings)
+
+        # reduce as uint8, which avoids a cast from bool on every call
+        np.add.reduce(self.crossings.view(np.uint8).reshape(
+            self.n_bins, self.bin_len, self.n_channels),
+                      axis=1,
+                      out=self.counts.view(np.uint8))
+        return self.counts
@@ -0,0 +1,136 @@
+import numpy as np
+from scipy.linalg import expm
+from scipy.signal import fftconvolve
+
+INTEGRATORS = ('exact', 'euler')
+
+
+def discretize(J, B, h, method='exact'):
+    """
+    Discrete-time transition and input matrices of the linear system
+    ``dx/ds = J x + B u``, over a step of ``h`` time constants with the input
+    held constant during the step
+
+    Parameters
+    ----------
+    J : array of shape (n, n)
+        Dynamics matrix
+    B : array of shape (n, m)
+        Input matrix
+    h : float
+        Step (``dt / tau``)
+    method : str, optional
+        'exact' (matrix exponential, i.e. zero-order hold) or 'euler'
+        (forward Euler, ``I + h J`` and ``h B``), by default 'exact'
+
+    Returns
+    -------
+    A : array of shape (n, n)
+        Transition matrix
+    B_d : array of shape (n, m)
+        Input matrix of one step
+    """
+    if method not in INTEGRATORS:
+        raise ValueError(f'Unknown integrator: {method}')
+    n, m = B.shape
+    if method == 'euler':
+        return np.eye(n) + h * J, h * B
+
+    # the exponential of the augmented matrix [[J, B], [0, 0]] holds both
+    # matrices, and does not need J to be invertible
+    M = np.zeros((n + m, n + m))
+    M[:n, :n] = J
+    M[:n, n:] = B
+    E = expm(h * M)
+    return E[:n, :n], E[:n, n:]
+
+
+class LinearDynamics:
+    """
+    Latent state driven by linear dynamics ``tau dx/dt = J x + B u``,
+    advanced by precomputed discrete-time matrices. The state and the
+    outputs of ``step`` are preallocated, and ``step`` advances any number
+    of samples at once (for batched or offline use), from the impulse
+    response of the system instead of a per-sample loop.
+
+    Parameters
+    ----------
+    J : array of shape (n_dims, n_dims)
+        Dynamics matrix
+    B : array of shape (n_dims, n_inputs)
+        Input matrix
+    dt : float
+        Sample period (s)
+    tau : float
+        Time constant (s)
+    method : str, optional
+        'exact' or 'euler', see ``discretize``, by default 'exact'
+    max_steps : int, optional
+        Max. number of samples per ``step``, by default 1000
+    """
+
+    def __init__(self, J, B, dt, tau, method='exact', max_steps=1000):
+        J = np.atleast_2d(np.asarray(J, dtype=np.float64))
+        B = np.atleast_2d(np.asarray(B, dtype=np.float64))
+        self.n_dims, self.n_inputs = B.shape
+        self.max_steps = max_steps
+        self.A, self.B_d = discretize(J, B, dt / tau, method=method)
+
+        # powers[j] = A^(j + 1) and impulse[j] = A^j B_d, the response to a
+        # unit input j samples earlier
+        self.powers = np.zeros((max_steps, self.n_dims, self.n_dims))
+        self.impulse = np.zeros((max_steps, self.n_dims, self.n_inputs))
+        power = np.eye(self.n_dims)
+        for j in range(max_steps):
+            self.impulse[j] = power @ self.B_d
+            power = power @ self.A
+            self.powers[j] = power
+
+        self.x = np.zeros(self.n_dims)
+        self.drive = np.zeros(self.n_dims)
+        self.states = np.zeros((max_steps, self.n_dims))
+
+    def reset(self, x=None):
+        """
+        Set the state (to zero by default)
+        """
+        if x is None:
+            self.x.fill(0)
+        else:
+            self.x[:] = x
+
+    def step(self, inputs):
+        """
+        Advance the state by one sample per row of ``inputs``
+
+        Parameters
+        ----------
+        inputs : array of shape (k, n_inputs)
+            Input of each sample, held during the sample
+
+        Returns
+        -------
+        states : array of shape (k, n_dims)
+            State after each sample (a view of a preallocated buffer,
+            overwritten by the next call). The last row is the new state.
+        """
+        k = inputs.shape[0]
+        if k > self.max_steps:
+            raise ValueError(f'At most {self.max_steps} samples per step')
+        states = self.states[:k]
+
+        if k == 1:
+            np.matmul(self.A, self.x, out=states[0])
+            np.matmul(self.B_d, inputs[0], out=self.drive)
+            states[0] += self.drive
+        else:
+            # free response of the current state, plus the input convolved
+            # with the impulse response
+            np.matmul(self.powers[:k], self.x, out=states)
+            forced = fftconvolve(self.impulse[:k],
+                                 inputs[:, None, :],
+                                 axes=0)[:k]
+            states += forced.sum(axis=2)
+
+        self.x[:] = states[-1]
+        return states
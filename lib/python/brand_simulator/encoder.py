@@ -0,0 +1,303 @@
+import tracemalloc
+
+import numpy as np
+
+
+class RateEncoder:
+    """
+    Cosine-tuned firing-rate encoder that works entirely on preallocated
+    float32 buffers, so that steady-state iterations do not allocate.
+
+    This is the 'cosine' encoding model: each neuron fires at ``fr_mean +
+    fr_mod * (c . x)``, plus ``click_tuning`` times the click state, rectified
+    at zero. Other models (see ``ENCODERS``) subclass it and only change how
+    the tuning parameters are drawn (``draw``), so they share ``encode`` and
+    its batched path.
+
+    Parameters
+    ----------
+    n_neurons : int
+        Number of simulated neurons
+    n_dims : int
+        Dimensionality of the encoded state ``x_t``
+    seed : int, optional
+        Seed for the tuning parameters, by default 42
+    count_allocs : bool, optional
+        Measure the bytes allocated by each call to ``encode``, by default
+        False. This uses tracemalloc and is meant for verification only.
+    dtype : np.dtype, optional
+        Type of the tuning parameters and buffers, by default float32
+    max_batch : int, optional
+        Max. number of states encoded by one call to ``encode`` with a batch
+        of states, by default 1
+    """
+
+    def __init__(self,
+                 n_neurons,
+                 n_dims,
+                 seed=42,
+                 count_allocs=False,
+                 dtype=np.float32,
+                 max_batch=1):
+        self.n_neurons = n_neurons
+        self.n_dims = n_dims
+        self.seed = seed
+        self.count_allocs = count_allocs
+        self.dtype = np.dtype(dtype)
+        self.max_batch = max_batch
+
+        # bytes allocated during the last call to encode()
+        self.alloc_bytes = 0
+
+    @classmethod
+    def from_parameters(cls, parameters, n_dims=2, **kwargs):
+        """
+        Create the encoder of a node
+
+        Parameters
+        ----------
+        parameters : dict
+            Node parameters, as in the graph YAML: ``n_neurons`` and,
+            optionally, ``encoder_seed`` (42), ``count_allocs`` (False) and
+            ``max_batch`` (1), plus those of the model
+        n_dims : int, optional
+            Dimensionality of the encoded state, by default 2
+        **kwargs
+            Other arguments of the encoder (e.g. ``dtype``)
+
+        Returns
+        -------
+        encoder : RateEncoder
+        """
+        return cls(parameters['n_neurons'],
+                   n_dims,
+                   seed=parameters.get('encoder_seed', 42),
+                   count_allocs=parameters.get('count_allocs', False),
+                   max_batch=parameters.get('max_batch', 1),
+                   **kwargs)
+
+    def draw(self, rng):
+        """
+        Draw the tuning parameters (as float64): ``fr_mean`` and ``fr_mod``
+        of shape (n_neurons, 1), ``click_tuning`` of shape (n_neurons, 1) and
+        the unit tuning vectors ``c`` of shape (n_neurons, n_dims). The draws
+        follow the order of the original ``sim2D`` node, so the same seed
+        gives the same tuning.
+
+        Parameters
+        ----------
+        rng : np.random.RandomState
+        """
+        fr_min = rng.uniform(size=(self.n_neurons, 1)) * 20.0
+        fr_max = rng.uniform(
+            size=(self.n_neurons, 1)) * (100.0 - fr_min) + fr_min
+
+        self.fr_mean = 0.5 * (fr_max + fr_min)
+        self.fr_mod = 0.5 * (fr_max - fr_min)
+
+        self.click_tuning = rng.uniform(size=(self.n_neurons, 1)) * 100.0 - 50.0
+        self.c = self.draw_directions(rng)
+
+    def draw_directions(self, rng):
+        """
+        Draw one uniformly oriented unit tuning vector per neuron
+
+        Returns
+        -------
+        c : array of shape (n_neurons, n_dims)
+        """
+        c = rng.uniform(size=(self.n_neurons, self.n_dims)) * 2 - 1
+        return c / np.sqrt((c**2).sum(axis=1, keepdims=True))
+
+    def build(self):
+        """
+        Draw the tuning parameters and allocate the working buffers
+        """
+        self.draw(np.random.RandomState(self.seed))
+        self.weights = np.hstack(
+            (self.fr_mod * self.c, self.fr_mean, self.click_tuning))
+        for name in ('fr_mean', 'fr_mod', 'click_tuning', 'c', 'weights'):
+            setattr(self, name, getattr(self, name).astype(self.dtype))
+
+        # working buffers
+        self.x_t = np.zeros((self.n_dims, 1), dtype=self.dtype)
+        self.click = np.zeros((), dtype=self.dtype)
+        self.rates = np.zeros((self.n_neurons, 1), dtype=self.dtype)
+        self.click_rates = np.zeros_like(self.rates)
+        self.zero = np.zeros((), dtype=self.dtype)
+
+        # byte view of the rates, to publish without copying to bytes
+        self.rates_view = memoryview(self.rates.reshape(-1)).cast('B')
+
+        # batch path: a single product of the augmented states [x, 1, click]
+        # with the weights [fr_mod * c, fr_mean, click_tuning], as broadcast
+        # operations over a batch use scratch buffers. One row of inputs and
+        # of rates per state, so that both operands of the product are
+        # C-contiguous (np.dot then works without scratch buffers) and the
+        # rates of each state are contiguous.
+        self.inputs = np.zeros((self.max_batch, self.n_dims + 2),
+                               dtype=self.dtype)
+        self.inputs[:, self.n_dims] = 1
+        self.states = self.inputs[:, :self.n_dims].T
+        self.clicks = self.inputs[:, self.n_dims + 1]
+        self.batch_rates = np.zeros((self.max_batch, self.n_neurons),
+                                    dtype=self.dtype)
+        self.weights_t = np.ascontiguousarray(self.weights.T)
+        self.batch_views = {}
+
+        if self.count_allocs and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def encode(self, X=None, clicks=None, click_enabled=True):
+        """
+        Compute firing rates, either from the current contents of ``x_t``
+        and ``click`` (into ``rates``), or from a batch of states (into
+        ``batch_rates``)
+
+        Parameters
+        ----------
+        X : array of shape (n_dims, k), optional
+            States to encode, k <= max_batch, by default ``x_t``. States
+            written in place, in ``states[:, :k]``, are not copied.
+        clicks : array of shape (k, ), optional
+            Click state of each state in ``X`` (e.g. ``clicks[:k]``), by
+            default 0
+        click_enabled : bool, optional
+            Add the click tuning term, by default True
+
+        Returns
+        -------
+        rates : array of shape (n_neurons, 1) or (n_neurons, k)
+            Firing rates (in Hz). This is a view of the encoder's own buffer
+            and is overwritten by the next call.
+        """
+        if self.count_allocs:
+            tracemalloc.clear_traces()
+
+        if X is None:
+            rates = self._encode_one(click_enabled)
+        else:
+            rates = self._encode_batch(X, clicks, click_enabled)
+
+        if self.count_allocs:
+            self.alloc_bytes = tracemalloc.get_traced_memory()[1]
+
+        return rates
+
+    def _encode_one(self, click_enabled):
+        np.dot(self.c, self.x_t, out=self.rates)
+        np.multiply(self.rates, self.fr_mod, out=self.rates)
+        np.add(self.rates, self.fr_mean, out=self.rates)
+        if click_enabled:
+            np.multiply(self.click_tuning, self.click, out=self.click_rates)
+            np.add(self.rates, self.click_rates, out=self.rates)
+        np.maximum(self.rates, self.zero, out=self.rates)
+        return self.rates
+
+    def _encode_batch(self, X, clicks, click_enabled):
+        k = X.shape[1]
+        if k > self.max_batch:
+            raise ValueError(f'At most {self.max_batch} states per batch')
+
+        # views of the first k states, made once per batch size so that
+        # steady-state calls do not allocate
+        views = self.batch_views.get(k)
+        if views is None:
+            views = self.batch_views[k] = (self.states[:, :k],
+                                           self.clicks[:k],
+                                           self.inputs[:k],
+                                           self.batch_rates[:k],
+                                           self.batch_rates[:k].T)
+        states, batch_clicks, inputs, rates, rates_t = views
+
+        # states and clicks written in place (``states``, ``clicks``) are
+        # not copied
+        if not np.may_share_memory(X, self.inputs):
+            np.copyto(states, X)
+        if not click_enabled or clicks is None:
+            batch_clicks.fill(0)
+        elif not np.may_share_memory(clicks, self.inputs):
+            np.copyto(batch_clicks, clicks)
+
+        np.dot(inputs, self.weights_t, out=rates)
+        np.maximum(rates, self.zero, out=rates)
+        return rates_t
+
+
+class UniformEncoder(RateEncoder):
+    """
+    Encoder with the same modulation depth for all neurons: ``fr_mean =
+    fr_mod = mod_amp``, so each neuron fires between 0 and ``2 * mod_amp``
+    along its preferred direction (the model of ``sim2D_uniform``).
+
+    Parameters
+    ----------
+    n_neurons : int
+        Number of simulated neurons
+    n_dims : int
+        Dimensionality of the encoded state
+    mod_amp : float, optional
+        Modulation depth (in Hz), by default 10.0
+    **kwargs
+        Other arguments of ``RateEncoder``
+    """
+
+    def __init__(self, n_neurons, n_dims, mod_amp=10.0, **kwargs):
+        super().__init__(n_neurons, n_dims, **kwargs)
+        self.mod_amp = mod_amp
+
+    @classmethod
+    def from_parameters(cls, parameters, n_dims=2, **kwargs):
+        kwargs.setdefault('mod_amp', parameters.get('mod_amp', 10.0))
+        return super().from_parameters(parameters, n_dims, **kwargs)
+
+    def draw(self, rng):
+        # same draws as the original sim2D_uniform node
+        self.fr_mod = self.mod_amp * np.ones((self.n_neurons, 1))
+        self.fr_mean = self.fr_mod.copy()
+
+        self.click_tuning = rng.uniform(size=(self.n_neurons, 1)) * 100.0 - 50.0
+        self.c = self.draw_directions(rng)
+
+
+class SubspaceEncoder(RateEncoder):
+    """
+    Cosine-tuned encoder of a state made of preparatory, movement (2D
+    velocity) and speed subspaces, as ``sim2D_prep``'s ``x_t``. The tuning is
+    drawn as for ``RateEncoder`` over all dimensions, so each neuron mixes
+    the subspaces.
+
+    Parameters
+    ----------
+    n_neurons : int
+        Number of simulated neurons
+    prep_dims : int, optional
+        Dimensionality of the preparatory subspace, by default 2
+    **kwargs
+        Other arguments of ``RateEncoder``
+    """
+
+    def __init__(self, n_neurons, prep_dims=2, **kwargs):
+        super().__init__(n_neurons, prep_dims + 3, **kwargs)
+        self.prep_dims = prep_dims
+
+        # rows of each subspace in the state
+        self.prep_slice = slice(0, prep_dims)
+        self.move_slice = slice(prep_dims, prep_dims + 2)
+        self.speed_index = prep_dims + 2
+
+    @classmethod
+    def from_parameters(cls, parameters, **kwargs):
+        return cls(parameters['n_neurons'],
+                   prep_dims=parameters.get('prep_dims', 2),
+                   seed=parameters.get('encoder_seed', 42),
+                   count_allocs=parameters.get('count_allocs', False),
+                   max_batch=parameters.get('max_batch', 1),
+                   **kwargs)
+
+
+ENCODERS = {
+    'cosine': RateEncoder,
+    'uniform': UniformEncoder,
+    'subspace': SubspaceEncoder,
+}
@@ -0,0 +1,358 @@
+import bisect
+import json
+import os
+
+import numpy as np
+
+from brand_simulator.schema import RECORD_FIELD, load_schema
+from brand_simulator.streams import Field, next_id, xrange_pages
+
+INDEX_FILE = 'index.json'
+
+# every export holds the entry IDs, split in their two parts
+ID_COLUMNS = ('id_ms', 'id_seq')
+
+
+def parse_id(entry_id):
+    """
+    Split a stream entry ID into its millisecond time and sequence number
+
+    Parameters
+    ----------
+    entry_id : bytes or str
+        Entry ID, as '<ms>-<seq>'
+
+    Returns
+    -------
+    ms, seq : int
+    """
+    if isinstance(entry_id, bytes):
+        entry_id = entry_id.decode()
+    ms, _, seq = entry_id.partition('-')
+    return int(ms), int(seq or 0)
+
+
+def infer_fields(r, stream, entry, dtypes=None):
+    """
+    Guess how to decode the fields of a stream from one of its entries.
+    Binary records are decoded with the stream's schema and fields listed
+    in ``dtypes`` as raw bytes of their type. Other values that parse as
+    numbers are read as text, and the rest as uint8 bytes.
+
+    Parameters
+    ----------
+    r : redis.Redis
+        Redis connection
+    stream : str
+        Stream name
+    entry : dict
+        One entry of the stream
+    dtypes : dict, optional
+        Maps field names (bytes) to the dtype of their binary values, or to
+        'timespec', by default None
+
+    Returns
+    -------
+    fields : dict
+        Maps field names (str) to ``Field`` specs
+    """
+    dtypes = dtypes or {}
+    fields = {}
+    for key, value in entry.items():
+        name = key.decode()
+        if key == RECORD_FIELD:
+            dtype = load_schema(r, stream)
+            if dtype is not None:
+                fields[name] = Field(dtype, (-1, ), key=key)
+                continue
+        # listed fields are binary, whatever their first value looks like
+        if key not in dtypes:
+            try:
+                float(value)
+                fields[name] = Field(kind='text', key=key)
+                continue
+            except ValueError:
+                pass
+        dtype = dtypes.get(key, np.uint8)
+        if isinstance(dtype, str) and dtype == 'timespec':
+            fields[name] = Field(kind='timespec', key=key)
+        else:
+            fields[name] = Field(dtype, (-1, ), key=key)
+    return fields
+
+
+class StreamExporter:
+    """
+    Appends decoded stream entries to on-disk column files, one raw binary
+    file per field in ``path``, which can later be memory-mapped (see
+    ``open_export``). A small JSON index holds the dtype and row shape of
+    each column, the number of entries, the last entry ID and the row
+    offset of the first entry of each appended page, and is rewritten after
+    every page so an interrupted export can be resumed.
+
+    Parameters
+    ----------
+    path : str
+        Output directory, created if needed. An existing export in this
+        directory is appended to.
+    stream : str
+        Stream name, recorded in the index
+    """
+
+    def __init__(self, path, stream):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        index_path = os.path.join(path, INDEX_FILE)
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                self.index = json.load(f)
+        else:
+            self.index = {
+                'stream': stream,
+                'n_entries': 0,
+                'last_id': None,
+                'columns': {},
+                'pages': [],
+            }
+
+    @property
+    def n_entries(self):
+        return self.index['n_entries']
+
+    @property
+    def last_id(self):
+        return self.index['last_id']
+
+    def fields(self):
+        """
+        Field specs of the exported columns, to append more entries decoded
+        the same way
+
+        Returns
+        -------
+        fields : dict
+            Maps column names to ``Field`` specs
+        """
+        fields = {}
+        for name, spec in self.index['columns'].items():
+            if name in ID_COLUMNS:
+                continue
+            fields[name] = Field(np.lib.format.descr_to_dtype(spec['descr']),
+                                 spec['shape'],
+                                 kind=spec['kind'],
+                                 key=spec['key'].encode())
+        return fields
+
+    def append(self, page, fields):
+        """
+        Decode a page of entries and append it to the column files
+
+        Parameters
+        ----------
+        page : list
+            (entry_id, entry_dict) pairs, in ID order
+        fields : dict
+            Maps column names to ``Field`` specs
+        """
+        if not page:
+            return
+        ids = np.array([parse_id(entry_id) for entry_id, _ in page],
+                       dtype=np.uint64)
+        columns = {}
+        for name, field in fields.items():
+            key = field.key if field.key is not None else name.encode()
+            columns[name] = field.decode([entry[key] for _, entry in page])
+        self.append_columns(ids, columns, fields)
+
+    def append_columns(self, ids, columns, fields=None):
+        """
+        Append entries that are already decoded (e.g. generated offline) to
+        the column files
+
+        Parameters
+        ----------
+        ids : uint64 array of shape (n, 2)
+            Time (ms) and sequence number of the entry IDs, in ID order
+        columns : dict
+            Maps column names to arrays of shape (n, *shape)
+        fields : dict, optional
+            ``Field`` specs the columns were decoded with, recorded in the
+            index. By default None (raw binary values).
+        """
+        n = ids.shape[0]
+        if not n:
+            return
+        fields = fields or {}
+        columns = {
+            ID_COLUMNS[0]: ids[:, 0],
+            ID_COLUMNS[1]: ids[:, 1],
+            **columns,
+        }
+
+        for name, data in columns.items():
+            spec = self.index['columns'].get(name)
+            if spec is None:
+                spec = {
+                    'file': f'{name}.bin',
+                    'descr': np.lib.format.dtype_to_descr(data.dtype),
+                    'shape': list(data.shape[1:]),
+                }
+                if name not in ID_COLUMNS:
+                    field = fields.get(name)
+                    spec['kind'] = 'binary' if field is None else field.kind
+                    key = None if field is None else field.key
+                    spec['key'] = (key or name.encode()).decode()
+                self.index['columns'][name] = spec
+            elif tuple(spec['shape']) != data.shape[1:]:
+                raise ValueError(f'Column {name} changed shape from '
+                                 f'{tuple(spec["shape"])} to '
+                                 f'{data.shape[1:]}')
+            with open(os.path.join(self.path, spec['file']), 'ab') as f:
+                f.write(np.ascontiguousarray(data).data)
+
+        self.index['pages'].append(
+            [f'{ids[0, 0]}-{ids[0, 1]}', self.index['n_entries']])
+        self.index['n_entries'] += n
+        self.index['last_id'] = f'{ids[-1, 0]}-{ids[-1, 1]}'
+        self.write_index()
+
+    def write_index(self):
+        """
+        Atomically replace the JSON index
+        """
+        index_path = os.path.join(self.path, INDEX_FILE)
+        with open(index_path + '.tmp', 'w') as f:
+            json.dump(self.index, f)
+        os.replace(index_path + '.tmp', index_path)
+
+
+def export_stream(r,
+                  stream,
+                  path,
+                  fields=None,
+                  dtypes=None,
+                  exclude=(),
+                  count=10000,
+                  end='+'):
+    """
+    Export a stream to memory-mappable column files, one XRANGE page at a
+    time, so memory use does not depend on the length of the stream. If
+    ``path`` already holds an export of the stream, only the entries added
+    since are exported.
+
+    Parameters
+    ----------
+    r : redis.Redis
+        Redis connection
+    stream : str
+        Stream name
+    path : str
+        Output directory
+    fields : dict, optional
+        Maps column names to ``Field`` specs, by default inferred from the
+        first entry with ``infer_fields``
+    dtypes : dict, optional
+        Binary field types passed to ``infer_fields``, by default None
+    exclude : tuple of str, optional
+        Fields left out of the inferred ``fields``, by default ()
+    count : int, optional
+        Number of entries per XRANGE page, by default 10000
+    end : str, optional
+        Last entry ID to export, by default the last entry at the time of
+        the call
+
+    Returns
+    -------
+    n_entries : int
+        Number of entries exported by this call
+    """
+    exporter = StreamExporter(path, stream)
+    start = '-' if exporter.last_id is None else next_id(exporter.last_id)
+    if end == '+':
+        last = r.xrevrange(stream, count=1)
+        if not last:
+            return 0
+        end = last[0][0]
+
+    n_start = exporter.n_entries
+    if fields is None and exporter.n_entries:
+        fields = exporter.fields()
+    for page in xrange_pages(r, stream, start, end, count):
+        if fields is None:
+            fields = infer_fields(r, stream, page[0][1], dtypes)
+            for name in exclude:
+                fields.pop(name, None)
+        exporter.append(page, fields)
+    return exporter.n_entries - n_start
+
+
+def _locate(index, id_ms, id_seq, entry_id, side):
+    """
+    Row of ``entry_id`` (an int in ms, or an entry ID) in an export, as
+    ``np.searchsorted`` with ``side``
+    """
+    if isinstance(entry_id, (int, np.integer)):
+        # a time covers all the entries of that millisecond
+        ms = int(entry_id)
+        seq = 0 if side == 'left' else np.iinfo(np.uint64).max
+    else:
+        ms, seq = parse_id(entry_id)
+
+    # narrow the search to the pages around the entry
+    page_ids = [parse_id(page_id) for page_id, _ in index['pages']]
+    offsets = [offset for _, offset in index['pages']] + [index['n_entries']]
+    k = bisect.bisect_right(page_ids, (ms, 0)) - 1
+    lo = offsets[max(k, 0)]
+    hi = offsets[min(bisect.bisect_right(page_ids, (ms, seq)),
+                     len(offsets) - 1)]
+
+    a = lo + np.searchsorted(id_ms[lo:hi], ms, side='left')
+    b = lo + np.searchsorted(id_ms[lo:hi], ms, side='right')
+    return int(a + np.searchsorted(id_seq[a:b], seq, side=side))
+
+
+def open_export(path, columns=None, start=None, end=None):
+    """
+    Memory-map the columns of an export, without reading them
+
+    Parameters
+    ----------
+    path : str
+        Export directory
+    columns : list of str, optional
+        Columns to open, by default all
+    start, end : int or str, optional
+        Range of entries to open (inclusive), as entry IDs or times in ms
+        (the time part of entry IDs), by default all entries
+
+    Returns
+    -------
+    data : dict
+        Maps column names to read-only ``np.memmap`` arrays of shape
+        (n_entries, *shape)
+    """
+    with open(os.path.join(path, INDEX_FILE)) as f:
+        index = json.load(f)
+    n = index['n_entries']
+
+    def open_column(name):
+        spec = index['columns'][name]
+        if n == 0:
+            return np.empty((0, ) + tuple(spec['shape']),
+                            dtype=np.lib.format.descr_to_dtype(spec['descr']))
+        return np.memmap(os.path.join(path, spec['file']),
+                         dtype=np.lib.format.descr_to_dtype(spec['descr']),
+                         mode='r',
+                         shape=(n, ) + tuple(spec['shape']))
+
+    rows = slice(None)
+    if n and (start is not None or end is not None):
+        id_ms, id_seq = (open_column(name) for name in ID_COLUMNS)
+        a = 0 if start is None else _locate(index, id_ms, id_seq, start,
+                                            'left')
+        b = n if end is None else _locate(index, id_ms, id_seq, end, 'right')
+        rows = slice(a, max(a, b))
+
+    if columns is None:
+        columns = list(index['columns'])
+    return {name: open_column(name)[rows] for name in columns}
@@ -0,0 +1,322 @@
+import logging
+
+import numpy as np
+
+from brand_simulator.detection import ThresholdDetector
+from brand_simulator.noise import NoiseGenerator
+from brand_simulator.sampling import SAMPLERS
+from brand_simulator.synthesis import (AP_WAVEFORM, MultiUnitSynthesizer,
+                                       SparseSpikeSynthesizer,
+                                       StreamingConvolver, quantize)
+from brand_simulator.waveforms import WaveformBank
+
+
+class ContinuousGenerator:
+    """
+    Spike sampling and continuous data synthesis for one block of
+    continuous data per firing-rate sample, as done by ``spike_gen_30k``.
+    The node and the offline engine (``brand_simulator.offline``) share this
+    class, so the same parameters and seed give the same data in both.
+
+    Parameters
+    ----------
+    n_neurons : int
+        Number of channels (``n_end - n_start`` of the node)
+    n_ms : int
+        Number of milliseconds per block (process loops per firing-rate
+        sample)
+    ms_samples : int
+        Number of continuous samples per millisecond
+    seed : int
+        Random seed
+    scale : float
+        Action potential scale (mV to int16)
+    n_start : int, optional
+        First channel read from the firing-rate vector, by default 0
+    n_units : int, optional
+        Units per channel, by default 1
+    continuous_rate : float, optional
+        Continuous data rate (Hz), by default 30000
+    spike_sampler, synthesis, waveform_file, n_waveforms, waveform_dtype,
+    noise_rms, noise_type, noise_band, lfp_rms, noise_buffer_s,
+    threshold_source, threshold_mult, rms_window_s, glm_link,
+    refractory_period, history_amp, history_tau_ms, coupling_amp,
+    coupling_tau_ms : optional
+        As the ``spike_gen_30k`` parameters of the same name
+    """
+
+    def __init__(self,
+                 n_neurons,
+                 n_ms,
+                 ms_samples,
+                 seed,
+                 scale,
+                 n_start=0,
+                 n_units=1,
+                 continuous_rate=30000,
+                 spike_sampler='bernoulli',
+                 synthesis='sparse',
+                 waveform_file=None,
+                 n_waveforms=1,
+                 waveform_dtype='float32',
+                 noise_rms=0,
+                 noise_type='pink',
+                 noise_band=(1, 7500),
+                 lfp_rms=0,
+                 noise_buffer_s=2.0,
+                 threshold_source='spikes',
+                 threshold_mult=-4.5,
+                 rms_window_s=1.0,
+                 glm_link='exp',
+                 refractory_period=60,
+                 history_amp=(-4.0, -0.5),
+                 history_tau_ms=(1.0, 20.0),
+                 coupling_amp=0,
+                 coupling_tau_ms=5.0):
+        # with several units per channel, unit u of channel c reads its rate
+        # from input neuron (n_start + c) * n_units + u
+        if n_units > 1 and (spike_sampler == 'binomial'
+                            or synthesis != 'sparse'):
+            raise ValueError('units_per_channel > 1 requires a vectorized '
+                             'spike_sampler and sparse synthesis')
+
+        self.n_neurons = n_neurons
+        self.n_ms = n_ms
+        self.ms_samples = ms_samples
+        self.n_samples = n_ms * ms_samples
+        self.seed = seed
+        self.scale = scale
+        self.n_start = n_start
+        self.n_units = n_units
+        self.continuous_rate = continuous_rate
+        self.spike_sampler = spike_sampler
+        self.synthesis = synthesis
+        self.waveform_file = waveform_file
+        self.n_waveforms = n_waveforms
+        self.waveform_dtype = waveform_dtype
+        self.noise_rms = noise_rms
+        self.noise_type = noise_type
+        self.noise_band = noise_band
+        self.lfp_rms = lfp_rms
+        self.noise_buffer_s = noise_buffer_s
+        self.threshold_source = threshold_source
+        self.threshold_mult = threshold_mult
+        self.rms_window_s = rms_window_s
+        self.glm_link = glm_link
+        self.refractory_period = refractory_period
+        self.history_amp = history_amp
+        self.history_tau_ms = history_tau_ms
+        self.coupling_amp = coupling_amp
+        self.coupling_tau_ms = coupling_tau_ms
+
+        self.buffer30k_spikes = np.zeros((self.n_samples, n_neurons))
+        self.buffer30k_continuous = np.zeros((self.n_samples, n_neurons))
+        self.continuous = np.zeros((self.n_samples, n_neurons),
+                                   dtype=np.int16)
+        self.spike_counts = np.zeros((n_ms, n_neurons), dtype=np.int8)
+
+        self.noise = None
+        self.detector = None
+
+    @classmethod
+    def from_parameters(cls, parameters):
+        """
+        Create the generator of a ``spike_gen_30k`` node
+
+        Parameters
+        ----------
+        parameters : dict
+            Node parameters, as in the graph YAML. Optional parameters that
+            are missing take the node's defaults.
+
+        Returns
+        -------
+        generator : ContinuousGenerator
+        """
+        return cls(
+            parameters['n_end'] - parameters['n_start'],
+            int(parameters['sample_rate'] / parameters['fr_sample_rate']),
+            int(parameters['continuous_rate'] / parameters['sample_rate']),
+            parameters['random_seed'],
+            parameters['scale'],
+            n_start=parameters['n_start'],
+            n_units=parameters.get('units_per_channel', 1),
+            continuous_rate=parameters['continuous_rate'],
+            spike_sampler=parameters.get('spike_sampler', 'bernoulli'),
+            synthesis=parameters.get('synthesis', 'sparse'),
+            waveform_file=parameters.get('waveform_file'),
+            n_waveforms=parameters.get('n_waveforms', 1),
+            waveform_dtype=parameters.get('waveform_dtype', 'float32'),
+            noise_rms=parameters.get('noise_rms', 0),
+            noise_type=parameters.get('noise_type', 'pink'),
+            noise_band=parameters.get('noise_band', [1, 7500]),
+            lfp_rms=parameters.get('lfp_rms', 0),
+            noise_buffer_s=parameters.get('noise_buffer_s', 2.0),
+            threshold_source=parameters.get('threshold_source', 'spikes'),
+            threshold_mult=parameters.get('threshold_mult', -4.5),
+            rms_window_s=parameters.get('rms_window_s', 1.0),
+            glm_link=parameters.get('glm_link', 'exp'),
+            refractory_period=parameters.get('refractory_period', 60),
+            history_amp=parameters.get('history_amp', [-4.0, -0.5]),
+            history_tau_ms=parameters.get('history_tau_ms', [1.0, 20.0]),
+            coupling_amp=parameters.get('coupling_amp', 0),
+            coupling_tau_ms=parameters.get('coupling_tau_ms', 5.0))
+
+    def build(self):
+        """
+        Seed the random number generators and build the sampler, waveforms,
+        synthesizer, noise source and threshold detector
+        """
+        np.random.seed(self.seed)
+
+        # 'binomial' keeps the original np.random.binomial draws
+        if self.spike_sampler != 'binomial':
+            # the GLM's spike-history, refractory and coupling filters
+            options = {}
+            if self.spike_sampler == 'glm':
+                options = dict(link=self.glm_link,
+                               refractory_period=self.refractory_period,
+                               history_amp=self.history_amp,
+                               history_tau_ms=self.history_tau_ms,
+                               coupling_amp=self.coupling_amp,
+                               coupling_tau_ms=self.coupling_tau_ms)
+            self.sampler = SAMPLERS[self.spike_sampler](
+                self.n_samples, (self.n_neurons, ) if self.n_units == 1 else
+                (self.n_neurons, self.n_units),
+                self.continuous_rate,
+                seed=self.seed,
+                **options)
+
+        # AP waveform templates, shared by index across channels (or units)
+        n_sources = self.n_neurons * self.n_units
+        if self.waveform_file is not None:
+            self.waveforms = WaveformBank.from_file(self.waveform_file,
+                                                    n_sources,
+                                                    seed=self.seed,
+                                                    dtype=self.waveform_dtype,
+                                                    scale=self.scale)
+        elif self.n_waveforms > 1:
+            self.waveforms = WaveformBank.generate(
+                self.n_waveforms,
+                n_sources,
+                n_taps=AP_WAVEFORM.shape[0],
+                sample_rate=self.continuous_rate,
+                seed=self.seed,
+                dtype=self.waveform_dtype,
+                scale=self.scale)
+        else:
+            self.waveforms = WaveformBank.single(AP_WAVEFORM,
+                                                 n_sources,
+                                                 dtype=self.waveform_dtype,
+                                                 scale=self.scale)
+        logging.info(
+            f'Using {self.waveforms.n_templates} AP waveform template(s)')
+
+        # both synthesizers carry the AP tail across firing-rate blocks
+        if self.n_units > 1:
+            # per-unit amplitudes, so units on a channel are distinguishable
+            amplitudes = np.random.default_rng(self.seed).uniform(
+                0.5, 1.5, size=(self.n_neurons, self.n_units))
+            self.synthesizer = MultiUnitSynthesizer(self.waveforms,
+                                                    self.n_neurons,
+                                                    self.n_units,
+                                                    amplitudes=amplitudes)
+        elif self.synthesis == 'sparse':
+            self.synthesizer = SparseSpikeSynthesizer(self.waveforms,
+                                                      self.n_neurons)
+        else:
+            self.synthesizer = StreamingConvolver(self.waveforms,
+                                                  self.n_neurons)
+
+        # background noise, precomputed (refilled off the main loop once
+        # ``start`` is called)
+        if self.noise_rms > 0 or self.lfp_rms > 0:
+            self.noise = NoiseGenerator(
+                self.n_neurons,
+                self.noise_rms,
+                sample_rate=self.continuous_rate,
+                kind=self.noise_type,
+                band=self.noise_band,
+                lfp_rms=self.lfp_rms,
+                buffer_len=int(self.noise_buffer_s * self.continuous_rate),
+                seed=self.seed)
+            logging.info(f'Adding {self.noise_type} noise (RMS '
+                         f'{self.noise_rms}, LFP RMS {self.lfp_rms})')
+
+        # 'continuous' detects crossings in the published voltage, and keeps
+        # the ground-truth spike counts in a separate field
+        if self.threshold_source == 'continuous':
+            self.detector = ThresholdDetector(
+                self.n_neurons,
+                self.n_samples,
+                self.ms_samples,
+                thresh_mult=self.threshold_mult,
+                rms_window=int(self.rms_window_s * self.continuous_rate))
+            logging.info('Detecting threshold crossings at '
+                         f'{self.threshold_mult} x RMS')
+
+    def start(self):
+        """
+        Start the background noise refill thread. Without it, noise is
+        regenerated on the caller's thread, which gives the same noise.
+        """
+        if self.noise is not None:
+            self.noise.start()
+
+    def stop(self):
+        """
+        Stop the background noise refill thread, if started
+        """
+        if self.noise is not None:
+            self.noise.stop()
+
+    @property
+    def thresholds(self):
+        """
+        Threshold crossings per millisecond of the last block: detected in
+        the continuous data, or the ground-truth spike counts
+        """
+        if self.detector is not None:
+            return self.detector.counts
+        return self.spike_counts
+
+    def process(self, rates):
+        """
+        Generate one block of continuous data, into ``continuous`` and
+        ``spike_counts`` (and the detector's ``counts``)
+
+        Parameters
+        ----------
+        rates : float array
+            Full firing-rate vector (in Hz) of one input sample, from which
+            this generator's channels (or units) are read
+        """
+        if self.n_units > 1:
+            rates_sub = rates[self.n_start * self.n_units:(
+                self.n_start + self.n_neurons) * self.n_units].reshape(
+                    self.n_neurons, self.n_units)
+        else:
+            rates_sub = rates[self.n_start:self.n_start + self.n_neurons]
+
+        # generate spikes (rates scaled to spks/30khz-window)
+        if self.spike_sampler == 'binomial':
+            rate_rep = np.tile(rates_sub, (self.n_samples, 1))
+            spikes = np.random.binomial(1, rate_rep / self.continuous_rate)
+        else:
+            spikes = self.sampler.sample(rates_sub)
+        if self.n_units > 1:
+            # a channel crosses threshold when any of its units spikes
+            np.any(spikes, axis=2, out=self.buffer30k_spikes)
+        else:
+            self.buffer30k_spikes[:] = spikes
+        # generate continuous data, by convolving spikes with AP waveform,
+        # and scaling voltage
+        self.buffer30k_continuous[:] = self.synthesizer.process(spikes)
+        quantize(self.buffer30k_continuous, self.continuous)
+        if self.noise is not None:
+            self.noise.add(self.continuous)
+        if self.detector is not None:
+            self.detector.detect(self.continuous)
+        # ground-truth spike counts per 1ms bin
+        self.spike_counts[:] = self.buffer30k_spikes.reshape(
+            self.n_ms, self.ms_samples, self.n_neurons).sum(axis=1)
@@ -0,0 +1,248 @@
+import numpy as np
+
+LINKS = ('exp', 'softplus')
+
+
+class GLMSampler:
+    """
+    Draws spikes from a point-process GLM: the spike probability of each
+    channel in a sample is ``link(drive + history + coupling)``, where the
+    drive gives the input firing rate when the other terms are zero.
+
+    - history: per-channel spike-history filters, each a sum of exponential
+      kernels, applied as a recurrent state update (each state decays by a
+      fixed factor per sample and jumps by the kernel amplitude at each
+      spike) instead of a convolution over past spikes. Negative amplitudes
+      give relative refractoriness and adaptation, positive ones bursting.
+    - refractory: no spikes for ``refractory_period`` samples after a spike
+    - coupling: optional exponential filters of the spikes of the other
+      channels, with random weights
+
+    Without coupling, channels are independent and their history states
+    evolve in closed form between spikes, so a block is drawn a spike at a
+    time instead of a sample at a time: the probabilities of all remaining
+    samples and channels are computed at once, the first spike of each
+    channel is kept and only the channels that fired are advanced past it.
+    This takes one pass per spike of the busiest channel (a few per block)
+    over preallocated (n_samples, n_channels) buffers. With coupling, the
+    samples are advanced one at a time, vectorized over channels, with the
+    coupling input as one more exponential state. Both draw the same spikes
+    from the same uniform variates.
+
+    Parameters
+    ----------
+    n_samples : int
+        Number of samples generated per call
+    shape : tuple of int
+        Shape of the rate input, e.g. (n_channels,) or (n_channels, n_units)
+    sample_rate : float
+        Rate (in Hz) of the generated samples
+    seed : int, SeedSequence or Generator, optional
+        Seed for the random number generator, by default None
+    link : str, optional
+        'exp' or 'softplus', by default 'exp'
+    refractory_period : int, optional
+        Absolute refractory period (samples), by default 60 (2 ms at 30 kHz)
+    history_amp : sequence of float or array of shape (n_kernels, *shape)
+        Amplitude of each history kernel (in units of the link's input), for
+        all channels or per channel, by default (-4.0, -0.5)
+    history_tau_ms : sequence of float, optional
+        Time constant of each history kernel (ms), by default (1.0, 20.0)
+    coupling_amp : float, optional
+        Standard deviation of the coupling weights, scaled by
+        ``1 / sqrt(n_channels)``, by default 0 (no coupling). Coupling is
+        only between the channels of one sampler.
+    coupling_tau_ms : float, optional
+        Time constant of the coupling filters (ms), by default 5.0
+    """
+
+    def __init__(self,
+                 n_samples,
+                 shape,
+                 sample_rate,
+                 seed=None,
+                 link='exp',
+                 refractory_period=60,
+                 history_amp=(-4.0, -0.5),
+                 history_tau_ms=(1.0, 20.0),
+                 coupling_amp=0,
+                 coupling_tau_ms=5.0):
+        if link not in LINKS:
+            raise ValueError(f'Unknown link: {link}')
+        self.n_samples = n_samples
+        self.shape = tuple(shape)
+        self.sample_rate = sample_rate
+        self.link = link
+        self.refractory_period = refractory_period
+        self.rng = np.random.default_rng(seed)
+
+        n = int(np.prod(self.shape))
+
+        # history kernels, one row of states per kernel, and their decay
+        # over 0 to n_samples samples
+        tau = np.asarray(history_tau_ms, dtype=np.float64)[:, None]
+        self.n_kernels = tau.shape[0]
+        self.decay = np.exp(-1e3 / (tau * sample_rate))
+        self.powers = self.decay**np.arange(n_samples + 1)
+        self.history_amp = np.broadcast_to(
+            np.asarray(history_amp, dtype=np.float64).reshape(
+                self.n_kernels, -1), (self.n_kernels, n)).copy()
+        self.history = np.zeros((self.n_kernels, n))
+
+        # per channel: first sample that may spike (after the refractory
+        # period), carried across blocks
+        self.ready = np.zeros(n, dtype=np.intp)
+        self.t = np.arange(n_samples)[:, None]
+
+        self.coupling_weights = None
+        if coupling_amp:
+            w = self.rng.normal(scale=coupling_amp / np.sqrt(n), size=(n, n))
+            np.fill_diagonal(w, 0)
+            self.coupling_weights = w
+
+            # the coupling input is one more exponential state, after the
+            # history states, so that all decay and sum together
+            self.states = np.zeros((self.n_kernels + 1, n))
+            self.state_decay = np.vstack(
+                (self.decay, np.exp(-1e3 / (coupling_tau_ms * sample_rate))))
+            self.history = self.states[:self.n_kernels]
+            self.coupling = self.states[self.n_kernels]
+            self.u = np.zeros(n)
+            self.p = np.zeros(n)
+            self.allowed = np.zeros(n, dtype=bool)
+        else:
+            # per channel: sample of the history state
+            self.channels = np.arange(n)
+            self.t0 = np.zeros(n, dtype=np.intp)
+            self.lag = np.zeros((n_samples, n), dtype=np.intp)
+            self.u_block = np.zeros((n_samples, n))
+            self.kernel_block = np.zeros((n_samples, n))
+            self.allowed = np.zeros((n_samples, n), dtype=bool)
+            self.fired = np.zeros((n_samples, n), dtype=bool)
+
+        self.drive = np.zeros(n)
+        self.rate_p = np.zeros(n)
+        self.uniform = np.zeros((n_samples, n))
+
+        self.spikes = np.zeros((n_samples, ) + self.shape, dtype=bool)
+        self.spikes_flat = self.spikes.reshape(n_samples, n)
+
+    def apply_link(self, u, out):
+        """
+        Spike probability of the link's input ``u``
+        """
+        if self.link == 'exp':
+            return np.exp(u, out=out)
+        return np.logaddexp(u, 0, out=out)
+
+    def inverse_link(self, p, out):
+        """
+        Link input whose spike probability is ``p`` (-inf for 0)
+        """
+        with np.errstate(divide='ignore'):
+            if self.link == 'exp':
+                np.log(p, out=out)
+            else:
+                np.expm1(p, out=out)
+                np.log(out, out=out)
+        return out
+
+    def sample(self, rates):
+        """
+        Draw spikes for one block
+
+        Parameters
+        ----------
+        rates : array
+            Firing rates (in Hz), of shape ``shape``
+
+        Returns
+        -------
+        spikes : bool array of shape (n_samples, *shape)
+            Spike raster. This is the sampler's own buffer and is overwritten
+            by the next call.
+        """
+        np.divide(np.ravel(rates), self.sample_rate, out=self.rate_p)
+        np.maximum(self.rate_p, 0, out=self.rate_p)
+        self.inverse_link(self.rate_p, self.drive)
+        self.rng.random(out=self.uniform)
+
+        self.spikes.fill(False)
+        if self.coupling_weights is None:
+            self._sample_spikes()
+        else:
+            self._sample_steps()
+        return self.spikes
+
+    def _sample_spikes(self):
+        history, powers, T = self.history, self.powers, self.n_samples
+        t0, ready = self.t0, self.ready
+
+        # channels left to draw, initially all
+        t0.fill(0)
+        ch = self.channels
+        while ch.size:
+            m = ch.size
+            lag, u, kernel = self.lag[:, :m], self.u_block[:, :m], \
+                self.kernel_block[:, :m]
+            allowed, fired = self.allowed[:, :m], self.fired[:, :m]
+
+            # link input of every sample if the channel does not spike
+            # again, from the history state at sample t0 (lags before t0
+            # are clipped, those samples are not allowed)
+            np.subtract(self.t, t0[ch], out=lag)
+            u[:] = self.drive[ch]
+            for k in range(self.n_kernels):
+                np.take(powers[k], lag, out=kernel, mode='clip')
+                np.multiply(kernel, history[k, ch], out=kernel)
+                np.add(u, kernel, out=u)
+            self.apply_link(u, out=u)
+            np.greater_equal(self.t, ready[ch], out=allowed)
+            np.multiply(u, allowed, out=u)
+            if m == self.channels.size:
+                np.less(self.uniform, u, out=fired)
+            else:
+                np.take(self.uniform, ch, axis=1, out=kernel)
+                np.less(kernel, u, out=fired)
+
+            # keep the first spike of each channel, and draw the rest of the
+            # block again, for the channels that fired, from the state after
+            # it
+            first = fired.argmax(axis=0)
+            hit = fired[first, self.channels[:m]]
+            ch = ch[hit]
+            t_spike = first[hit]
+            self.spikes_flat[t_spike, ch] = True
+            history[:, ch] *= powers[:, t_spike + 1 - t0[ch]]
+            history[:, ch] += self.history_amp[:, ch]
+            t0[ch] = t_spike + 1
+            ready[ch] = t_spike + 1 + self.refractory_period
+
+        # carry the history states and the refractory periods over to the
+        # next block
+        history *= powers[:, T - t0]
+        ready -= T
+
+    def _sample_steps(self):
+        states, u, p, ready = self.states, self.u, self.p, self.ready
+        K = self.n_kernels
+        for t in range(self.n_samples):
+            # spike probability from the drive and the filtered past spikes
+            np.add(self.drive, states.sum(axis=0), out=u)
+            self.apply_link(u, out=p)
+
+            spikes = self.spikes_flat[t]
+            np.less(self.uniform[t], p, out=spikes)
+            np.less_equal(ready, t, out=self.allowed)
+            np.logical_and(spikes, self.allowed, out=spikes)
+
+            # recurrent updates of the filter states, with the kernels and
+            # weights of the channels that fired
+            np.multiply(states, self.state_decay, out=states)
+            if spikes.any():
+                ch = np.flatnonzero(spikes)
+                states[:K, ch] += self.history_amp[:, ch]
+                states[K] += self.coupling_weights[:, ch].sum(axis=1)
+                ready[ch] = t + 1 + self.refractory_period
+
+        ready -= self.n_samples
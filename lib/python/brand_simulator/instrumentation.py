@@ -0,0 +1,273 @@
+import time
+
+import numpy as np
+
+
+class LatencyHistogram:
+    """
+    HDR-style log-linear histogram of non-negative integer values (e.g.
+    durations in ns). Values below ``2**sub_bits`` are counted exactly;
+    above that, each power of two is split into ``2**(sub_bits - 1)``
+    buckets, which bounds the relative error of any percentile by
+    ``2**-(sub_bits - 1)``. Bucket ``(m << (sub_bits - 1)) + (v >> m)``
+    holds value ``v``, with ``m = max(0, v.bit_length() - sub_bits)``.
+
+    Parameters
+    ----------
+    sub_bits : int, optional
+        Number of bits of precision, by default 7 (< 1.6% error)
+    max_bits : int, optional
+        Values are clipped to ``2**max_bits - 1``, by default 36 (~68 s in
+        ns)
+    """
+
+    def __init__(self, sub_bits=7, max_bits=36):
+        self.sub_bits = sub_bits
+        self.max_value = 2**max_bits - 1
+        n_buckets = ((max_bits - sub_bits + 1) << (sub_bits - 1)) + 2**(sub_bits - 1)
+        self.counts = np.zeros(n_buckets, dtype=np.int64)
+
+        # lowest value held by each bucket
+        idx = np.arange(n_buckets, dtype=np.int64)
+        m = np.maximum(0, (idx >> (sub_bits - 1)) - 1)
+        self.lower = (idx - (m << (sub_bits - 1))) << m
+        self.upper = self.lower + (np.int64(1) << m) - 1
+
+    def reset(self):
+        """
+        Clear all counts
+        """
+        self.counts[:] = 0
+
+    def index(self, values):
+        """
+        Bucket index of each value
+
+        Parameters
+        ----------
+        values : int array
+            Values to bin
+
+        Returns
+        -------
+        idx : int64 array
+        """
+        v = np.clip(values, 0, self.max_value).astype(np.int64)
+        # frexp gives the bit length for the integers covered here (< 2**53)
+        m = np.maximum(0, np.frexp(v)[1] - self.sub_bits)
+        return (m << (self.sub_bits - 1)) + (v >> m)
+
+    def record(self, values):
+        """
+        Add values to the histogram
+
+        Parameters
+        ----------
+        values : int array
+            Values to add
+        """
+        self.counts += np.bincount(self.index(values),
+                                   minlength=self.counts.shape[0])
+
+    def percentiles(self, q):
+        """
+        Percentiles of the recorded values
+
+        Parameters
+        ----------
+        q : array of float
+            Percentiles, between 0 and 100
+
+        Returns
+        -------
+        values : int64 array
+            Upper bound of the bucket holding each percentile (0 if empty)
+        """
+        cumsum = np.cumsum(self.counts)
+        if cumsum[-1] == 0:
+            return np.zeros(len(q), dtype=np.int64)
+        idx = np.searchsorted(cumsum, np.asarray(q) / 100 * cumsum[-1])
+        return self.upper[np.minimum(idx, cumsum.shape[0] - 1)]
+
+
+class LoopRecorder:
+    """
+    Lightweight timing recorder for a node's main loop. Each iteration is
+    split in phases (e.g. read, compute, publish) marked with ``lap``. Phase
+    durations, the total loop time and deadline misses are written to
+    fixed-size ring buffers, which costs a few clock reads per iteration.
+
+    The first phase is usually a blocking read, so the deadline applies to
+    the rest of the iteration: the time from the end of the first phase to
+    the end of the iteration.
+
+    Every ``interval`` seconds, the iterations recorded since the previous
+    report are binned in a ``LatencyHistogram`` per phase and one entry is
+    added to the ``stream`` Redis stream, with the node name, the number of
+    iterations and deadline misses, and the p50/p99/p99.9/max of each
+    phase and of the total, in microseconds (e.g. ``read_p99``).
+
+    Parameters
+    ----------
+    r : redis.Redis
+        Redis connection
+    node : str
+        Node name, published with each summary
+    phases : tuple of str, optional
+        Names of the loop phases, by default ('read', 'compute', 'publish')
+    stream : str, optional
+        Stream the summaries are published to, by default 'latency_stats'.
+        None only keeps the ring buffers.
+    interval : float, optional
+        Time between summaries, in seconds, by default 1.0
+    deadline : float, optional
+        Time (s) after the first phase above which an iteration counts as a
+        deadline miss, by default None (no deadline)
+    capacity : int, optional
+        Length of the ring buffers, which should hold at least one
+        ``interval`` of iterations, by default 8192
+    maxlen : int, optional
+        Approximate maximum length of ``stream``, by default 10000
+    """
+
+    PERCENTILES = (50, 99, 99.9)
+    SUFFIXES = ('p50', 'p99', 'p999')
+
+    def __init__(self,
+                 r,
+                 node,
+                 phases=('read', 'compute', 'publish'),
+                 stream='latency_stats',
+                 interval=1.0,
+                 deadline=None,
+                 capacity=8192,
+                 maxlen=10000):
+        self.r = r
+        self.node = node
+        self.phases = tuple(phases) + ('total', )
+        self.n_phases = len(phases)
+        self.stream = stream
+        self.interval_ns = int(interval * 1e9)
+        self.deadline_ns = None if deadline is None else int(deadline * 1e9)
+        self.capacity = capacity
+        self.maxlen = maxlen
+
+        self.durations = np.zeros((capacity, self.n_phases + 1),
+                                  dtype=np.int64)
+        self.misses = np.zeros(capacity, dtype=bool)
+        self.pos = 0
+        self.n = 0
+        self.n_reported = 0
+        self.n_misses = 0
+
+        self.phase = 0
+        self.t_begin = 0
+        self.t_lap = 0
+        self.t_ready = 0
+        self.t_report = time.monotonic_ns()
+
+        self.histogram = LatencyHistogram()
+        self.summary = {'node': node}
+
+    def begin(self, t=None):
+        """
+        Start an iteration
+
+        Parameters
+        ----------
+        t : int, optional
+            Start time (``time.monotonic_ns()``), by default now
+        """
+        self.t_begin = self.t_lap = time.monotonic_ns() if t is None else t
+        self.t_ready = self.t_begin
+        self.phase = 0
+
+    def lap(self):
+        """
+        End the current phase. The iteration ends with its last phase.
+        """
+        t = time.monotonic_ns()
+        self.durations[self.pos, self.phase] = t - self.t_lap
+        self.t_lap = t
+        if self.phase == 0:
+            self.t_ready = t
+        self.phase += 1
+        if self.phase == self.n_phases:
+            self.end(t)
+
+    def end(self, t=None):
+        """
+        End the iteration, whether or not all phases were marked, and
+        publish a summary if one is due
+
+        Parameters
+        ----------
+        t : int, optional
+            End time (``time.monotonic_ns()``), by default now
+        """
+        if t is None:
+            t = time.monotonic_ns()
+        self.durations[self.pos, self.n_phases] = t - self.t_begin
+        missed = (self.deadline_ns is not None
+                  and t - self.t_ready > self.deadline_ns)
+        self.misses[self.pos] = missed
+        self.n_misses += missed
+
+        self.pos = (self.pos + 1) % self.capacity
+        self.n += 1
+        self.phase = 0
+
+        if t - self.t_report >= self.interval_ns:
+            self.report(t)
+
+    def window(self):
+        """
+        Rows of the ring buffers recorded since the last report
+
+        Returns
+        -------
+        durations : int64 array of shape (n, n_phases + 1)
+            Phase and total durations (ns), oldest first
+        misses : bool array of shape (n,)
+            Deadline misses
+        """
+        n = min(self.n - self.n_reported, self.capacity)
+        rows = np.arange(self.pos - n, self.pos) % self.capacity
+        return self.durations[rows], self.misses[rows]
+
+    def report(self, t=None):
+        """
+        Publish a summary of the iterations since the last report
+
+        Parameters
+        ----------
+        t : int, optional
+            Current time (``time.monotonic_ns()``), by default now
+
+        Returns
+        -------
+        summary : dict
+            The published fields
+        """
+        durations, misses = self.window()
+        self.summary['n'] = durations.shape[0]
+        self.summary['misses'] = int(misses.sum())
+        self.summary['total_misses'] = self.n_misses
+        for j, phase in enumerate(self.phases):
+            self.histogram.reset()
+            self.histogram.record(durations[:, j])
+            values = self.histogram.percentiles(self.PERCENTILES)
+            for suffix, value in zip(self.SUFFIXES, values):
+                self.summary[f'{phase}_{suffix}'] = value / 1e3
+            self.summary[f'{phase}_max'] = (durations[:, j].max() / 1e3
+                                            if durations.shape[0] else 0.0)
+
+        if self.stream is not None:
+            self.r.xadd(self.stream,
+                        self.summary,
+                        maxlen=self.maxlen,
+                        approximate=True)
+
+        self.n_reported = self.n
+        self.t_report = time.monotonic_ns() if t is None else t
+        return self.summary
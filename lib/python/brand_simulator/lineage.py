@@ -0,0 +1,156 @@
+import numpy as np
+
+from brand_simulator.alignment import match
+
+# fields forwarded by every node: index and CLOCK_MONOTONIC time (ns) of the
+# mouse_vel sample an entry derives from
+ORIGIN_FIELDS = ('origin_i', 'origin_ts')
+
+LATENCY_PERCENTILES = (50, 99, 99.9)
+
+
+def timespec_ns(data):
+    """
+    Time in ns of a C ``struct timespec``, as written by the C nodes
+
+    Parameters
+    ----------
+    data : bytes
+        Encoded timespec (2 little-endian int64)
+
+    Returns
+    -------
+    ns : int
+    """
+    sec, nsec = np.frombuffer(data, dtype='<i8', count=2)
+    return int(sec) * 1_000_000_000 + int(nsec)
+
+
+def read_origin(entry_dict, record=None):
+    """
+    Origin of an input entry, from its binary record or its fields
+
+    Parameters
+    ----------
+    entry_dict : dict
+        Input entry
+    record : structured array, optional
+        Decoded binary record(s) of the entry, by default None (legacy
+        fields)
+
+    Returns
+    -------
+    origin_i : int
+        Index of the originating mouse sample, -1 if the entry has no
+        origin (e.g. written by an older node)
+    origin_ts : int
+        Time of the originating mouse sample, in ns
+    """
+    if record is not None:
+        return int(record['origin_i'][0]), int(record['origin_ts'][0])
+    origin_i = entry_dict.get(b'origin_i')
+    if origin_i is None:
+        return -1, 0
+    return int(origin_i), int(entry_dict[b'origin_ts'])
+
+
+def follow_entries(columns, upstream, key='input_id', ids='id'):
+    """
+    Carry the origin of the upstream entries to the samples of a node that
+    records the ID of the entry it consumed (e.g. cb_generator)
+
+    Parameters
+    ----------
+    columns : dict
+        Columns of the downstream stream, with the consumed entry IDs in
+        ``key`` (keys from ``brand_simulator.streams.id_keys``)
+    upstream : dict
+        Columns of the upstream stream, with its entry IDs in ``ids`` and
+        the ``ORIGIN_FIELDS``
+    key, ids : str, optional
+        Names of the ID columns, by default 'input_id' and 'id'
+
+    Returns
+    -------
+    columns : dict
+        ``columns`` with the ``ORIGIN_FIELDS`` and the upstream 'ts' as
+        'ts_upstream' (-1 / NaN where the entry is not found)
+    """
+    rows = match(upstream[ids], columns[key])
+    found = rows >= 0
+    columns = dict(columns)
+    for name in ORIGIN_FIELDS:
+        columns[name] = np.where(found, upstream[name][rows], -1)
+    columns['ts_upstream'] = np.where(found, upstream['ts'][rows], np.nan)
+    return columns
+
+
+def hop_latencies(stages):
+    """
+    Latency of each hop of a graph, vectorized over all samples. Every
+    stage is matched to the previous one on 'origin_i', so the upstream
+    stage must hold one entry per origin (e.g. one firing_rates entry per
+    mouse sample), while the downstream stage may hold several. Stages
+    built with ``follow_entries`` are instead compared with the exact
+    upstream entry they consumed ('ts_upstream').
+
+    Parameters
+    ----------
+    stages : list of (str, dict)
+        Stage names and columns, from the source to the sink. Each stage
+        holds 'origin_i', 'origin_ts' and 'ts' (time of its output), in
+        seconds for the times. The first stage is the source itself (its
+        'ts' is its 'origin_ts').
+
+    Returns
+    -------
+    latencies : dict
+        Maps '<upstream>-><stage>' to the time from the upstream output to
+        each downstream output, and 'total' to the time from the origin to
+        each output of the last stage, in seconds
+    """
+    latencies = {}
+    for (up_name, up), (name, stage) in zip(stages[:-1], stages[1:]):
+        if 'ts_upstream' in stage:
+            latency = stage['ts'] - stage['ts_upstream']
+            latencies[f'{up_name}->{name}'] = latency[np.isfinite(latency)]
+            continue
+        rows = match(up['origin_i'], stage['origin_i'])
+        found = (rows >= 0) & (stage['origin_i'] >= 0)
+        latencies[f'{up_name}->{name}'] = (stage['ts'][found] -
+                                           up['ts'][rows[found]])
+
+    sink = stages[-1][1]
+    found = sink['origin_i'] >= 0
+    latencies['total'] = sink['ts'][found] - sink['origin_ts'][found]
+    return latencies
+
+
+def summarize(latencies, percentiles=LATENCY_PERCENTILES):
+    """
+    Percentiles of each latency distribution
+
+    Parameters
+    ----------
+    latencies : dict
+        Maps names to latencies in seconds, e.g. from ``hop_latencies``
+    percentiles : tuple of float, optional
+        Percentiles to compute, by default (50, 99, 99.9)
+
+    Returns
+    -------
+    summary : dict
+        Maps names to dicts with 'n', the percentiles (e.g. 'p99.9') and
+        'max', in microseconds
+    """
+    summary = {}
+    for name, values in latencies.items():
+        values = values[np.isfinite(values)]
+        stats = {'n': values.shape[0]}
+        if values.shape[0]:
+            for q, value in zip(percentiles, np.percentile(values,
+                                                           percentiles)):
+                stats[f'p{q:g}'] = value * 1e6
+            stats['max'] = values.max() * 1e6
+        summary[name] = stats
+    return summary
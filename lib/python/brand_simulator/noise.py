@@ -0,0 +1,261 @@
+import logging
+import threading
+
+import numpy as np
+import scipy.fft
+
+INT16_MIN = np.iinfo(np.int16).min
+INT16_MAX = np.iinfo(np.int16).max
+
+
+class NoiseGenerator:
+    """
+    Background noise source for continuous data. Noise is precomputed into
+    an int16 ring buffer split in two halves. Once the reader has consumed a
+    half, a background thread regenerates it, so noise synthesis never runs
+    on the caller's thread.
+
+    Each half is the start of a colored noise segment a little longer than
+    the half, whose first samples are crossfaded (with equal-power weights,
+    which keep the RMS) with the extra samples of the previous segment. The
+    noise is therefore continuous across halves and refills, with no step
+    at the half boundaries.
+
+    A refilled half is swapped into the ring under ``lock``, and the reader
+    copies from the ring under the same lock, so the reader never sees a
+    partly rewritten half. If the reader enters a half that has not been
+    refilled yet (an underrun, counted in ``underruns``), it reads the old
+    noise of that half to its end, and the new noise for it is dropped
+    (the next refill continues the segment before it).
+
+    Parameters
+    ----------
+    n_channels : int
+        Number of channels
+    rms : float
+        RMS of the per-channel noise, in output (int16) units
+    sample_rate : float, optional
+        Sample rate (Hz) of the continuous data, by default 30000
+    kind : str, optional
+        Spectrum of the per-channel noise: 'pink' (1/f), 'white' or
+        'bandlimited' (flat within ``band``), by default 'pink'
+    band : tuple of float, optional
+        Frequency band (Hz) of the noise, by default (1, 7500)
+    lfp_rms : float, optional
+        RMS of a 1/f local field potential component common to all
+        channels, by default 0 (disabled)
+    lfp_band : tuple of float, optional
+        Frequency band (Hz) of the common LFP component, by default (1, 300)
+    buffer_len : int, optional
+        Length of the ring buffer in samples, by default 2 s of data
+    seed : int, optional
+        Seed for the noise, by default None
+    """
+
+    def __init__(self,
+                 n_channels,
+                 rms,
+                 sample_rate=30000,
+                 kind='pink',
+                 band=(1, 7500),
+                 lfp_rms=0,
+                 lfp_band=(1, 300),
+                 buffer_len=None,
+                 seed=None):
+        self.n_channels = n_channels
+        self.rms = rms
+        self.sample_rate = sample_rate
+        self.kind = kind
+        self.band = band
+        self.lfp_rms = lfp_rms
+        self.lfp_band = lfp_band
+        self.rng = np.random.default_rng(seed)
+
+        if buffer_len is None:
+            buffer_len = 2 * sample_rate
+        self.half_len = buffer_len // 2
+        self.buffer_len = 2 * self.half_len
+
+        # segments overlap the next half by 1/8 of a half, crossfaded with
+        # sin/cos weights (the first output sample is the previous
+        # segment's)
+        self.overlap = self.half_len // 8
+        self.segment_len = self.half_len + self.overlap
+        phase = 0.5 * np.pi * np.arange(self.overlap) / self.overlap
+        self.fade_in = np.sin(phase)[:, None]
+        self.fade_out = np.cos(phase)[:, None]
+        self.tails = {}
+
+        # spectral shapes, normalized so the generated noise has unit RMS
+        freqs = scipy.fft.rfftfreq(self.segment_len, d=1 / sample_rate)
+        self.shape = self._spectral_shape(freqs, kind, band)
+        self.lfp_shape = self._spectral_shape(freqs, 'pink', lfp_band)
+
+        # the two halves of the ring, and a spare half that the refill
+        # thread fills before swapping it in
+        self.halves = [
+            np.zeros((self.half_len, n_channels), dtype=np.int16)
+            for _ in range(2)
+        ]
+        self.spare = np.zeros((self.half_len, n_channels), dtype=np.int16)
+        self.sum = None
+
+        self.read_pos = 0
+        self.underruns = 0
+        self.ready = [True, True]
+        self.generate(self.halves[0])
+        self.generate(self.halves[1])
+
+        self.refill = [threading.Event(), threading.Event()]
+        self.lock = threading.Lock()
+        self.running = False
+        self.thread = None
+
+    @staticmethod
+    def _spectral_shape(freqs, kind, band):
+        if kind == 'white':
+            shape = np.ones_like(freqs)
+        elif kind == 'pink':
+            shape = np.zeros_like(freqs)
+            in_band = (freqs >= band[0]) & (freqs <= band[1])
+            shape[in_band] = 1 / np.sqrt(freqs[in_band])
+        elif kind == 'bandlimited':
+            shape = ((freqs >= band[0]) & (freqs <= band[1])).astype(float)
+        else:
+            raise ValueError(f'Unknown noise kind: {kind}')
+
+        # Parseval: unit-variance white noise keeps unit variance
+        return shape / np.sqrt(np.mean(shape**2))
+
+    def _colored(self, name, shape, n_channels):
+        white = self.rng.standard_normal((self.segment_len, n_channels),
+                                         dtype=np.float32)
+        spectrum = scipy.fft.rfft(white, axis=0)
+        spectrum *= shape[:, None]
+        segment = scipy.fft.irfft(spectrum, n=self.segment_len, axis=0)
+
+        # continue from the end of the previous segment of this component
+        tail = self.tails.get(name)
+        if tail is not None:
+            segment[:self.overlap] *= self.fade_in
+            segment[:self.overlap] += self.fade_out * tail
+        self.tails[name] = segment[self.half_len:].copy()
+        return segment[:self.half_len]
+
+    def generate(self, out):
+        """
+        Generate the next half of the ring buffer, continuing the previous
+        one
+
+        Parameters
+        ----------
+        out : int16 array of shape (buffer_len // 2, n_channels)
+            Output array
+        """
+        noise = self._colored('noise', self.shape, self.n_channels)
+        noise *= self.rms
+        if self.lfp_rms > 0:
+            noise += self.lfp_rms * self._colored('lfp', self.lfp_shape, 1)
+        np.rint(noise, out=noise)
+        np.clip(noise, INT16_MIN, INT16_MAX, out=noise)
+        np.copyto(out, noise, casting='unsafe')
+
+    def start(self):
+        """
+        Start the background refill thread
+        """
+        self.running = True
+        self.thread = threading.Thread(target=self._refill_loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop the background refill thread
+        """
+        self.running = False
+        for event in self.refill:
+            event.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def _refill_loop(self):
+        half = 0
+        while self.running:
+            self.refill[half].wait()
+            if not self.running:
+                break
+            self.refill[half].clear()
+
+            tails = dict(self.tails)
+            self.generate(self.spare)
+            with self.lock:
+                # after an underrun the reader is in this half, reading its
+                # old noise: keep it, drop the new noise and its tails
+                if self.read_pos // self.half_len != half:
+                    self.halves[half], self.spare = self.spare, \
+                        self.halves[half]
+                else:
+                    self.tails = tails
+                self.ready[half] = True
+
+            half = 1 - half
+
+    def _advance(self, n_samples):
+        # called with the lock held
+        half_before = self.read_pos // self.half_len
+        self.read_pos = (self.read_pos + n_samples) % self.buffer_len
+        half_after = self.read_pos // self.half_len
+
+        if half_after == half_before:
+            return None
+
+        # the half we just left can be regenerated
+        self.ready[half_before] = False
+        if not self.ready[half_after]:
+            self.underruns += 1
+        return half_before
+
+    def add(self, block):
+        """
+        Add the next samples of noise to a block of data, in place,
+        saturating at the int16 range
+
+        Parameters
+        ----------
+        block : int16 array of shape (n_samples, n_channels)
+            Continuous data. ``n_samples`` must not exceed half of the
+            ring buffer.
+
+        Returns
+        -------
+        block : int16 array
+        """
+        n_samples = block.shape[0]
+        if self.sum is None or self.sum.shape[0] != n_samples:
+            self.sum = np.zeros((n_samples, self.n_channels), dtype=np.int32)
+
+        with self.lock:
+            half, offset = divmod(self.read_pos, self.half_len)
+            n_first = min(n_samples, self.half_len - offset)
+            np.add(block[:n_first],
+                   self.halves[half][offset:offset + n_first],
+                   out=self.sum[:n_first],
+                   dtype=np.int32)
+            if n_first < n_samples:
+                np.add(block[n_first:],
+                       self.halves[1 - half][:n_samples - n_first],
+                       out=self.sum[n_first:],
+                       dtype=np.int32)
+            left = self._advance(n_samples)
+
+        if left is not None:
+            if self.running:
+                self.refill[left].set()
+            else:
+                self.generate(self.halves[left])
+                self.ready[left] = True
+
+        np.clip(self.sum, INT16_MIN, INT16_MAX, out=self.sum)
+        np.copyto(block, self.sum, casting='unsafe')
+
+        return block
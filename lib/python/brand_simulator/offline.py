@@ -0,0 +1,431 @@
+import logging
+import os
+import time
+
+import numpy as np
+from scipy.signal import lfilter
+
+from brand_simulator.encoder import ENCODERS
+from brand_simulator.export import INDEX_FILE, StreamExporter, open_export
+from brand_simulator.sharding import ShardPool, make_generator
+
+# stream written by the firing-rate node
+RATES_STREAM = 'firing_rates'
+
+# firing-rate nodes, and the defaults they set on top of rate_encoder's
+RATE_NODES = {
+    'rate_encoder': {},
+    'sim2D': {},
+    'sim2D_uniform': {
+        'encoder_model': 'uniform',
+        'click_enabled': 0
+    },
+}
+
+# continuous data generator factories of the spike generator nodes
+GENERATORS = {
+    'spike_gen_30k': make_generator,
+    'spike_gen_30k_mp': ShardPool.from_parameters,
+}
+
+
+def synthetic_velocity(n_samples,
+                       max_v=25.0,
+                       sample_rate=200,
+                       tau=0.5,
+                       click_rate=0.2,
+                       click_len=0.1,
+                       seed=0):
+    """
+    Smooth random mouse velocities, in the format of the 'samples' field of
+    the mouse_vel stream. Each velocity component is an Ornstein-Uhlenbeck
+    process with a standard deviation of ``max_v / 2``.
+
+    Parameters
+    ----------
+    n_samples : int
+        Number of samples
+    max_v : float, optional
+        Velocity normalization of rate_encoder, by default 25.0
+    sample_rate : float, optional
+        Sample rate (Hz) of the trace, by default 200
+    tau : float, optional
+        Time constant (s) of the velocity, by default 0.5
+    click_rate : float, optional
+        Rate (Hz) of mouse clicks, by default 0.2
+    click_len : float, optional
+        Duration (s) of each click, by default 0.1
+    seed : int, optional
+        Random seed, by default 0
+
+    Returns
+    -------
+    samples : int16 array of shape (n_samples, 3)
+        x and y velocity, and click state
+    """
+    rng = np.random.default_rng(seed)
+    a = np.exp(-1 / (tau * sample_rate))
+    noise = rng.standard_normal((n_samples, 2)) * (max_v / 2) * np.sqrt(1 -
+                                                                       a**2)
+    velocity = lfilter([1.0], [1.0, -a], noise, axis=0)
+
+    onsets = rng.random(n_samples) < click_rate / sample_rate
+    n_click = max(1, int(click_len * sample_rate))
+    click = np.convolve(onsets, np.ones(n_click))[:n_samples] > 0
+
+    samples = np.empty((n_samples, 3), dtype=np.int16)
+    samples[:, :2] = np.clip(np.rint(velocity),
+                             np.iinfo(np.int16).min + 1,
+                             np.iinfo(np.int16).max)
+    samples[:, 2] = click
+    return samples
+
+
+def load_velocity(path, first_index=None):
+    """
+    Load a recorded velocity trace
+
+    Parameters
+    ----------
+    path : str
+        .npy file of shape (n_samples, 2) or (n_samples, 3) (x and y
+        velocity, and optionally the click state), or an export of the
+        mouse_vel stream (see ``brand_simulator.export``)
+    first_index : int, optional
+        Index of the first sample to load, e.g. the first mouse sample read
+        by a live graph, by default the start of the trace
+
+    Returns
+    -------
+    index : int64 array of shape (n_samples, )
+        Mouse sample indices (the 'index' field of mouse_vel, or the row in
+        a .npy file)
+    samples : int16 array of shape (n_samples, 3)
+        x and y velocity, and click state
+    """
+    if os.path.exists(os.path.join(path, INDEX_FILE)):
+        data = open_export(path, ['index', 'samples'])
+        index = np.asarray(data['index']).reshape(-1)
+        samples = np.asarray(data['samples'])
+        samples = samples.reshape(samples.shape[0], -1)
+    else:
+        samples = np.load(path)
+        index = np.arange(samples.shape[0])
+
+    if samples.shape[1] == 2:
+        samples = np.concatenate(
+            (samples, np.zeros((samples.shape[0], 1), dtype=samples.dtype)),
+            axis=1)
+    if first_index is not None:
+        k = np.searchsorted(index, first_index)
+        index, samples = index[k:], samples[k:]
+    return index.astype(np.int64), samples[:, :3].astype(np.int16)
+
+
+class OfflineSimulator:
+    """
+    Runs a simulator graph in process, as fast as the CPU allows: the firing
+    rates of the ``rate_encoder`` (or ``sim2D``) node, then the spikes and
+    continuous data of each ``spike_gen_30k`` or ``spike_gen_30k_mp`` node,
+    from a velocity trace instead of the mouse, and without Redis or
+    wall-clock pacing. The tuning, seeds and generators are those of the
+    live nodes (the nodes use the same encoder, ``ContinuousGenerator``,
+    ``ShardThreads`` and ``ShardPool``), so the output can be compared with
+    an export of a live run.
+
+    Stages are chained generators over chunks of input samples::
+
+        chunks -> rate_stage -> spike_stage -> write_stage
+
+    The output is one export directory per stream (see
+    ``brand_simulator.export``), laid out as the exports of the live per-ms
+    streams. Entry IDs are simulated times in ms.
+
+    The 'subspace' encoding model needs the task streams, so it cannot be
+    simulated offline.
+
+    The 'binomial' spike sampler draws from NumPy's global generator, so it
+    only reproduces the live nodes when a single ``spike_gen_30k`` node is
+    simulated.
+
+    Parameters
+    ----------
+    n_neurons : int
+        Number of simulated neurons (rate_encoder)
+    max_v : float
+        Max. mouse velocity for normalization (rate_encoder)
+    generators : dict
+        Maps output stream names to the ``ContinuousGenerator`` (or
+        ``ShardThreads``, ``ShardPool``) of each spike generator node
+    sample_rate : float, optional
+        Sample rate (Hz) of the velocity trace, by default 200
+    seed : int, optional
+        Seed of the firing-rate tuning, by default 42 (as the
+        ``encoder_seed`` of the node)
+    encoder_model : str, optional
+        Encoding model (see ``ENCODERS``), by default 'cosine'
+    click_enabled : bool, optional
+        Add the click tuning term, by default True
+    rate_parameters : dict, optional
+        Other parameters of the encoding model (e.g. ``mod_amp``), by
+        default None
+    """
+
+    def __init__(self,
+                 n_neurons,
+                 max_v,
+                 generators,
+                 sample_rate=200,
+                 seed=42,
+                 encoder_model='cosine',
+                 click_enabled=True,
+                 rate_parameters=None):
+        if encoder_model not in ENCODERS:
+            raise ValueError(f'Unknown encoder_model: {encoder_model}')
+
+        self.n_neurons = n_neurons
+        self.max_v = max_v
+        self.max_v_mag = np.sqrt(2) * self.max_v
+        self.generators = generators
+        self.sample_rate = sample_rate
+        self.period_ms = int(1000 / sample_rate)
+        self.seed = seed
+        self.encoder_model = encoder_model
+        self.click_enabled = click_enabled
+        self.rate_parameters = rate_parameters or {}
+
+    @classmethod
+    def from_graph(cls, graph, streams=None):
+        """
+        Create the simulator of a graph
+
+        Parameters
+        ----------
+        graph : dict
+            Graph, as loaded from its YAML file. It must have a
+            ``rate_encoder``, ``sim2D`` or ``sim2D_uniform`` node.
+        streams : list of str, optional
+            Output streams of the spike generator nodes to simulate, by
+            default all
+
+        Returns
+        -------
+        simulator : OfflineSimulator
+        """
+        nodes = {node['name']: node for node in graph['nodes']}
+        rate_nodes = [name for name in RATE_NODES if name in nodes]
+        if not rate_nodes:
+            raise ValueError('The graph has no firing-rate node')
+        sim = {
+            **RATE_NODES[rate_nodes[0]],
+            **nodes[rate_nodes[0]]['parameters']
+        }
+        sample_rate = nodes.get('mouseAdapter', {}).get('parameters',
+                                                        {}).get(
+                                                            'sample_rate', 200)
+
+        generators = {}
+        for node in graph['nodes']:
+            if node['name'] not in GENERATORS:
+                continue
+            parameters = node['parameters']
+            stream = parameters['output_stream']
+            if streams is None or stream in streams:
+                generators[stream] = GENERATORS[node['name']](parameters)
+        return cls(sim['n_neurons'],
+                   sim['max_v'],
+                   generators,
+                   sample_rate=sample_rate,
+                   seed=sim.get('encoder_seed', 42),
+                   encoder_model=sim.get('encoder_model', 'cosine'),
+                   click_enabled=sim.get('click_enabled', 1),
+                   rate_parameters=sim)
+
+    def build(self, max_batch=1000):
+        """
+        Draw the firing-rate tuning and build the generators
+
+        Parameters
+        ----------
+        max_batch : int, optional
+            Max. number of input samples per chunk, by default 1000
+        """
+        parameters = dict(self.rate_parameters,
+                          n_neurons=self.n_neurons,
+                          encoder_seed=self.seed,
+                          count_allocs=False,
+                          max_batch=max_batch)
+        self.encoder = ENCODERS[self.encoder_model].from_parameters(
+            parameters)
+        if self.encoder.n_dims != 2:
+            raise ValueError(f'The {self.encoder_model} model cannot be '
+                             'simulated offline')
+        self.encoder.build()
+        for generator in self.generators.values():
+            generator.build()
+
+    def chunks(self, index, samples, chunk):
+        """
+        Split a velocity trace into chunks of ``chunk`` samples
+
+        Yields
+        ------
+        index : int64 array of shape (k, )
+        samples : int16 array of shape (k, 3)
+        """
+        for start in range(0, samples.shape[0], chunk):
+            yield index[start:start + chunk], samples[start:start + chunk]
+
+    def rate_stage(self, chunks):
+        """
+        Compute the firing rates of each chunk of velocity samples, with the
+        same operations and types as ``RateLoop.encode``, for all samples of
+        the chunk at once
+
+        Yields
+        ------
+        index : int64 array of shape (k, )
+        rates : float32 array of shape (k, n_neurons)
+            Firing rates, as published by the firing-rate node
+        """
+        enc = self.encoder
+        mouse = np.empty((2, enc.max_batch), dtype=np.float32)
+        for index, samples in chunks:
+            k = samples.shape[0]
+            mouse[0, :k] = samples[:, 0]
+            mouse[1, :k] = -samples[:, 1]
+            states = enc.states[:, :k]
+            np.clip(mouse[:, :k], -self.max_v, self.max_v, out=states)
+            np.divide(states, self.max_v_mag, out=states)
+            enc.clicks[:k] = samples[:, 2]
+
+            rates = enc.encode(states,
+                               enc.clicks[:k],
+                               click_enabled=self.click_enabled)
+            yield index, rates.T.copy()
+
+    def spike_stage(self, chunks):
+        """
+        Generate the continuous data of every spike generator node, one
+        block per firing-rate sample
+
+        Yields
+        ------
+        index : int64 array of shape (k, )
+        rates : float32 array of shape (k, n_neurons)
+        blocks : dict
+            Maps output streams to their 'continuous' (one row of
+            ``ms_samples * n_channels`` int16 per ms), 'thresholds' and, when
+            detecting crossings, 'spike_counts' (one row of int8 per ms)
+        """
+        for index, rates in chunks:
+            k = rates.shape[0]
+            blocks = {}
+            for stream, generator in self.generators.items():
+                n_ms = generator.n_ms
+                continuous = np.empty(
+                    (k * n_ms, generator.ms_samples * generator.n_neurons),
+                    dtype=np.int16)
+                thresholds = np.empty((k * n_ms, generator.n_neurons),
+                                      dtype=np.int8)
+                spike_counts = (np.empty_like(thresholds)
+                                if generator.threshold_source == 'continuous'
+                                else None)
+                for j in range(k):
+                    generator.process(rates[j])
+                    rows = slice(j * n_ms, (j + 1) * n_ms)
+                    continuous[rows] = generator.continuous.reshape(n_ms, -1)
+                    thresholds[rows] = generator.thresholds
+                    if spike_counts is not None:
+                        spike_counts[rows] = generator.spike_counts
+                blocks[stream] = {
+                    'continuous': continuous,
+                    'thresholds': thresholds,
+                }
+                if spike_counts is not None:
+                    blocks[stream]['spike_counts'] = spike_counts
+            yield index, rates, blocks
+
+    def write_stage(self, chunks, path):
+        """
+        Append each chunk to the exports in ``path``
+
+        Yields
+        ------
+        n_samples : int
+            Number of input samples written so far
+        """
+        exporters = {
+            stream: StreamExporter(os.path.join(path, stream), stream)
+            for stream in [RATES_STREAM, *self.generators]
+        }
+        i = 0
+        for index, rates, blocks in chunks:
+            k = index.shape[0]
+            i_rates = np.arange(i, i + k, dtype=np.uint64)
+            exporters[RATES_STREAM].append_columns(
+                self._ids(i_rates * np.uint64(self.period_ms)), {
+                    'i': i_rates.astype(np.uint32),
+                    'i_in': index,
+                    'rates': rates,
+                })
+            for stream, columns in blocks.items():
+                n_ms = self.generators[stream].n_ms
+                i_ms = np.arange(i * n_ms, (i + k) * n_ms, dtype=np.uint64)
+                exporters[stream].append_columns(
+                    self._ids(i_ms), {
+                        'i': i_ms.astype(np.int64),
+                        'i_in': np.repeat(index, n_ms),
+                        **columns,
+                    })
+            i += k
+            yield i
+
+    @staticmethod
+    def _ids(ms):
+        ids = np.zeros((ms.shape[0], 2), dtype=np.uint64)
+        ids[:, 0] = ms
+        return ids
+
+    def run(self, index, samples, path, chunk=1000):
+        """
+        Simulate a velocity trace and write all streams to ``path``
+
+        Parameters
+        ----------
+        index : int array of shape (n_samples, )
+            Mouse sample indices
+        samples : int16 array of shape (n_samples, 3)
+            Velocity trace (e.g. from ``load_velocity`` or
+            ``synthetic_velocity``)
+        path : str
+            Output directory, which must not hold an export of these streams
+        chunk : int, optional
+            Number of input samples processed and written at once, by
+            default 1000
+
+        Returns
+        -------
+        n_samples : int
+            Number of input samples simulated
+        """
+        for stream in [RATES_STREAM, *self.generators]:
+            if os.path.exists(os.path.join(path, stream, INDEX_FILE)):
+                raise ValueError(f'{os.path.join(path, stream)} already '
+                                 'holds an export')
+        self.build(max_batch=chunk)
+
+        t0 = time.perf_counter()
+        n = 0
+        stages = self.write_stage(
+            self.spike_stage(self.rate_stage(self.chunks(index, samples,
+                                                         chunk))), path)
+        try:
+            for n in stages:
+                elapsed = time.perf_counter() - t0
+                logging.info(f'{n / self.sample_rate:.1f} s simulated in '
+                             f'{elapsed:.1f} s')
+        finally:
+            for generator in self.generators.values():
+                generator.stop()
+        return n
@@ -0,0 +1,165 @@
+import ctypes
+import ctypes.util
+import time
+
+import numpy as np
+
+TIMER_ABSTIME = 1
+
+
+class _timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+def _load_clock_nanosleep():
+    """
+    Returns a function that sleeps until an absolute CLOCK_MONOTONIC time
+    (in ns) with libc's clock_nanosleep, or None if libc does not provide it
+    """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        clock_nanosleep = libc.clock_nanosleep
+    except (OSError, AttributeError, TypeError):
+        return None
+    clock_nanosleep.argtypes = [
+        ctypes.c_int, ctypes.c_int,
+        ctypes.POINTER(_timespec),
+        ctypes.POINTER(_timespec)
+    ]
+    clock_nanosleep.restype = ctypes.c_int
+    ts = _timespec()
+    ts_ref = ctypes.byref(ts)
+
+    def sleep_until(deadline_ns):
+        ts.tv_sec, ts.tv_nsec = divmod(deadline_ns, 1_000_000_000)
+        # ctypes releases the GIL; an EINTR return is covered by the spin
+        clock_nanosleep(time.CLOCK_MONOTONIC, TIMER_ABSTIME, ts_ref, None)
+
+    return sleep_until
+
+
+_sleep_until = _load_clock_nanosleep()
+
+
+class DeadlineScheduler:
+    """
+    Paces a loop on a fixed grid of absolute monotonic deadlines. Deadline k
+    is ``t0 + k * period``, so timing errors never accumulate: a late
+    iteration is released immediately and the following ones stay on the
+    grid, which catches up. The thread sleeps with an absolute
+    clock_nanosleep until ``spin`` before the deadline, then spins for the
+    final stretch. If the loop falls more than ``resync`` periods behind
+    (e.g. the input stalled), the grid is re-anchored at the current time
+    instead of bursting through the missed deadlines.
+
+    Lateness (time between a deadline and the release) is accumulated in a
+    histogram with power-of-two microsecond buckets: bucket 0 counts
+    lateness under 1 us and bucket b counts [2**(b-1), 2**b) us.
+
+    Parameters
+    ----------
+    period : float
+        Period of the deadlines, in seconds
+    spin : float, optional
+        Length of the final busy-wait, in seconds, by default 50e-6
+    resync : int, optional
+        Number of periods behind schedule after which the grid is
+        re-anchored, by default 10. None disables re-anchoring.
+    n_buckets : int, optional
+        Number of lateness histogram buckets, by default 24 (up to ~8 s)
+    """
+
+    def __init__(self, period, spin=50e-6, resync=10, n_buckets=24):
+        self.period_ns = int(round(period * 1e9))
+        self.spin_ns = int(spin * 1e9)
+        self.resync_ns = None if resync is None else resync * self.period_ns
+        self.n_buckets = n_buckets
+
+        self.t0 = None
+        self.k = 0
+        self.histogram = np.zeros(n_buckets, dtype=np.int64)
+        self.n_resyncs = 0
+        self.max_lateness_ns = 0
+
+    def start(self, t0=None):
+        """
+        Anchor the grid, so that the next deadline is ``t0``
+
+        Parameters
+        ----------
+        t0 : int, optional
+            Time of the first deadline (``time.monotonic_ns()``), by
+            default now
+        """
+        self.t0 = time.monotonic_ns() if t0 is None else t0
+        self.k = 0
+
+    def wait(self):
+        """
+        Wait for the next deadline. The grid is anchored at the first call
+        if ``start`` was not called.
+
+        Returns
+        -------
+        lateness : int
+            Time (ns) between the deadline and the release
+        """
+        if self.t0 is None:
+            self.start()
+
+        deadline = self.t0 + self.k * self.period_ns
+        now = time.monotonic_ns()
+        if self.resync_ns is not None and now - deadline > self.resync_ns:
+            # too far behind to catch up, restart the grid here
+            self.t0 = now - self.k * self.period_ns
+            deadline = now
+            self.n_resyncs += 1
+
+        if deadline - now > self.spin_ns and _sleep_until is not None:
+            _sleep_until(deadline - self.spin_ns)
+        elif deadline - now > self.spin_ns:
+            time.sleep((deadline - now - self.spin_ns) / 1e9)
+        while time.monotonic_ns() < deadline:
+            pass
+
+        lateness = time.monotonic_ns() - deadline
+        self.k += 1
+        self.histogram[min((lateness // 1000).bit_length(),
+                           self.n_buckets - 1)] += 1
+        if lateness > self.max_lateness_ns:
+            self.max_lateness_ns = lateness
+        return lateness
+
+    def percentile(self, q):
+        """
+        Upper bound of the lateness percentile ``q``, from the histogram
+
+        Parameters
+        ----------
+        q : float
+            Percentile, between 0 and 100
+
+        Returns
+        -------
+        lateness : float
+            Upper edge (us) of the histogram bucket holding the percentile
+        """
+        n = self.histogram.sum()
+        if n == 0:
+            return 0.0
+        b = np.searchsorted(np.cumsum(self.histogram), q / 100 * n)
+        return float(2**b)
+
+    def summary(self):
+        """
+        Summary of the lateness so far, for logging
+
+        Returns
+        -------
+        summary : str
+        """
+        return (f'{self.histogram.sum()} deadlines, '
+                f'p50 < {self.percentile(50):.0f} us, '
+                f'p99 < {self.percentile(99):.0f} us, '
+                f'max {self.max_lateness_ns / 1e3:.1f} us, '
+                f'{self.n_resyncs} resyncs')
@@ -0,0 +1,175 @@
+import time
+
+import numpy as np
+
+from brand_simulator.schema import HEADER_NAMES, RECORD_FIELD
+
+PUBLISH_MODES = ('per_ms', 'pipeline', 'packed')
+
+
+class BlockPublisher:
+    """
+    Publishes a block of ``n_ms`` milliseconds of data to a Redis stream.
+    Data fields are registered once as preallocated arrays and sent through
+    memoryviews, so nothing is copied or re-serialized per entry.
+
+    Modes:
+
+    - 'per_ms': one XADD per millisecond (one round trip each)
+    - 'pipeline': one XADD per millisecond, sent as a single MULTI/EXEC
+      transaction, so readers never see a partial block
+    - 'packed': a single entry holding the whole block, with ``n_ms`` and
+      ``ms_offsets`` (uint32 byte offset of each millisecond in
+      'continuous')
+
+    Parameters
+    ----------
+    r : redis.Redis
+        Redis connection
+    stream : str
+        Output stream
+    n_ms : int
+        Number of milliseconds per block
+    fields : dict
+        Data fields, mapping name to an array whose first dimension is a
+        multiple of ``n_ms``. Arrays must be C-contiguous and are read at
+        every ``publish`` call.
+    mode : str, optional
+        One of 'per_ms', 'pipeline' or 'packed', by default 'per_ms'
+    maxlen : int, optional
+        Approximate maximum length of the stream, by default None
+    scheduler : DeadlineScheduler, optional
+        If given, each write waits for the scheduler's next deadline (one
+        per millisecond in 'per_ms' mode, one per block otherwise), by
+        default None
+    records : structured array, optional
+        ``n_ms`` binary records (see ``brand_simulator.schema``). If given,
+        entries use the binary format: header values are copied from
+        ``sample`` into the records before each write, which are sent in
+        the 'rec' field next to ``fields``. Timestamps are then in ns. By
+        default None (one field per header value, float timestamps in s).
+    """
+
+    def __init__(self,
+                 r,
+                 stream,
+                 n_ms,
+                 fields,
+                 mode='per_ms',
+                 maxlen=None,
+                 scheduler=None,
+                 records=None):
+        if mode not in PUBLISH_MODES:
+            raise ValueError(f'Unknown publish mode: {mode}')
+
+        self.r = r
+        self.stream = stream
+        self.n_ms = n_ms
+        self.mode = mode
+        self.maxlen = maxlen
+        self.scheduler = scheduler
+        self.records = records
+
+        if records is not None:
+            # the records are sent as bytes, one row per millisecond
+            fields = {RECORD_FIELD.decode(): records.view(np.uint8), **fields}
+            self.clock = time.monotonic_ns
+            self.entry = {}
+        else:
+            self.clock = time.monotonic
+            self.entry = None
+        self.fields = fields
+        self.block_views = {}
+        self.ms_views = {}
+        for name, data in fields.items():
+            if not data.flags['C_CONTIGUOUS'] or data.shape[0] % n_ms:
+                raise ValueError(f'Field {name} must be C-contiguous with a '
+                                 f'multiple of {n_ms} rows')
+            self.block_views[name] = memoryview(data).cast('B')
+            rows = data.reshape(n_ms, -1)
+            self.ms_views[name] = [memoryview(row).cast('B') for row in rows]
+
+        # byte offset of each millisecond, for readers of packed entries
+        if 'continuous' in fields:
+            ms_bytes = fields['continuous'].nbytes // n_ms
+        else:
+            ms_bytes = 0
+        self.ms_offsets = (np.arange(n_ms, dtype=np.uint32) *
+                           ms_bytes).tobytes()
+
+        if mode == 'pipeline':
+            self.pipe = self.r.pipeline(transaction=True)
+
+    def publish(self, sample):
+        """
+        Publish one block
+
+        Parameters
+        ----------
+        sample : dict
+            Entry header, with at least 'i', 'ts' and 'ts_end'. 'i' is the
+            index of the first millisecond in the block and is advanced by
+            ``n_ms``; 'ts' and 'ts_end' are set to the time before and after
+            each write. In the default format, data fields are added to this
+            dict and it is sent as the entry.
+        """
+        # binary entries only carry the records and data fields
+        entry = sample if self.entry is None else self.entry
+
+        if self.mode == 'packed':
+            entry['n_ms'] = self.n_ms
+            entry['ms_offsets'] = self.ms_offsets
+            entry.update(self.block_views)
+            if self.scheduler is not None:
+                self.scheduler.wait()
+            sample['ts'] = self.clock()
+            if self.records is not None:
+                self.stamp(sample, slice(None))
+                self.records['i'] += np.arange(self.n_ms, dtype=np.uint64)
+            self.r.xadd(self.stream,
+                        entry,
+                        maxlen=self.maxlen,
+                        approximate=True)
+            sample['ts_end'] = self.clock()
+            sample['i'] += self.n_ms
+
+        elif self.mode == 'pipeline':
+            if self.scheduler is not None:
+                self.scheduler.wait()
+            sample['ts'] = self.clock()
+            for s in range(self.n_ms):
+                for name, views in self.ms_views.items():
+                    entry[name] = views[s]
+                if self.records is not None:
+                    self.stamp(sample, s)
+                self.pipe.xadd(self.stream,
+                               entry,
+                               maxlen=self.maxlen,
+                               approximate=True)
+                sample['i'] += 1
+            self.pipe.execute()
+            sample['ts_end'] = self.clock()
+
+        else:
+            for s in range(self.n_ms):
+                for name, views in self.ms_views.items():
+                    entry[name] = views[s]
+                if self.scheduler is not None:
+                    self.scheduler.wait()
+                sample['ts'] = self.clock()
+                if self.records is not None:
+                    self.stamp(sample, s)
+                self.r.xadd(self.stream,
+                            entry,
+                            maxlen=self.maxlen,
+                            approximate=True)
+                sample['ts_end'] = self.clock()
+                sample['i'] += 1
+
+    def stamp(self, sample, s):
+        """
+        Copy the header values in ``sample`` to the binary record(s) ``s``
+        """
+        for name in HEADER_NAMES:
+            if name in sample:
+                self.records[name][s] = sample[name]
@@ -0,0 +1,546 @@
+import logging
+import time
+import tracemalloc
+
+import numpy as np
+
+from brand_simulator.aio import OverlappedIO
+from brand_simulator.dynamics import LinearDynamics
+from brand_simulator.encoder import ENCODERS, SubspaceEncoder
+from brand_simulator.instrumentation import LoopRecorder
+from brand_simulator.lineage import timespec_ns
+from brand_simulator.schema import (FLAG_CLICK, FLAG_MOVING, RECORD_FIELD,
+                                    new_records, publish_schema,
+                                    record_dtype)
+from brand_simulator.sidestreams import LatestEntries
+
+
+class ReachTask:
+    """
+    Task state behind the preparatory subspace of the 'subspace' encoding
+    model (formerly ``sim2D_prep``). Preparatory activity is turned on
+    (``t_t``) while a target is shown and the cursor is not moving yet, and
+    follows
+
+        tau dp/dt = J_prep p + t_t u
+
+    with u the reach vector (target - cursor position when the target
+    changed), embedded in the preparatory subspace. The target and cursor
+    are the latest entries of the ``targetData`` and ``cursorData`` side
+    streams, fetched with the mouse samples.
+
+    The task logic is stepped sample by sample; the preparatory dynamics
+    are linear, so they are advanced for a whole batch at once.
+
+    Parameters
+    ----------
+    r : redis.Redis
+        Redis connection
+    prep_dims : int
+        Dimensionality of the preparatory subspace (>= 2). The 2D reach
+        vector is embedded in it by a fixed random orthonormal map when > 2.
+    max_batch : int
+        Max. number of samples per update
+    integrator : str, optional
+        Discretization of the preparatory dynamics, 'exact' or 'euler', by
+        default 'exact' (see ``LinearDynamics``)
+    """
+
+    def __init__(self, r, prep_dims, max_batch, integrator='exact'):
+        if prep_dims < 2:
+            raise ValueError('prep_dims must be at least 2')
+
+        self.cursor_pos = np.zeros(2)
+        self.cursor_pos_start = np.zeros(2)
+        self.target_pos = np.zeros(2)
+        self.target_pos_last = np.zeros(2)
+        self.target_state = 0
+        self.target_state_last = 0
+
+        self.moving = 0
+
+        self.t_t = 0  # preparatory activity on
+        self.t_t_duration = 0
+        self.v_t_duration = 0
+
+        self.max_p_t_mag = 1000 * 10
+
+        if prep_dims == 2:
+            embedding = np.eye(2)
+        else:
+            # fixed random orthonormal embedding
+            embedding = np.linalg.qr(np.random.default_rng(42).standard_normal(
+                (prep_dims, 2)))[0]
+        self.prep = LinearDynamics(-0.09 * np.eye(prep_dims),
+                                   embedding,
+                                   dt=0.005,
+                                   tau=0.010,
+                                   method=integrator,
+                                   max_steps=max_batch)
+
+        # per-sample task state of the last update
+        self.u_batch = np.zeros((max_batch, 2))
+        self.moving_batch = np.zeros(max_batch, dtype=np.int32)
+        self.t_t_batch = np.zeros(max_batch, dtype=np.int32)
+
+        # latest task state, fetched with the mouse samples
+        self.side = LatestEntries(r, ['targetData', 'cursorData'])
+
+    def update_targets(self):
+        """
+        Read the target and cursor entries that changed at the last refresh
+        of ``side``
+        """
+        if 'targetData' in self.side.changed:
+            target = self.side.entries['targetData']
+            self.target_pos[0] = np.frombuffer(target[b'X'], np.float32)[0]
+            self.target_pos[1] = np.frombuffer(target[b'Y'], np.float32)[0]
+            self.target_state = np.frombuffer(target[b'state'], np.int32)[0]
+
+        if 'cursorData' in self.side.changed:
+            cursor = self.side.entries['cursorData']
+            self.cursor_pos[0] = np.frombuffer(cursor[b'X'], np.float32)[0]
+            self.cursor_pos[1] = np.frombuffer(cursor[b'Y'], np.float32)[0]
+
+    def update(self, encoder, k):
+        """
+        Fill the speed and preparatory rows of the first ``k`` states of a
+        ``SubspaceEncoder``, whose movement rows hold the normalized
+        velocity
+
+        Parameters
+        ----------
+        encoder : SubspaceEncoder
+            Encoder, built
+        k : int
+            Number of states
+        """
+        states = encoder.states
+        velocity = states[encoder.move_slice, :k]
+        speed = states[encoder.speed_index, :k]
+        np.hypot(velocity[0], velocity[1], out=speed)
+
+        for j in range(k):
+            self.step(speed[j], self.u_batch[j])
+            self.moving_batch[j] = self.moving
+            self.t_t_batch[j] = self.t_t
+
+        p_t = self.prep.step(self.u_batch[:k])
+        np.divide(p_t.T,
+                  self.max_p_t_mag,
+                  out=states[encoder.prep_slice, :k])
+
+    def step(self, speed, u_t):
+        # task logic of one sample, given its normalized speed; writes the
+        # input of the preparatory dynamics to u_t
+        if self.target_state != self.target_state_last:
+            self.cursor_pos_start[:] = self.cursor_pos
+
+        if speed > 0.1:
+            self.v_t_duration += 1
+            if self.v_t_duration > 2:
+                self.moving = 1
+        else:
+            self.v_t_duration = 0
+            self.moving = 0
+
+        # no prep activity when no target or on target
+        if self.target_state < 1 or self.target_state > 2:
+            self.t_t = 0
+        # if moving and prep activity has already lasted for a bit (200ms), turn off
+        elif self.moving == 1 and self.t_t_duration > 200 / 5:
+            self.t_t = 0
+        # start prep activity when change of target
+        elif (abs(self.target_pos[0] - self.target_pos_last[0]) > 0.1 or
+              abs(self.target_pos[1] - self.target_pos_last[1]) > 0.1):
+            self.t_t = 1
+        # start prep activity when target is shown/on and not moving
+        elif self.moving == 0 and (self.target_state == 1 or
+                                   self.target_state == 2):
+            self.t_t = 1
+
+        if self.t_t > 0:
+            self.t_t_duration += 1
+        else:
+            self.t_t_duration = 0
+
+        self.target_state_last = self.target_state
+        self.target_pos_last[:] = self.target_pos
+
+        # reach vector, driving the preparatory activity while t_t is on
+        np.subtract(self.target_pos, self.cursor_pos_start, out=u_t)
+        u_t *= self.t_t
+
+
+class RateLoop:
+    """
+    Main loop of the firing-rate nodes: ``rate_encoder``, and ``sim2D``,
+    ``sim2D_uniform`` and ``sim2D_prep``, which only change its defaults.
+
+    Each iteration reads mouse samples from ``in_stream`` (one, or in batch
+    mode the whole backlog), maps them to states of the ``encoder_model``
+    (see ``ENCODERS``), encodes all of them with one ``encode`` call and
+    publishes one entry per sample in a single pipelined write.
+
+    With ``count_allocs``, the bytes allocated by each iteration (read,
+    decode, encode and publish, measured with tracemalloc) are published in
+    the 'alloc_bytes' field of the entries of the next iteration.
+
+    The 'cosine' and 'uniform' models encode the normalized 2D velocity.
+    The 'subspace' model also encodes the speed and the preparatory
+    activity of a ``ReachTask``, and its entries carry the subspaces and
+    the task state.
+
+    Parameters
+    ----------
+    r : redis.Redis
+        Redis connection
+    name : str
+        Node name, published with the latency summaries
+    parameters : dict
+        Node parameters. Missing optional parameters are set to their
+        defaults.
+    """
+
+    def __init__(self, r, name, parameters):
+
+        # set defaults
+        parameters.setdefault('encoder_model', 'cosine')
+        parameters.setdefault('click_enabled', 1)
+        parameters.setdefault('output_stream', 'firing_rates')
+        parameters.setdefault('batch_mode', 0)
+        parameters.setdefault('max_batch', 1000)
+        parameters.setdefault('count_allocs', 0)
+        parameters.setdefault('async_io', 0)
+        parameters.setdefault('prep_integrator', 'exact')
+        parameters.setdefault('stream_format', 'fields')
+        parameters.setdefault('latency_stream', 'latency_stats')
+        parameters.setdefault('latency_interval', 1.0)
+        parameters.setdefault('loop_deadline_ms', None)
+
+        self.r = r
+        self.name = name
+        self.parameters = parameters
+
+        self.n_neurons = parameters['n_neurons']
+        self.max_v = parameters['max_v']
+        self.in_stream = parameters['in_stream']
+        self.max_samples = parameters['max_samples']
+        self.encoder_model = parameters['encoder_model']
+        self.click_enabled = parameters['click_enabled']
+        self.output_stream = parameters['output_stream']
+        self.batch_mode = parameters['batch_mode']
+        self.count_allocs = parameters['count_allocs']
+        self.async_io = parameters['async_io']
+        self.prep_integrator = parameters['prep_integrator']
+        self.stream_format = parameters['stream_format']
+        self.latency_stream = parameters['latency_stream']
+        self.latency_interval = parameters['latency_interval']
+        self.loop_deadline_ms = parameters['loop_deadline_ms']
+
+        if self.encoder_model not in ENCODERS:
+            raise ValueError(f'Unknown encoder_model: {self.encoder_model}')
+
+        # one sample per read unless draining the backlog
+        self.max_batch = parameters['max_batch'] if self.batch_mode else 1
+        self.loop_deadline = (None if self.loop_deadline_ms is None else
+                              self.loop_deadline_ms / 1e3)
+
+        self.max_v_mag = np.sqrt(2) * self.max_v
+        self.binary = self.stream_format == 'binary'
+
+        # index of the next output entry
+        self.i = np.zeros((), dtype=np.uint32)
+
+    def build(self):
+        """
+        Build the encoder (and the task of the 'subspace' model) and
+        allocate the buffers of the largest batch
+        """
+        # allocations are counted over whole iterations, not per encode
+        parameters = dict(self.parameters,
+                          max_batch=self.max_batch,
+                          count_allocs=False)
+        self.encoder = ENCODERS[self.encoder_model].from_parameters(
+            parameters)
+        self.encoder.build()
+
+        # the movement rows of the states hold the normalized velocity
+        if isinstance(self.encoder, SubspaceEncoder):
+            self.task = ReachTask(self.r,
+                                  self.encoder.prep_dims,
+                                  self.max_batch,
+                                  integrator=self.prep_integrator)
+            self.velocity = self.encoder.states[self.encoder.move_slice]
+        elif self.encoder.n_dims == 2:
+            self.task = None
+            self.velocity = self.encoder.states
+        else:
+            raise ValueError(f'The {self.encoder_model} model encodes a '
+                             f'{self.encoder.n_dims}D state, not the 2D '
+                             'velocity')
+
+        # the fields format of the 'subspace' model has float timestamps
+        # in s, as sim2D_prep
+        self.clock = (time.monotonic if self.task is not None
+                      and not self.binary else time.monotonic_ns)
+
+        self.mouse_batch = np.zeros((2, self.max_batch), dtype=np.float32)
+        self.i_in_batch = np.zeros(self.max_batch, dtype=np.int32)
+        self.origin_ts_batch = np.zeros(self.max_batch, dtype=np.uint64)
+        self.flags_batch = np.zeros(self.max_batch, dtype=np.uint16)
+        self.alloc_buf = np.zeros(1, dtype=np.int64)
+
+        # output index and time of each sample, published through byte
+        # views
+        self.batch_offsets = np.arange(self.max_batch + 1, dtype=np.uint32)
+        self.i_buf = np.zeros(self.max_batch + 1, dtype=np.uint32)
+        self.ts_buf = np.zeros(1, dtype=np.uint64)
+        self.state_buf = np.zeros(1, dtype=np.int32)
+
+        payload = [('rates', '<f4', (self.n_neurons, ))]
+        if self.count_allocs:
+            payload.append(('alloc_bytes', '<i8'))
+        if self.task is not None:
+            # float64 copy of the states, published with the rates
+            self.x_batch = np.zeros((self.max_batch, self.encoder.n_dims))
+            speed = self.encoder.speed_index
+            self.x_views = [{
+                'prep_subspace':
+                    memoryview(x[self.encoder.prep_slice]).cast('B'),
+                'move_subspace':
+                    memoryview(x[self.encoder.move_slice]).cast('B'),
+                'speed_subspace':
+                    memoryview(x[speed:speed + 1]).cast('B'),
+            } for x in self.x_batch]
+            payload += [('x', '<f8', (self.encoder.n_dims, )),
+                        ('t_t', '<i4')]
+        if self.binary:
+            self.records = new_records(record_dtype(payload), self.max_batch)
+            self.record_views = [
+                memoryview(row).cast('B')
+                for row in self.records.view(np.uint8).reshape(
+                    self.max_batch, -1)
+            ]
+            self.moving_flags = np.zeros(self.max_batch, dtype=np.uint16)
+            publish_schema(self.r, self.output_stream, self.records.dtype)
+        else:
+            self.init_entries()
+
+        logging.info(f'{self.encoder_model} firing rates parameters '
+                     f'initiated for {self.n_neurons} neurons')
+
+    def init_entries(self):
+        # one entry per batch slot, reused for every batch: the byte views
+        # are fixed and the other values are replaced in place
+        self.entries = []
+        for j in range(self.max_batch):
+            entry = {
+                'ts': memoryview(self.ts_buf).cast('B'),
+                'rates': memoryview(self.encoder.batch_rates[j]).cast('B'),
+                'i': memoryview(self.i_buf[j:j + 1]).cast('B'),
+                'i_in': 0,
+                'origin_i': 0,
+                'origin_ts': 0
+            }
+            if self.task is not None:
+                entry.update(self.x_views[j],
+                             ts_start=0,
+                             ts=0,
+                             ts_end=0,
+                             target_state=memoryview(
+                                 self.state_buf).cast('B'),
+                             moving=0,
+                             t_t=0)
+            if self.count_allocs:
+                entry['alloc_bytes'] = memoryview(self.alloc_buf).cast('B')
+            self.entries.append(entry)
+
+    def run(self):
+        """
+        Build, then read, encode and publish until the node is stopped
+        """
+        self.build()
+
+        # per-phase loop timing, summarized to the latency stream
+        self.recorder = LoopRecorder(self.r,
+                                     self.name,
+                                     stream=self.latency_stream,
+                                     interval=self.latency_interval,
+                                     deadline=self.loop_deadline)
+
+        self.start_io()
+
+        logging.info(f'Publishing firing rates for {self.n_neurons} neurons '
+                     f'(up to {self.max_batch} samples per read)')
+
+        if self.count_allocs and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+        self.last_id = '$'
+        ts_end = self.clock()
+
+        while True:
+            # block until at least one sample is available (and, in batch
+            # mode, drain the backlog in the same round trip)
+            ts_start = self.clock()
+            self.recorder.begin()
+            if self.count_allocs:
+                tracemalloc.clear_traces()
+            k = self.read()
+            self.recorder.lap()
+
+            rates = self.encode(k)
+            self.recorder.lap()
+
+            self.publish(k, rates, ts_start, ts_end)
+            if self.count_allocs:
+                # peak bytes traced since the start of the iteration
+                self.alloc_buf[0] = tracemalloc.get_traced_memory()[1]
+            ts_end = self.clock()
+            self.recorder.lap()
+
+    def start_io(self):
+        # optionally overlap the next read and the writes with computation,
+        # on separate connections
+        self.io = None
+        self.writer = self.r
+        if self.async_io:
+            self.io = OverlappedIO.from_client(self.r,
+                                               self.in_stream,
+                                               count=self.max_batch)
+            self.io.start()
+            self.writer = self.io
+
+    def read(self):
+        """
+        Read all pending mouse samples (up to ``max_batch``), and the task
+        side streams in the same round trip
+
+        Returns
+        -------
+        k : int
+            Number of samples read
+        """
+        if self.io is not None:
+            self.reply = self.io.read()
+            if self.task is not None:
+                self.task.side.refresh()
+        elif self.task is not None:
+            p = self.r.pipeline(transaction=False)
+            p.xread(streams={self.in_stream: self.last_id},
+                    count=self.max_batch,
+                    block=0)
+            self.task.side.queue(p)
+            self.reply, = self.task.side.execute(p)
+        else:
+            self.reply = self.r.xread(streams={self.in_stream: self.last_id},
+                                      count=self.max_batch,
+                                      block=0)
+
+        entries = self.reply[0][1]
+        self.last_id = entries[-1][0]
+
+        for j, (_, entry_dict) in enumerate(entries):
+            samples = np.frombuffer(entry_dict[b'samples'], np.int16)
+            self.mouse_batch[0, j] = samples[0]
+            self.mouse_batch[1, j] = -samples[1]
+            self.encoder.clicks[j] = samples[2]
+            self.flags_batch[j] = FLAG_CLICK if samples[2] else 0
+            i_in = int.from_bytes(entry_dict[b'index'], "little", signed=True)
+            origin_ts = timespec_ns(entry_dict[b'timestamps'])
+            if self.binary:
+                self.i_in_batch[j] = i_in
+                self.origin_ts_batch[j] = origin_ts
+            else:
+                entry = self.entries[j]
+                entry['i_in'] = i_in
+                entry['origin_i'] = i_in
+                entry['origin_ts'] = origin_ts
+
+        if self.task is not None:
+            self.task.update_targets()
+
+        return len(entries)
+
+    def encode(self, k):
+        """
+        Encode the first ``k`` samples of the batch
+
+        Returns
+        -------
+        rates : array of shape (n_neurons, k)
+            View of the encoder's ``batch_rates``
+        """
+        # compute intended velocity from mouse data
+        velocity = self.velocity[:, :k]
+        np.clip(self.mouse_batch[:, :k], -self.max_v, self.max_v,
+                out=velocity)
+        np.divide(velocity, self.max_v_mag, out=velocity)
+
+        states = self.encoder.states[:, :k]
+        if self.task is not None:
+            self.task.update(self.encoder, k)
+            self.x_batch[:k] = states.T
+
+        # compute firing rates for all k samples in one product
+        return self.encoder.encode(states,
+                                   self.encoder.clicks[:k],
+                                   click_enabled=self.click_enabled)
+
+    def publish(self, k, rates, ts_start, ts_end):
+        """
+        Publish one entry per sample, in a single pipelined write
+        """
+        task = self.task
+        ts = self.clock()
+        np.add(self.batch_offsets, self.i, out=self.i_buf)
+        self.i.fill(self.i_buf.item(k))
+
+        p = self.writer.pipeline(transaction=False)
+        if self.binary:
+            records = self.records[:k]
+            records['i'] = self.i_buf[:k]
+            records['i_in'] = self.i_in_batch[:k]
+            records['origin_i'] = self.i_in_batch[:k]
+            records['origin_ts'] = self.origin_ts_batch[:k]
+            records['flags'] = self.flags_batch[:k]
+            records['rates'] = rates.T
+            records['ts_start'] = ts_start
+            records['ts'] = ts
+            records['ts_end'] = ts_end
+            if self.count_allocs:
+                records['alloc_bytes'] = self.alloc_buf
+            if task is not None:
+                moving_flags = self.moving_flags[:k]
+                np.multiply(task.moving_batch[:k], FLAG_MOVING,
+                            out=moving_flags, casting='unsafe')
+                records['flags'] |= moving_flags
+                records['state'] = task.target_state
+                records['x'] = self.x_batch[:k]
+                records['t_t'] = task.t_t_batch[:k]
+            for j in range(k):
+                p.xadd(self.output_stream,
+                       {RECORD_FIELD: self.record_views[j]},
+                       maxlen=self.max_samples,
+                       approximate=True)
+        else:
+            if task is None:
+                self.ts_buf[0] = ts
+            else:
+                self.state_buf[0] = task.target_state
+            for j in range(k):
+                entry = self.entries[j]
+                if task is not None:
+                    # moving and t_t are 0 or 1, whose ints are not
+                    # allocated
+                    entry['ts_start'] = ts_start
+                    entry['ts'] = ts
+                    entry['ts_end'] = ts_end
+                    entry['moving'] = task.moving_batch.item(j)
+                    entry['t_t'] = task.t_t_batch.item(j)
+                p.xadd(self.output_stream,
+                       entry,
+                       maxlen=self.max_samples,
+                       approximate=True)
+        p.execute()
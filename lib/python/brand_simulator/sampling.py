@@ -0,0 +1,132 @@
+import numpy as np
+
+from brand_simulator.glm import GLMSampler
+
+
+class BernoulliSampler:
+    """
+    Draws spikes as one Bernoulli trial per sample and channel. Uniform
+    variates are drawn into a preallocated buffer and compared against the
+    per-channel spike probabilities, broadcast along the time axis.
+
+    Parameters
+    ----------
+    n_samples : int
+        Number of samples generated per call
+    shape : tuple of int
+        Shape of the rate input, e.g. (n_channels,) or (n_channels, n_units)
+    sample_rate : float
+        Rate (in Hz) of the generated samples
+    seed : int, SeedSequence or Generator, optional
+        Seed for the random number generator, by default None
+    """
+
+    def __init__(self, n_samples, shape, sample_rate, seed=None):
+        self.n_samples = n_samples
+        self.shape = tuple(shape)
+        self.sample_rate = sample_rate
+        self.rng = np.random.default_rng(seed)
+
+        self.p = np.zeros(self.shape, dtype=np.float32)
+        self.uniform = np.zeros((n_samples, ) + self.shape, dtype=np.float32)
+        self.spikes = np.zeros((n_samples, ) + self.shape, dtype=bool)
+
+    def sample(self, rates):
+        """
+        Draw spikes for one block
+
+        Parameters
+        ----------
+        rates : array
+            Firing rates (in Hz), of shape ``shape``
+
+        Returns
+        -------
+        spikes : bool array of shape (n_samples, *shape)
+            Spike raster. This is the sampler's own buffer and is overwritten
+            by the next call; use ``spikes.view(np.uint8)`` for a uint8 view.
+        """
+        np.divide(rates, self.sample_rate, out=self.p)
+        self.rng.random(dtype=np.float32, out=self.uniform)
+        np.less(self.uniform, self.p, out=self.spikes)
+        return self.spikes
+
+
+class PoissonEventSampler:
+    """
+    Draws spike times directly from exponential inter-spike intervals, so
+    the cost scales with the number of spikes instead of samples x channels.
+    Intervals are drawn in rescaled (unit-rate) time, which keeps the
+    process exact when the rate changes between blocks. At most one spike is
+    kept per sample and channel.
+
+    Parameters
+    ----------
+    n_samples : int
+        Number of samples generated per call
+    shape : tuple of int
+        Shape of the rate input, e.g. (n_channels,) or (n_channels, n_units)
+    sample_rate : float
+        Rate (in Hz) of the generated samples
+    seed : int, SeedSequence or Generator, optional
+        Seed for the random number generator, by default None
+    """
+
+    def __init__(self, n_samples, shape, sample_rate, seed=None):
+        self.n_samples = n_samples
+        self.shape = tuple(shape)
+        self.sample_rate = sample_rate
+        self.rng = np.random.default_rng(seed)
+
+        n = int(np.prod(self.shape))
+        self.p = np.zeros(n)
+        self.t_next = np.zeros(n)
+        # unit-rate time left until the next event of each channel
+        self.residual = self.rng.standard_exponential(n)
+
+        self.spikes = np.zeros((n_samples, ) + self.shape, dtype=bool)
+        self.spikes_flat = self.spikes.reshape(n_samples, n)
+
+    def sample(self, rates):
+        """
+        Draw spikes for one block
+
+        Parameters
+        ----------
+        rates : array
+            Firing rates (in Hz), of shape ``shape``
+
+        Returns
+        -------
+        spikes : bool array of shape (n_samples, *shape)
+            Spike raster. This is the sampler's own buffer and is overwritten
+            by the next call.
+        """
+        np.divide(np.ravel(rates), self.sample_rate, out=self.p)
+        firing = self.p > 0
+
+        # time (in samples) of the next event of each channel
+        self.t_next.fill(np.inf)
+        np.divide(self.residual, self.p, out=self.t_next, where=firing)
+
+        self.spikes.fill(False)
+        ch = np.flatnonzero(self.t_next < self.n_samples)
+        while ch.size:
+            t = self.t_next[ch]
+            self.spikes_flat[t.astype(np.intp), ch] = True
+            t += self.rng.standard_exponential(ch.size) / self.p[ch]
+            self.t_next[ch] = t
+            ch = ch[t < self.n_samples]
+
+        # carry the remaining rescaled time over to the next block
+        self.residual[firing] = ((self.t_next[firing] - self.n_samples) *
+                                 self.p[firing])
+
+        return self.spikes
+
+
+SAMPLERS = {
+    'bernoulli': BernoulliSampler,
+    'poisson_events': PoissonEventSampler,
+    'glm': GLMSampler,
+}
@@ -0,0 +1,169 @@
+import json
+
+import numpy as np
+
+# 2: origin_i and origin_ts added to the header
+SCHEMA_VERSION = 2
+
+# header flags
+FLAG_CLICK = 1 << 0
+FLAG_MOVING = 1 << 1
+
+# packed (unaligned) header, common to all binary records. Timestamps are
+# CLOCK_MONOTONIC in ns, 'state' is node-specific (e.g. the target state).
+# 'origin_i' and 'origin_ts' are the index and time of the input sample
+# (mouse_vel) the record derives from, forwarded by every node.
+HEADER_FIELDS = [
+    ('version', '<u2'),
+    ('flags', '<u2'),
+    ('state', '<i4'),
+    ('i', '<u8'),
+    ('i_in', '<i8'),
+    ('origin_i', '<i8'),
+    ('origin_ts', '<u8'),
+    ('ts_start', '<u8'),
+    ('ts_in', '<u8'),
+    ('ts', '<u8'),
+    ('ts_end', '<u8'),
+]
+HEADER_DTYPE = np.dtype(HEADER_FIELDS)
+HEADER_NAMES = HEADER_DTYPE.names[1:]
+
+# stream entries in the binary format hold their record in this field
+RECORD_FIELD = b'rec'
+
+
+def record_dtype(payload):
+    """
+    Structured dtype of a binary record: the common header followed by the
+    payload fields
+
+    Parameters
+    ----------
+    payload : list of tuple
+        Payload fields, as (name, format) or (name, format, shape) tuples,
+        e.g. ``[('rates', '<f4', (n_neurons, ))]``
+
+    Returns
+    -------
+    dtype : np.dtype
+    """
+    return np.dtype(HEADER_FIELDS + list(payload))
+
+
+def new_records(dtype, n=1):
+    """
+    Preallocate binary records with the schema version set
+
+    Parameters
+    ----------
+    dtype : np.dtype
+        Record dtype, from ``record_dtype``
+    n : int, optional
+        Number of records, by default 1
+
+    Returns
+    -------
+    records : structured array of shape (n,)
+    """
+    records = np.zeros(n, dtype=dtype)
+    records['version'] = SCHEMA_VERSION
+    return records
+
+
+def schema_key(stream):
+    """
+    Redis key holding the record dtype of a stream
+    """
+    return f'{stream}:schema'
+
+
+def publish_schema(r, stream, dtype):
+    """
+    Store the record dtype of a stream in Redis, so that consumers can
+    decode its entries without knowing the payload in advance
+
+    Parameters
+    ----------
+    r : redis.Redis
+        Redis connection
+    stream : str
+        Stream name
+    dtype : np.dtype
+        Record dtype
+    """
+    r.set(schema_key(stream),
+          json.dumps({
+              'version': SCHEMA_VERSION,
+              'descr': dtype.descr
+          }))
+
+
+def load_schema(r, stream):
+    """
+    Load the record dtype of a stream from Redis
+
+    Parameters
+    ----------
+    r : redis.Redis
+        Redis connection
+    stream : str
+        Stream name
+
+    Returns
+    -------
+    dtype : np.dtype or None
+        Record dtype, or None if the stream has no binary schema
+    """
+    schema = r.get(schema_key(stream))
+    if schema is None:
+        return None
+    schema = json.loads(schema)
+    if schema['version'] != SCHEMA_VERSION:
+        raise ValueError(f'Unsupported schema version {schema["version"]} '
+                         f'for stream {stream}')
+    return np.dtype([(field[0], field[1], tuple(field[2]))
+                     if len(field) > 2 else tuple(field)
+                     for field in schema['descr']])
+
+
+def decode(data, dtype):
+    """
+    Decode binary records without copying
+
+    Parameters
+    ----------
+    data : bytes
+        One or more concatenated records
+    dtype : np.dtype
+        Record dtype
+
+    Returns
+    -------
+    records : structured array
+        Read-only view of ``data``
+    """
+    records = np.frombuffer(data, dtype=dtype)
+    if records.shape[0] and np.any(records['version'] != SCHEMA_VERSION):
+        raise ValueError('Unsupported record version')
+    return records
+
+
+def decode_entries(entries, dtype):
+    """
+    Decode the records of a list of stream entries (e.g. an XRANGE reply)
+    into a single structured array
+
+    Parameters
+    ----------
+    entries : list
+        (entry_id, entry_dict) pairs
+    dtype : np.dtype
+        Record dtype
+
+    Returns
+    -------
+    records : structured array
+    """
+    return decode(b''.join(entry[RECORD_FIELD] for _, entry in entries),
+                  dtype)
@@ -0,0 +1,558 @@
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from brand_simulator.generator import ContinuousGenerator
+
+# arrays in shared memory start on their own cache line
+ALIGNMENT = 64
+
+
+def shard_bounds(n_channels, n_shards):
+    """
+    Split channels into contiguous shards of nearly equal size
+
+    Parameters
+    ----------
+    n_channels : int
+        Number of channels
+    n_shards : int
+        Number of shards
+
+    Returns
+    -------
+    bounds : list of (int, int)
+        First and last + 1 channel of each shard
+    """
+    edges = [n_channels * k // n_shards for k in range(n_shards + 1)]
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def shard_seeds(seed, n_shards):
+    """
+    Independent seeds for the shards of a node, spawned from its seed with
+    ``np.random.SeedSequence.spawn``
+
+    Parameters
+    ----------
+    seed : int
+        Node seed (``random_seed``)
+    n_shards : int
+        Number of shards
+
+    Returns
+    -------
+    seeds : list of int
+    """
+    return [
+        int(child.generate_state(1)[0])
+        for child in np.random.SeedSequence(seed).spawn(n_shards)
+    ]
+
+
+def shard_parameters(parameters, n_shards):
+    """
+    ``spike_gen_30k`` parameters of each shard of a node's channels. Each
+    shard gets its own seed (see ``shard_seeds``), so shards draw
+    independent spikes and the data only depends on the node's seed and the
+    number of shards.
+
+    Parameters
+    ----------
+    parameters : dict
+        Node parameters
+    n_shards : int
+        Number of shards
+
+    Returns
+    -------
+    shards : list of dict
+        Parameters of each shard, with its ``n_start``, ``n_end`` and
+        ``random_seed``
+    """
+    n_start = parameters['n_start']
+    seeds = shard_seeds(parameters['random_seed'], n_shards)
+    bounds = shard_bounds(parameters['n_end'] - n_start, n_shards)
+    return [
+        dict(parameters,
+             n_start=n_start + start,
+             n_end=n_start + end,
+             random_seed=int(seed))
+        for (start, end), seed in zip(bounds, seeds)
+    ]
+
+
+def make_generator(parameters):
+    """
+    Create the generator of a ``spike_gen_30k`` node: a
+    ``ContinuousGenerator``, or ``ShardThreads`` if the node has
+    ``n_threads`` > 1
+
+    Parameters
+    ----------
+    parameters : dict
+        Node parameters, as in the graph YAML
+
+    Returns
+    -------
+    generator : ContinuousGenerator or ShardThreads
+    """
+    if parameters.get('n_threads', 1) > 1:
+        return ShardThreads.from_parameters(parameters)
+    return ContinuousGenerator.from_parameters(parameters)
+
+
+class SharedArrays:
+    """
+    Arrays laid out in a single ``multiprocessing.shared_memory`` block.
+    Processes forked after creation see the same memory, so they exchange
+    data through these arrays without copies or pickling.
+
+    Parameters
+    ----------
+    layout : dict
+        Maps names to (shape, dtype) of each array
+    """
+
+    def __init__(self, layout):
+        offsets = {}
+        size = 0
+        for name, (shape, dtype) in layout.items():
+            offsets[name] = size
+            nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+            size += -(-nbytes // ALIGNMENT) * ALIGNMENT
+
+        self.shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        self.arrays = {
+            name: np.ndarray(shape,
+                             dtype=dtype,
+                             buffer=self.shm.buf,
+                             offset=offsets[name])
+            for name, (shape, dtype) in layout.items()
+        }
+        for array in self.arrays.values():
+            array.fill(0)
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def close(self, unlink=True):
+        """
+        Release the arrays and the shared memory block
+
+        Parameters
+        ----------
+        unlink : bool, optional
+            Also free the block, by default True. Only the creating process
+            should unlink it.
+        """
+        self.arrays = {}
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+class SeqLock:
+    """
+    Sequence lock for arrays in shared memory, with one writer and any
+    number of readers. The writer makes the counter odd while it writes;
+    readers copy the data and retry if the counter was odd or changed in
+    the meantime. Readers never block the writer. This relies on the
+    writer's stores becoming visible in order, as on x86.
+
+    Parameters
+    ----------
+    counter : int64 array of shape (1, )
+        Counter, in shared memory
+    """
+
+    def __init__(self, counter):
+        self.counter = counter
+
+    def write_begin(self):
+        self.counter[0] += 1
+
+    def write_end(self):
+        self.counter[0] += 1
+
+    def read(self, copies):
+        """
+        Copy a consistent snapshot of the protected arrays
+
+        Parameters
+        ----------
+        copies : list of (array, array)
+            (out, src) pairs, copied with ``np.copyto``
+
+        Returns
+        -------
+        version : int
+            Number of writes completed before the snapshot
+        """
+        while True:
+            start = int(self.counter[0])
+            if start & 1:
+                continue
+            for out, src in copies:
+                np.copyto(out, src)
+            if int(self.counter[0]) == start:
+                return start >> 1
+
+
+class ShardedGenerator:
+    """
+    Base class of the generators that split the channels of a
+    ``spike_gen_30k`` node into shards (see ``shard_parameters``), each
+    generated by its own ``ContinuousGenerator``. Subclasses have the
+    interface of ``ContinuousGenerator``, so the nodes and the offline
+    engine use any of them the same way.
+
+    Parameters
+    ----------
+    parameters : dict
+        Node parameters, as for ``ContinuousGenerator.from_parameters``
+    n_shards : int
+        Number of shards
+    """
+
+    def __init__(self, parameters, n_shards):
+        self.shards = shard_parameters(parameters, n_shards)
+        self.generators = [
+            ContinuousGenerator.from_parameters(shard)
+            for shard in self.shards
+        ]
+        first = self.generators[0]
+        self.n_neurons = parameters['n_end'] - parameters['n_start']
+        self.n_ms = first.n_ms
+        self.ms_samples = first.ms_samples
+        self.n_samples = first.n_samples
+        self.threshold_source = first.threshold_source
+        self.n_shards = n_shards
+
+        # columns of each shard in the node's output
+        n_start = parameters['n_start']
+        self.columns = [
+            slice(shard['n_start'] - n_start, shard['n_end'] - n_start)
+            for shard in self.shards
+        ]
+
+    def _use_outputs(self, continuous, spike_counts, thresholds):
+        self.continuous = continuous
+        self.spike_counts = spike_counts
+        if self.threshold_source == 'continuous':
+            self.thresholds = thresholds
+        else:
+            self.thresholds = spike_counts
+
+    def _gather(self, k):
+        # copy the block of shard k into its columns of the outputs
+        generator = self.generators[k]
+        columns = self.columns[k]
+        self.continuous[:, columns] = generator.continuous
+        self.spike_counts[:, columns] = generator.spike_counts
+        if generator.detector is not None:
+            self.thresholds[:, columns] = generator.detector.counts
+
+
+class ShardThreads(ShardedGenerator):
+    """
+    Generates the continuous data of a ``spike_gen_30k`` node with a
+    persistent pool of threads, one shard of channels per thread. The
+    calling thread generates the first shard itself, so ``n_threads``
+    threads work on each block. The bulk of the work (random draws,
+    scatter-add, casting, sums) is done in NumPy and SciPy kernels that
+    release the GIL, so shards run in parallel on the node's cores; only
+    the Python glue between kernels is serialized.
+
+    Every shard has its own ``np.random.Generator`` streams, seeded with
+    ``shard_seeds``, so the data is the same whatever the thread timing.
+    The 'binomial' sampler draws from NumPy's global generator and cannot
+    be used.
+
+    Parameters
+    ----------
+    parameters : dict
+        Node parameters, as for ``ContinuousGenerator.from_parameters``
+    n_threads : int
+        Number of threads (and shards)
+    """
+
+    def __init__(self, parameters, n_threads):
+        if parameters.get('spike_sampler', 'bernoulli') == 'binomial':
+            raise ValueError("n_threads > 1 requires a vectorized "
+                             "spike_sampler, not 'binomial'")
+        super().__init__(parameters, n_threads)
+        self.n_threads = n_threads
+
+        self.rates = None
+        self.error = None
+        self.running = False
+        self.threads = []
+
+    @classmethod
+    def from_parameters(cls, parameters):
+        """
+        Create the thread pool of a ``spike_gen_30k`` node
+
+        Parameters
+        ----------
+        parameters : dict
+            Node parameters, as in the graph YAML
+
+        Returns
+        -------
+        pool : ShardThreads
+        """
+        return cls(parameters, parameters.get('n_threads', 1))
+
+    def build(self):
+        """
+        Build the shard generators, allocate the outputs and start the
+        threads
+        """
+        for generator in self.generators:
+            generator.build()
+
+        n = self.n_neurons
+        self._use_outputs(np.zeros((self.n_samples, n), dtype=np.int16),
+                          np.zeros((self.n_ms, n), dtype=np.int8),
+                          np.zeros((self.n_ms, n), dtype=np.int8))
+
+        # all threads meet before and after each block
+        self.begin = threading.Barrier(self.n_threads)
+        self.end = threading.Barrier(self.n_threads)
+        self.running = True
+        self.threads = [
+            threading.Thread(target=self._work,
+                             args=(k, ),
+                             name=f'shard_{k}',
+                             daemon=True) for k in range(1, self.n_threads)
+        ]
+        for thread in self.threads:
+            thread.start()
+        logging.info(f'Generating {self.n_neurons} channels in '
+                     f'{self.n_threads} threads')
+
+    def start(self):
+        """
+        Start the background noise refill threads of the shards
+        """
+        for generator in self.generators:
+            generator.start()
+
+    def _run_shard(self, k):
+        try:
+            self.generators[k].process(self.rates)
+            self._gather(k)
+        except Exception as e:
+            self.error = e
+
+    def _work(self, k):
+        while True:
+            self.begin.wait()
+            if not self.running:
+                break
+            self._run_shard(k)
+            self.end.wait()
+
+    def process(self, rates):
+        """
+        Generate one block of continuous data, into ``continuous``,
+        ``spike_counts`` and ``thresholds``
+
+        Parameters
+        ----------
+        rates : float array
+            Full firing-rate vector (in Hz) of one input sample
+        """
+        self.rates = rates
+        self.begin.wait()
+        self._run_shard(0)
+        self.end.wait()
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def stop(self):
+        """
+        Stop the threads and the noise refill threads
+        """
+        if self.running:
+            self.running = False
+            self.begin.wait()
+            for thread in self.threads:
+                thread.join()
+        for generator in self.generators:
+            generator.stop()
+
+
+class ShardPool(ShardedGenerator):
+    """
+    Generates the continuous data of a ``spike_gen_30k`` node in worker
+    processes, one ``ContinuousGenerator`` per shard of its channels (see
+    ``shard_parameters``). The parent writes each firing-rate vector once
+    into shared memory, under a ``SeqLock``, and wakes the workers. Each
+    worker copies the rates, generates its shard, and writes it into its
+    columns of shared output blocks, which the parent then publishes as a
+    single block.
+
+    Parameters
+    ----------
+    parameters : dict
+        Node parameters, as for ``ContinuousGenerator.from_parameters``
+    n_workers : int
+        Number of worker processes (and shards)
+    n_rates : int
+        Length of the firing-rate vectors
+    cpus : list of int, optional
+        CPUs to pin the workers to, one per worker in turn, by default None
+        (the parent's affinity). CPUs outside of the parent's affinity are
+        ignored.
+    timeout : float, optional
+        Time (s) between checks that the workers are alive while waiting
+        for a block, by default 1.0
+    """
+
+    def __init__(self, parameters, n_workers, n_rates, cpus=None,
+                 timeout=1.0):
+        super().__init__(parameters, n_workers)
+        self.n_workers = n_workers
+        self.n_rates = n_rates
+        self.cpus = cpus
+        self.timeout = timeout
+
+        self.shared = None
+        self.workers = []
+
+    @classmethod
+    def from_parameters(cls, parameters):
+        """
+        Create the pool of a ``spike_gen_30k_mp`` node
+
+        Parameters
+        ----------
+        parameters : dict
+            Node parameters, as in the graph YAML
+
+        Returns
+        -------
+        pool : ShardPool
+        """
+        return cls(parameters,
+                   parameters.get('n_workers', 2),
+                   parameters['n_neurons'] *
+                   parameters.get('units_per_channel', 1),
+                   cpus=parameters.get('worker_cpus'))
+
+    def build(self):
+        """
+        Allocate the shared memory and fork the workers, which build their
+        generators
+        """
+        n = self.n_neurons
+        self.shared = SharedArrays({
+            'seq': ((1, ), np.int64),
+            'stop': ((1, ), np.int64),
+            'rates': ((self.n_rates, ), np.float32),
+            'continuous': ((self.n_samples, n), np.int16),
+            'spike_counts': ((self.n_ms, n), np.int8),
+            'thresholds': ((self.n_ms, n), np.int8),
+        })
+        self.lock = SeqLock(self.shared['seq'])
+        self._use_outputs(self.shared['continuous'],
+                          self.shared['spike_counts'],
+                          self.shared['thresholds'])
+
+        # fork, so the workers inherit the shared memory mapping
+        ctx = multiprocessing.get_context('fork')
+        self.go = [ctx.Semaphore(0) for _ in range(self.n_workers)]
+        self.done = ctx.Semaphore(0)
+        self.workers = []
+        for w in range(self.n_workers):
+            cpu = None if not self.cpus else self.cpus[w % len(self.cpus)]
+            worker = ctx.Process(target=self._work,
+                                 args=(w, cpu),
+                                 name=f'shard_{w}',
+                                 daemon=True)
+            worker.start()
+            self.workers.append(worker)
+        logging.info(f'Generating {self.n_neurons} channels in '
+                     f'{self.n_workers} worker processes')
+
+    def start(self):
+        """
+        Nothing to start: the workers start their noise refill threads when
+        they are forked
+        """
+
+    def _work(self, w, cpu):
+        # the parent stops the workers
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        if cpu is not None:
+            if cpu in os.sched_getaffinity(0):
+                os.sched_setaffinity(0, {cpu})
+            else:
+                logging.warning(f'Worker {w}: CPU {cpu} is not available, '
+                                'not pinning')
+
+        generator = self.generators[w]
+        generator.build()
+        generator.start()
+        rates = np.zeros(self.n_rates, dtype=np.float32)
+
+        while True:
+            self.go[w].acquire()
+            if self.shared['stop'][0]:
+                break
+            self.lock.read([(rates, self.shared['rates'])])
+
+            generator.process(rates)
+            self._gather(w)
+            self.done.release()
+
+        generator.stop()
+
+    def process(self, rates):
+        """
+        Generate one block of continuous data, into ``continuous``,
+        ``spike_counts`` and ``thresholds``
+
+        Parameters
+        ----------
+        rates : float array of shape (n_rates, )
+            Full firing-rate vector (in Hz) of one input sample
+        """
+        self.lock.write_begin()
+        self.shared['rates'][:] = rates
+        self.lock.write_end()
+        for go in self.go:
+            go.release()
+
+        for _ in range(self.n_workers):
+            while not self.done.acquire(timeout=self.timeout):
+                for worker in self.workers:
+                    if not worker.is_alive():
+                        raise RuntimeError(f'Worker {worker.name} exited '
+                                           f'with code {worker.exitcode}')
+
+    def stop(self):
+        """
+        Stop the workers and free the shared memory
+        """
+        if self.shared is None:
+            return
+        self.shared['stop'][0] = 1
+        for go in self.go:
+            go.release()
+        for worker in self.workers:
+            worker.join(self.timeout)
+            if worker.is_alive():
+                worker.terminate()
+        self.continuous = self.spike_counts = self.thresholds = None
+        self.shared.close()
+        self.shared = None
@@ -0,0 +1,138 @@
+from redis.exceptions import NoScriptError
+
+# latest entry of each stream in KEYS, or false (nil) if its ID is still
+# ARGV[i], so unchanged entries are not sent again
+LATEST_SCRIPT = """
+local out = {}
+for i, key in ipairs(KEYS) do
+    local last = redis.call('XREVRANGE', key, '+', '-', 'COUNT', 1)
+    if last[1] ~= nil and last[1][1] ~= ARGV[i] then
+        out[i] = last[1]
+    else
+        out[i] = false
+    end
+end
+return out
+"""
+
+
+class LatestEntries:
+    """
+    Local cache of the latest entry of slowly changing side streams (e.g.
+    the task's ``targetData`` and ``cursorData``), refreshed by one Lua
+    script call for all streams. The script only returns the entries whose
+    ID changed since the last refresh, and only those are decoded again.
+
+    Queued on a pipeline right after a node's blocking XREAD (``queue`` and
+    ``execute``), the script runs on the server as soon as the XREAD
+    returns, so the side streams are read in the same round trip as the
+    input and reflect their state at the time the input arrived.
+
+    Parameters
+    ----------
+    r : redis.Redis
+        Redis connection
+    streams : list of str
+        Side streams
+    """
+
+    def __init__(self, r, streams):
+        self.r = r
+        self.streams = list(streams)
+        self.load()
+
+        # '' never matches an entry ID, so the first refresh reads them all
+        self.ids = {stream: '' for stream in self.streams}
+        self.entries = {stream: None for stream in self.streams}
+        self.changed = set()
+
+    def load(self):
+        """
+        Load the script on the server (again, e.g. after a restart)
+        """
+        self.sha = self.r.script_load(LATEST_SCRIPT)
+
+    def queue(self, pipe):
+        """
+        Queue a refresh as the last command of a pipeline, to be run with
+        ``execute``
+
+        Parameters
+        ----------
+        pipe : redis.client.Pipeline
+            Pipeline (without transaction, so a blocking read can precede
+            the refresh)
+        """
+        pipe.evalsha(*self._args())
+
+    def _args(self):
+        ids = [self.ids[stream] for stream in self.streams]
+        return [self.sha, len(self.streams), *self.streams, *ids]
+
+    def execute(self, pipe):
+        """
+        Execute a pipeline whose last command is a queued refresh, and
+        update the cache
+
+        Parameters
+        ----------
+        pipe : redis.client.Pipeline
+            Pipeline, see ``queue``
+
+        Returns
+        -------
+        replies : list
+            Replies of the other commands of the pipeline
+        """
+        replies = pipe.execute(raise_on_error=False)
+        latest = replies.pop()
+        for reply in replies:
+            if isinstance(reply, Exception):
+                raise reply
+        if isinstance(latest, NoScriptError):
+            self.load()
+            latest = self.r.evalsha(*self._args())
+        elif isinstance(latest, Exception):
+            raise latest
+        self.update(latest)
+        return replies
+
+    def refresh(self):
+        """
+        Refresh the cache in its own round trip
+
+        Returns
+        -------
+        changed : set of str
+            Streams whose latest entry changed
+        """
+        try:
+            latest = self.r.evalsha(*self._args())
+        except NoScriptError:
+            self.load()
+            latest = self.r.evalsha(*self._args())
+        return self.update(latest)
+
+    def update(self, latest):
+        """
+        Update the cache from a reply of the script
+
+        Parameters
+        ----------
+        latest : list
+            For each stream, its new latest entry as ``[id, [field, value,
+            ...]]``, or None if unchanged
+
+        Returns
+        -------
+        changed : set of str
+            Streams whose latest entry changed
+        """
+        self.changed = set()
+        for stream, entry in zip(self.streams, latest):
+            if entry:
+                entry_id, fields = entry
+                self.ids[stream] = entry_id
+                self.entries[stream] = dict(zip(fields[::2], fields[1::2]))
+                self.changed.add(stream)
+        return self.changed
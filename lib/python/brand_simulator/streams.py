@@ -0,0 +1,285 @@
+import numpy as np
+
+from brand_simulator.schema import RECORD_FIELD, SCHEMA_VERSION, load_schema
+
+FIELD_KINDS = ('binary', 'text', 'timespec', 'id')
+
+# C struct timespec on 64-bit Linux, as written by the C nodes
+TIMESPEC_DTYPE = np.dtype([('tv_sec', '<i8'), ('tv_nsec', '<i8')])
+
+# entry IDs are keyed as (ms << ID_SEQ_BITS) | seq
+ID_SEQ_BITS = 20
+
+
+def id_keys(entry_ids):
+    """
+    Sortable integer keys of stream entry IDs
+
+    Parameters
+    ----------
+    entry_ids : list of bytes
+        Entry IDs, as b'<ms>-<seq>'
+
+    Returns
+    -------
+    keys : uint64 array
+        ``(ms << ID_SEQ_BITS) | seq`` for each ID (sequence numbers must be
+        below ``2**ID_SEQ_BITS``)
+    """
+    if not len(entry_ids):
+        return np.zeros(0, dtype=np.uint64)
+    parts = np.array(b' '.join(entry_ids).replace(b'-', b' ').split())
+    parts = parts.astype(np.uint64).reshape(-1, 2)
+    return (parts[:, 0] << np.uint64(ID_SEQ_BITS)) | parts[:, 1]
+
+
+class Field:
+    """
+    How to decode one field of a stream's entries
+
+    Parameters
+    ----------
+    dtype : np.dtype, optional
+        Type of the values, by default float64. 'timespec' fields are always
+        decoded to float64 seconds, and 'id' fields to uint64 keys.
+    shape : tuple, optional
+        Shape of the values in each entry, by default () (one value per
+        entry). One dimension may be -1, in which case all entries must hold
+        the same number of values.
+    kind : str, optional
+        One of:
+
+        - 'binary': raw little-endian values (e.g. ``ndarray.tobytes()``)
+        - 'text': numbers written as strings by redis-py (Python ints and
+          floats)
+        - 'timespec': C ``struct timespec``
+        - 'id': stream entry IDs (e.g. the entry a node consumed), decoded
+          to keys with ``id_keys``
+
+        by default 'binary'
+    key : bytes, optional
+        Name of the field in the stream entries, by default the name the
+        field is given in ``read_stream``
+    """
+
+    def __init__(self, dtype=np.float64, shape=(), kind='binary', key=None):
+        if kind not in FIELD_KINDS:
+            raise ValueError(f'Unknown field kind: {kind}')
+        if kind == 'timespec':
+            dtype = np.float64
+        elif kind == 'id':
+            dtype = np.uint64
+        self.dtype = np.dtype(dtype)
+        self.shape = tuple(shape)
+        self.kind = kind
+        self.key = key
+
+    def decode(self, values):
+        """
+        Decode the values of a list of entries at once
+
+        Parameters
+        ----------
+        values : list of bytes
+            Value of this field in each entry
+
+        Returns
+        -------
+        data : array of shape (len(values), *shape)
+        """
+        n = len(values)
+        if self.kind == 'id':
+            return id_keys(values).reshape((n, ) + self.shape)
+        if self.kind == 'text':
+            # numpy parses byte strings in C; ints may be written as floats
+            data = np.array(values).astype(np.float64).astype(self.dtype,
+                                                             copy=False)
+            return data.reshape((n, ) + self.shape)
+
+        data = b''.join(values)
+        dtype = TIMESPEC_DTYPE if self.kind == 'timespec' else self.dtype
+        if len(data) % (n * dtype.itemsize):
+            raise ValueError('Entries hold different numbers of values')
+        data = np.frombuffer(data, dtype=dtype).reshape((n, ) + self.shape)
+        if self.kind == 'timespec':
+            data = data['tv_sec'] + data['tv_nsec'] * 1e-9
+        return data
+
+
+def next_id(entry_id):
+    """
+    Smallest stream entry ID after ``entry_id``
+
+    Parameters
+    ----------
+    entry_id : bytes or str
+        Entry ID, as '<ms>-<seq>'
+
+    Returns
+    -------
+    entry_id : str
+    """
+    if isinstance(entry_id, bytes):
+        entry_id = entry_id.decode()
+    ms, seq = entry_id.split('-')
+    return f'{ms}-{int(seq) + 1}'
+
+
+def xrange_pages(r, stream, start='-', end='+', count=10000):
+    """
+    Iterate over the entries of a stream in pages of ``count`` entries, so
+    that a long stream is never held in a single XRANGE reply
+
+    Parameters
+    ----------
+    r : redis.Redis
+        Redis connection
+    stream : str
+        Stream name
+    start, end : str, optional
+        Range of entry IDs, by default the whole stream
+    count : int, optional
+        Number of entries per page, by default 10000
+
+    Yields
+    ------
+    page : list
+        (entry_id, entry_dict) pairs
+    """
+    while True:
+        page = r.xrange(stream, min=start, max=end, count=count)
+        if not page:
+            return
+        yield page
+        if len(page) < count:
+            return
+        start = next_id(page[-1][0])
+
+
+def read_stream(r,
+                stream,
+                fields,
+                start='-',
+                end='+',
+                count=10000,
+                ids=False):
+    """
+    Read a stream into one contiguous array per field (struct of arrays).
+    Entries are fetched in pages; the values of each field in a page are
+    concatenated and decoded with a single ``np.frombuffer`` into an output
+    array preallocated from XLEN, so no per-entry objects are built.
+
+    Parameters
+    ----------
+    r : redis.Redis
+        Redis connection
+    stream : str
+        Stream name
+    fields : dict
+        Maps output names to ``Field`` specs
+    start, end : str, optional
+        Range of entry IDs, by default the whole stream at the time of the
+        call (entries added while reading are ignored)
+    count : int, optional
+        Number of entries per XRANGE page, by default 10000
+    ids : bool, optional
+        Also return the entry IDs, as keys (see ``id_keys``) in an 'id'
+        column, by default False
+
+    Returns
+    -------
+    columns : dict
+        Maps output names to arrays of shape (n_entries, *shape)
+    """
+    if ids:
+        fields = dict(fields, id=Field(kind='id'))
+    keys = {
+        name: field.key if field.key is not None else name.encode()
+        for name, field in fields.items()
+    }
+    if end == '+':
+        last = r.xrevrange(stream, count=1)
+        end = last[0][0] if last else '-'
+    n = r.xlen(stream)
+
+    columns = {}
+    pos = 0
+    for page in xrange_pages(r, stream, start, end, count):
+        k = len(page)
+        for name, field in fields.items():
+            if ids and name == 'id':
+                data = id_keys([entry_id for entry_id, _ in page])
+            else:
+                key = keys[name]
+                data = field.decode([entry[key] for _, entry in page])
+            column = columns.get(name)
+            if column is None:
+                column = np.empty((max(n, k), ) + data.shape[1:],
+                                  dtype=data.dtype)
+            elif pos + k > column.shape[0]:
+                column = np.concatenate(
+                    (column, np.empty((pos + k - column.shape[0], ) +
+                                      data.shape[1:],
+                                      dtype=data.dtype)))
+            column[pos:pos + k] = data
+            columns[name] = column
+        pos += k
+
+    for name, field in fields.items():
+        if name in columns:
+            columns[name] = columns[name][:pos]
+        else:
+            shape = tuple(max(d, 0) for d in field.shape)
+            columns[name] = np.empty((0, ) + shape, dtype=field.dtype)
+    return columns
+
+
+def read_records(r,
+                 stream,
+                 fields=None,
+                 start='-',
+                 end='+',
+                 count=10000,
+                 ids=False):
+    """
+    Read a stream written in the binary format (see
+    ``brand_simulator.schema``) into one array per record field
+
+    Parameters
+    ----------
+    r : redis.Redis
+        Redis connection
+    stream : str
+        Stream name
+    fields : dict, optional
+        Other fields of the entries to read, as in ``read_stream``, by
+        default None
+    start, end : str, optional
+        Range of entry IDs, by default the whole stream
+    count : int, optional
+        Number of entries per XRANGE page, by default 10000
+    ids : bool, optional
+        Also return the entry IDs, as in ``read_stream``, by default False
+
+    Returns
+    -------
+    columns : dict
+        Maps record field names (header and payload) to arrays with one row
+        per record, and the names in ``fields`` to arrays with one row per
+        entry. These differ only for entries holding several records.
+    """
+    dtype = load_schema(r, stream)
+    if dtype is None:
+        raise ValueError(f'Stream {stream} has no binary schema')
+
+    record_name = RECORD_FIELD.decode()
+    specs = {record_name: Field(dtype, (-1, ), key=RECORD_FIELD)}
+    specs.update(fields or {})
+    columns = read_stream(r, stream, specs, start, end, count, ids)
+
+    records = columns.pop(record_name).reshape(-1)
+    if np.any(records['version'] != SCHEMA_VERSION):
+        raise ValueError('Unsupported record version')
+    for name in dtype.names:
+        columns[name] = records[name]
+    return columns
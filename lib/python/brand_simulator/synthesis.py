@@ -0,0 +1,245 @@
+import numpy as np
+from scipy.signal import fftconvolve
+
+from .waveforms import WaveformBank
+
+# action potential waveform (mV) sampled at 30 kHz
+AP_WAVEFORM = np.array([
+    0, -0.1, -0.2, -0.3, -0.4, -0.5, -0.6, -0.7, -0.8, -0.7, -0.6, -0.5, -0.4,
+    -0.3, -0.2, -0.1, 0, 0.05, 0.1, 0.15, 0.2, 0.19, 0.18, 0.17, 0.16, 0.15,
+    0.14, 0.13, 0.12, 0.11, 0.10, 0.09, 0.08, 0.07, 0.06, 0.05, 0.04, 0.03,
+    0.02, 0.01, 0
+])
+
+INT16_MIN = np.iinfo(np.int16).min
+INT16_MAX = np.iinfo(np.int16).max
+
+
+def quantize(data, out):
+    """
+    Round continuous data to the nearest integer and store it as int16,
+    saturating at the int16 range. Rounding (instead of truncating with
+    ``astype``) keeps the result independent of the floating point noise of
+    the method used to compute ``data``.
+
+    Parameters
+    ----------
+    data : float array
+        Continuous data. It is modified in place.
+    out : int16 array
+        Output array, of the same shape as ``data``
+
+    Returns
+    -------
+    out : int16 array
+    """
+    np.rint(data, out=data)
+    np.clip(data, INT16_MIN, INT16_MAX, out=data)
+    np.copyto(out, data, casting='unsafe')
+    return out
+
+
+class StreamingConvolver:
+    """
+    Convolves a multichannel stream with a kernel, one block at a time,
+    using overlap-add: the last ``n_taps - 1`` samples of each block's
+    convolution are kept as state and added to the start of the next block.
+    The output is therefore identical to convolving the whole stream at
+    once, and blocks may have any length.
+
+    Channels that share a kernel are convolved together, once per kernel.
+
+    Parameters
+    ----------
+    kernel : array of shape (n_taps,) or (n_taps, n_channels), or WaveformBank
+        Kernel shared by all channels, one kernel per channel, or a bank of
+        templates assigned to channels
+    n_channels : int
+        Number of channels
+    scale : float, optional
+        Scale applied to the kernel, by default 1.0
+    """
+
+    def __init__(self, kernel, n_channels, scale=1.0):
+        if isinstance(kernel, WaveformBank):
+            self.bank = kernel
+        elif np.ndim(kernel) == 2:
+            self.bank = WaveformBank(np.transpose(kernel),
+                                     np.arange(n_channels),
+                                     dtype='float64')
+        else:
+            self.bank = WaveformBank.single(kernel, n_channels, dtype='float64')
+
+        if self.bank.n_channels != n_channels:
+            raise ValueError(f'Waveform bank has {self.bank.n_channels} '
+                             f'channels, expected {n_channels}')
+
+        # (n_templates, n_taps) kernels in output units
+        self.kernels = self.bank.kernels(scale)
+        self.n_taps = self.bank.n_taps
+        self.n_channels = n_channels
+
+        # overlap of the previous blocks into the next one
+        self.tail = np.zeros((self.n_taps - 1, n_channels))
+        self.buffer = np.zeros((self.n_taps - 1, n_channels))
+
+    def reset(self):
+        """
+        Clear the overlap carried from previous blocks
+        """
+        self.tail.fill(0)
+
+    def accumulate(self, block, buffer):
+        """
+        Add the full convolution of ``block`` to ``buffer``
+
+        Parameters
+        ----------
+        block : array of shape (n_samples, n_channels)
+            Input block
+        buffer : array of shape (n_samples + n_taps - 1, n_channels)
+            Output buffer
+        """
+        for t, channels in self.bank.groups:
+            kernel = self.kernels[t][:, None]
+            if isinstance(channels, slice):
+                buffer += fftconvolve(block, kernel, mode='full', axes=0)
+            else:
+                buffer[:, channels] += fftconvolve(block[:, channels],
+                                                   kernel,
+                                                   mode='full',
+                                                   axes=0)
+
+    def process(self, block):
+        """
+        Convolve one block of the stream
+
+        Parameters
+        ----------
+        block : array of shape (n_samples, n_channels)
+            Input block
+
+        Returns
+        -------
+        out : float array of shape (n_samples, n_channels)
+            Output for the block. This is a view of the convolver's buffer
+            and is overwritten by the next call.
+        """
+        n_samples = block.shape[0]
+        if self.buffer.shape[0] != n_samples + self.n_taps - 1:
+            self.buffer = np.zeros((n_samples + self.n_taps - 1,
+                                    self.n_channels))
+
+        buffer = self.buffer
+        buffer[:self.n_taps - 1] = self.tail
+        buffer[self.n_taps - 1:] = 0
+
+        self.accumulate(block, buffer)
+
+        self.tail[:] = buffer[n_samples:]
+
+        return buffer[:n_samples]
+
+
+class SparseSpikeSynthesizer(StreamingConvolver):
+    """
+    Generates continuous data by stamping a waveform at each spike with a
+    scatter-add, so the cost scales with the number of spikes rather than
+    samples x channels. The overlap between blocks is handled as in
+    ``StreamingConvolver``.
+
+    Parameters
+    ----------
+    kernel : array of shape (n_taps,), or WaveformBank
+        Waveform stamped at each spike, or a bank of per-channel templates
+    n_channels : int
+        Number of channels
+    scale : float, optional
+        Scale applied to the waveform, by default 1.0
+    """
+
+    def __init__(self, kernel, n_channels, scale=1.0):
+        super().__init__(kernel, n_channels, scale=scale)
+        self.taps = np.arange(self.n_taps)
+
+    def accumulate(self, spikes, buffer):
+        """
+        Add the waveforms of the spikes in ``spikes`` to ``buffer``
+
+        Parameters
+        ----------
+        spikes : array of shape (n_samples, n_channels)
+            Spike raster (bool) or spike counts
+        buffer : array of shape (n_samples + n_taps - 1, n_channels)
+            Output buffer
+        """
+        t, ch = np.nonzero(spikes)
+        if t.size:
+            idx = (t[:, None] + self.taps) * self.n_channels + ch[:, None]
+            if len(self.bank.groups) == 1:
+                kernel = self.kernels[self.bank.groups[0][0]]
+                if spikes.dtype == bool:
+                    values = np.tile(kernel, t.size)
+                else:
+                    values = (spikes[t, ch][:, None] * kernel).reshape(-1)
+            else:
+                # gather the template of each spike's channel
+                values = self.kernels[self.bank.assignment[ch]]
+                if spikes.dtype != bool:
+                    values *= spikes[t, ch][:, None]
+                values = values.reshape(-1)
+            np.add.at(buffer.reshape(-1), idx.reshape(-1), values)
+
+
+class MultiUnitSynthesizer(SparseSpikeSynthesizer):
+    """
+    Sparse synthesizer for several units per channel. Each unit has its own
+    template (from a bank covering n_channels x n_units units) and its own
+    amplitude, and the waveforms of all units of a channel are summed.
+
+    Parameters
+    ----------
+    kernel : array of shape (n_taps,), or WaveformBank
+        Waveform shared by all units, or a bank with one entry per unit
+        (unit ``u`` of channel ``c`` is entry ``c * n_units + u``)
+    n_channels : int
+        Number of channels
+    n_units : int
+        Number of units per channel
+    amplitudes : array of shape (n_channels, n_units), optional
+        Amplitude of each unit, by default 1.0 for all units
+    scale : float, optional
+        Scale applied to the waveforms, by default 1.0
+    """
+
+    def __init__(self, kernel, n_channels, n_units, amplitudes=None,
+                 scale=1.0):
+        super().__init__(kernel, n_channels * n_units, scale=scale)
+
+        self.n_channels = n_channels
+        self.n_units = n_units
+        self.tail = np.zeros((self.n_taps - 1, n_channels))
+        self.buffer = np.zeros((self.n_taps - 1, n_channels))
+
+        if amplitudes is None:
+            amplitudes = np.ones((n_channels, n_units))
+        self.amplitudes = np.asarray(amplitudes, dtype=np.float64).reshape(-1)
+
+    def accumulate(self, spikes, buffer):
+        """
+        Add the waveforms of the spikes in ``spikes`` to ``buffer``
+
+        Parameters
+        ----------
+        spikes : bool array of shape (n_samples, n_channels, n_units)
+            Spike raster of each unit
+        buffer : array of shape (n_samples + n_taps - 1, n_channels)
+            Output buffer
+        """
+        t, ch, u = np.nonzero(spikes)
+        if t.size:
+            unit = ch * self.n_units + u
+            idx = (t[:, None] + self.taps) * self.n_channels + ch[:, None]
+            values = (self.kernels[self.bank.assignment[unit]] *
+                      self.amplitudes[unit][:, None])
+            np.add.at(buffer.reshape(-1), idx.reshape(-1), values.reshape(-1))
@@ -0,0 +1,145 @@
+import numpy as np
+
+
+class WaveformBank:
+    """
+    Set of spike waveform templates shared by index across channels.
+    Memory scales with the number of templates, not with the number of
+    channels: each channel only stores the index of its template.
+
+    Parameters
+    ----------
+    templates : array of shape (n_templates, n_taps)
+        Waveform templates (mV)
+    assignment : array of shape (n_channels,)
+        Index of the template used by each channel
+    dtype : str or dtype, optional
+        Storage type of the templates, 'float32' (default) or 'int16'. int16
+        templates are stored pre-scaled by ``scale`` and rounded.
+    scale : float, optional
+        Scale from mV to output units, by default 1.0
+    """
+
+    def __init__(self, templates, assignment, dtype='float32', scale=1.0):
+        templates = np.atleast_2d(np.asarray(templates, dtype=np.float64))
+        assignment = np.asarray(assignment)
+
+        if assignment.min() < 0 or assignment.max() >= templates.shape[0]:
+            raise ValueError(
+                f'Template assignment out of range for {templates.shape[0]} '
+                'templates')
+
+        self.dtype = np.dtype(dtype)
+        if self.dtype == np.int16:
+            self.templates = np.rint(templates * scale).astype(np.int16)
+            self.scale = 1.0
+        else:
+            self.templates = templates.astype(self.dtype)
+            self.scale = scale
+
+        self.assignment = assignment.astype(np.uint16)
+        self.n_templates, self.n_taps = self.templates.shape
+        self.n_channels = self.assignment.shape[0]
+
+        # channels grouped by template, so each template is applied once
+        self.groups = []
+        for t in np.unique(self.assignment):
+            channels = np.flatnonzero(self.assignment == t)
+            if channels.size == self.n_channels:
+                channels = slice(None)
+            self.groups.append((int(t), channels))
+
+    def kernels(self, scale=1.0):
+        """
+        Get the templates as float64 kernels in output units
+
+        Parameters
+        ----------
+        scale : float, optional
+            Additional scale applied to the templates, by default 1.0
+
+        Returns
+        -------
+        kernels : array of shape (n_templates, n_taps)
+        """
+        return self.templates.astype(np.float64) * (self.scale * scale)
+
+    @classmethod
+    def single(cls, template, n_channels, **kwargs):
+        """
+        Bank where every channel uses the same template
+
+        Parameters
+        ----------
+        template : array of shape (n_taps,)
+            Waveform template (mV)
+        n_channels : int
+            Number of channels
+        """
+        return cls(template, np.zeros(n_channels, dtype=np.uint16), **kwargs)
+
+    @classmethod
+    def from_file(cls, path, n_channels, seed=None, **kwargs):
+        """
+        Load templates from an .npy file holding an (n_templates, n_taps)
+        array, and assign them to channels at random
+
+        Parameters
+        ----------
+        path : str
+            Path to the .npy file
+        n_channels : int
+            Number of channels
+        seed : int, optional
+            Seed for the template assignment, by default None
+        """
+        templates = np.atleast_2d(np.load(path))
+        rng = np.random.default_rng(seed)
+        assignment = rng.integers(templates.shape[0], size=n_channels)
+        return cls(templates, assignment, **kwargs)
+
+    @classmethod
+    def generate(cls,
+                 n_templates,
+                 n_channels,
+                 n_taps=41,
+                 sample_rate=30000,
+                 seed=None,
+                 **kwargs):
+        """
+        Generate biphasic templates with random widths, trough depths and
+        repolarization amplitudes, and assign them to channels at random
+
+        Parameters
+        ----------
+        n_templates : int
+            Number of templates
+        n_channels : int
+            Number of channels
+        n_taps : int, optional
+            Length of the templates, by default 41
+        sample_rate : float, optional
+            Sample rate (Hz) of the templates, by default 30000
+        seed : int, optional
+            Seed for the templates and assignment, by default None
+        """
+        rng = np.random.default_rng(seed)
+        t = np.arange(n_taps) / sample_rate * 1e3  # ms
+
+        # trough at ~0.27 ms, followed by a slower repolarization peak
+        t_trough = rng.uniform(0.2, 0.33, size=(n_templates, 1))
+        w_trough = rng.uniform(0.07, 0.15, size=(n_templates, 1))
+        t_peak = t_trough + rng.uniform(0.25, 0.45, size=(n_templates, 1))
+        w_peak = rng.uniform(0.15, 0.35, size=(n_templates, 1))
+        depth = rng.uniform(0.4, 1.0, size=(n_templates, 1))
+        ratio = rng.uniform(0.15, 0.4, size=(n_templates, 1))
+
+        templates = depth * (
+            -np.exp(-0.5 * ((t - t_trough) / w_trough)**2) +
+            ratio * np.exp(-0.5 * ((t - t_peak) / w_peak)**2))
+        # start and end at zero
+        templates -= np.linspace(templates[:, :1], templates[:, -1:], n_taps,
+                                 axis=1)[..., 0]
+
+        assignment = rng.integers(n_templates, size=n_channels)
+        return cls(templates, assignment, **kwargs)
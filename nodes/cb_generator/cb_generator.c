@@ -51,6 +51,7 @@ struct timespec get_graph_load_timespec(redisContext *c);
 void shutdown_process();
 
 uint32_t parse_ip_str(char *ip_str);
+redisReply *get_entry_field(redisReply *fields, const char *name);
 
 int  initialize_broadcast_socket();
 //void initialize_realtime(char *yaml_path); // done
@@ -66,6 +67,7 @@ void error(char* msg, int ex);
 
 char NICKNAME[20] = "cb_generator";
 redisReply *reply;
+redisReply *data_reply = NULL;
 redisContext *redis_context;
 
 int one = 1, zero = 0;
@@ -194,15 +196,24 @@ int main(int argc_main, char **argv_main) {
 
     char *redis_data;
 
+    // entries may hold several 1 ms blocks (packed publish mode), which
+    // are served one per timer tick
+    int ms_per_entry = 0;
+    int ms_index = 0;
+    redisReply *ms_offsets = NULL;
+    uint32_t ms_bytes = cerebus_packets_per_SIGALRM * num_channels * 2;
+
     //////////////////////////////////
     // timing logging through redis
     //////////////////////////////////
 
     // number of arguments etc for calls to redis
-	int argc = 5; // number of arguments: "xadd NICKNAME * timestamps [timestamps]" **(index_sample [index_sample])
+	int argc = 9; // number of arguments: "xadd NICKNAME * timestamps [timestamps] input_id [input_id] input_ms [input_ms]"
 	size_t *argvlen = malloc(argc * sizeof(size_t)); // an array of the length of each argument put into Redis. This initializes the array
     int ind_xadd = 0; // xadd NICKNAME *
     int ind_timestamps = ind_xadd + 3; // timestamps [timestamps]
+    int ind_input_id = ind_timestamps + 2; // input_id [ID of the entry being sent]
+    int ind_input_ms = ind_input_id + 2; // input_ms [block of the entry being sent]
 
 	// allocating memory for the actual data being passed
 	int len = 16;  // maximum length of command entry
@@ -217,6 +228,12 @@ int main(int argc_main, char **argv_main) {
 	argv[ind_timestamps] = malloc(len);
 	argv[ind_timestamps+1] = malloc(sizeof(struct timeval));
 
+	// lineage of the data being sent
+	argv[ind_input_id] = malloc(len);
+	argv[ind_input_id+1] = malloc(sizeof(last_redis_id));
+	argv[ind_input_ms] = malloc(len);
+	argv[ind_input_ms+1] = malloc(len);
+
 	// populating the argv strings
 	// start with the "xadd NICKNAME"
 	argvlen[0] = sprintf(argv[0], "%s", "xadd"); // write the string "xadd" to the first position in argv, and put the length into argv
@@ -226,6 +243,8 @@ int main(int argc_main, char **argv_main) {
 	// and the samples array label
 	argvlen[ind_timestamps] = sprintf(argv[ind_timestamps], "%s", "timestamps");
 	argvlen[ind_timestamps+1] = sizeof(struct timeval);
+	argvlen[ind_input_id] = sprintf(argv[ind_input_id], "%s", "input_id");
+	argvlen[ind_input_ms] = sprintf(argv[ind_input_ms], "%s", "input_ms");
 
     printf("[%s] Starting main loop...\n", NICKNAME);
 
@@ -257,33 +276,57 @@ int main(int argc_main, char **argv_main) {
         }
         else
         {
-            freeReplyObject(reply); 
-            // Read new samples from redis stream (should be from a couple of ms back)
-            sprintf(redis_string, "xread count 1 streams %s %s", stream_name, last_redis_id);
-            reply = redisCommand(redis_context, redis_string);
-            if (reply == NULL || reply->type != REDIS_REPLY_ARRAY)
-            {
-                // The above redis call could maybe be blocking
-                continue;
-            }
-            else
+            // Read a new entry once the previous one has been fully sent
+            if (ms_index >= ms_per_entry)
             {
+                freeReplyObject(data_reply);
+                // Read new samples from redis stream (should be from a couple of ms back)
+                sprintf(redis_string, "xread count 1 streams %s %s", stream_name, last_redis_id);
+                data_reply = redisCommand(redis_context, redis_string);
+                if (data_reply == NULL || data_reply->type != REDIS_REPLY_ARRAY)
+                {
+                    // The above redis call could maybe be blocking
+                    freeReplyObject(data_reply);
+                    data_reply = NULL;
+                    continue;
+                }
+
                 // The xread value is nested:
                 // dim0 [0] The first stream (threshold_values)
                 // dim1 [1] Stream data
                 // dim2 [0+] The stream samples we're getting data from
                 // dim3 [0] The redis timestamp
-                // dim3 [1] The data content from the stream
-                // dim4 [13] The continuous data content from the stream
+                // dim3 [1] The data content from the stream, as field/value pairs
+                redisReply *entry = data_reply->element[0]->element[1]->element[0];
 
                 // Save timestamp/id of last redis sample
-                strcpy(last_redis_id, reply->element[0]->element[1]->element[0]->element[0]->str);  
-                // Copy redis data  
-                redis_data = reply->element[0]->element[1]->element[0]->element[1]->element[13]->str;
+                strcpy(last_redis_id, entry->element[0]->str);
+
+                redisReply *continuous = get_entry_field(entry->element[1], "continuous");
+                if (continuous == NULL)
+                {
+                    fprintf(stderr, "[%s] Entry %s has no 'continuous' field, skipping.\n", NICKNAME, last_redis_id);
+                    ms_per_entry = 0;
+                    continue;
+                }
+                redis_data = continuous->str;
 
+                // Packed entries carry n_ms blocks and their byte offsets
+                redisReply *n_ms = get_entry_field(entry->element[1], "n_ms");
+                ms_per_entry = (n_ms == NULL) ? 1 : atoi(n_ms->str);
+                ms_offsets = get_entry_field(entry->element[1], "ms_offsets");
+                ms_index = 0;
+            }
+
+            {
                 int num_cb_data_packets = 0;
                 int udp_packet_size = 0;
-                uint32_t buffer_ind = 0;            
+                uint32_t buffer_ind = ms_index * ms_bytes;
+                if (ms_offsets != NULL)
+                {
+                    memcpy(&buffer_ind, &ms_offsets->str[ms_index * sizeof(uint32_t)], sizeof(uint32_t));
+                }
+                ms_index++;
 
                 while(num_cb_data_packets < cerebus_packets_per_SIGALRM) {
 
@@ -349,6 +392,10 @@ int main(int argc_main, char **argv_main) {
                     // Update argvlen[timestamps+1]
                     argvlen[ind_timestamps+1] = sizeof(current_timespec);
 
+                    // Entry ID and block that were just sent
+                    argvlen[ind_input_id+1] = sprintf(argv[ind_input_id+1], "%s", last_redis_id);
+                    argvlen[ind_input_ms+1] = sprintf(argv[ind_input_ms+1], "%d", ms_index - 1);
+
                     // Send to redis
                     reply = redisCommandArgv(redis_context, argc,
                         (const char**) argv, argvlen);
@@ -617,6 +664,20 @@ uint32_t parse_ip_str(char *ip_str) {
     return ip_num;
 }
 
+//------------------------------------------------------------------
+// Find the value of a field in a stream entry by name. Returns NULL if
+// the entry has no such field
+//------------------------------------------------------------------
+redisReply *get_entry_field(redisReply *fields, const char *name)
+{
+    for (size_t i = 0; i + 1 < fields->elements; i += 2) {
+        if (strcmp(fields->element[i]->str, name) == 0) {
+            return fields->element[i + 1];
+        }
+    }
+    return NULL;
+}
+
 /*
 // Do we want the system to be realtime?  Setting the Scheduler to be real-time, priority 80
 void initialize_realtime(char *yaml_path) {
@@ -656,6 +717,7 @@ void shutdown_process() {
 	printf("[%s] Shutting down redis.\n", NICKNAME);
 
     freeReplyObject(reply); 
+    freeReplyObject(data_reply);
 	redisFree(redis_context);
 
 	printf("[%s] Exiting.\n", NICKNAME);
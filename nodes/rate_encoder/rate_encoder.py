@@ -0,0 +1,28 @@
+import gc
+from brand import BRANDNode
+from brand_simulator.rates import RateLoop
+
+
+class RateEncoderNode(BRANDNode):
+
+    def __init__(self):
+
+        super().__init__()
+
+        # reads, encodes and publishes with the model in 'encoder_model'
+        self.loop = RateLoop(self.r, self.NAME, self.parameters)
+
+    def run(self):
+        self.loop.run()
+
+
+if __name__ == "__main__":
+    gc.disable()
+
+    # setup
+    rate_encoder = RateEncoderNode()
+
+    # main
+    rate_encoder.run()
+
+    gc.collect()
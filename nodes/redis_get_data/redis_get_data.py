@@ -12,6 +12,7 @@ import sys
 import time
 import numpy as np
 from brand import BRANDNode
+from brand_simulator.aio import OverlappedIO, client_kwargs
 from redis import Redis
 from redis.exceptions import ConnectionError
 
@@ -19,6 +20,9 @@ class RedisGetData(BRANDNode):
     def __init__(self):
         
         super().__init__()
+
+        # set defaults
+        self.parameters.setdefault('async_io', False)
   
         self.redis_ext_host = self.parameters['redis_ext_host']
         self.redis_ext_port = self.parameters['redis_ext_port']
@@ -26,6 +30,7 @@ class RedisGetData(BRANDNode):
         self.input_fields = self.parameters['input_fields']
         #self.input_dtypes = self.parameters['input_dtypes']
         self.max_samples = self.parameters['max_samples']
+        self.async_io = self.parameters['async_io']
 
         try:
             self.r_ext = Redis(self.redis_ext_host, self.redis_ext_port, retry_on_timeout=True)
@@ -50,6 +55,10 @@ class RedisGetData(BRANDNode):
 
         logging.info(f'Receiving stream data from external Redis server...')
 
+        if self.async_io:
+            self.run_async()
+            return
+
         while True:
 
             try:
@@ -75,6 +84,33 @@ class RedisGetData(BRANDNode):
                 logging.info(f"Error with external Redis connection: {e}")
                 time.sleep(1)
 
+    def run_async(self):
+
+        # the external read of the next entry overlaps with the local write
+        # of this one
+        while True:
+            self.io = OverlappedIO(client_kwargs(self.r_ext),
+                                   client_kwargs(self.r),
+                                   self.input_stream,
+                                   last_id=self.last_id)
+            self.io.start()
+
+            try:
+                while True:
+                    self.reply = self.io.read()
+
+                    self.dataFrame = self.reply[0][1][0]
+                    self.last_id = self.dataFrame[0]
+
+                    self.io.xadd(self.input_stream, self.dataFrame[1], maxlen=self.max_samples, approximate=True)
+
+                    self.i += np.uint32(1)
+
+            except ConnectionError as e:
+                logging.info(f"Error with external Redis connection: {e}")
+                self.io.stop()
+                time.sleep(1)
+
 
 if __name__ == "__main__":
     gc.disable()
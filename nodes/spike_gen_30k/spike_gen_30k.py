@@ -5,15 +5,56 @@ import os
 import signal
 import sys
 import time
-from scipy.signal import fftconvolve
 import numpy as np
 from brand import BRANDNode
+from brand_simulator.aio import OverlappedIO
+from brand_simulator.instrumentation import LoopRecorder
+from brand_simulator.lineage import read_origin
+from brand_simulator.pacing import DeadlineScheduler
+from brand_simulator.publish import BlockPublisher
+from brand_simulator.schema import (RECORD_FIELD, decode, load_schema,
+                                    new_records, publish_schema,
+                                    record_dtype)
+from brand_simulator.sharding import make_generator
 
 class SpikeGenerator30k(BRANDNode):
     def __init__(self):
 
         super().__init__()
 
+        # set defaults
+        self.parameters.setdefault('spike_sampler', 'bernoulli')
+        self.parameters.setdefault('synthesis', 'sparse')
+        self.parameters.setdefault('waveform_file', None)
+        self.parameters.setdefault('n_waveforms', 1)
+        self.parameters.setdefault('waveform_dtype', 'float32')
+        self.parameters.setdefault('units_per_channel', 1)
+        self.parameters.setdefault('noise_rms', 0)
+        self.parameters.setdefault('noise_type', 'pink')
+        self.parameters.setdefault('noise_band', [1, 7500])
+        self.parameters.setdefault('lfp_rms', 0)
+        self.parameters.setdefault('noise_buffer_s', 2.0)
+        self.parameters.setdefault('threshold_source', 'spikes')
+        self.parameters.setdefault('threshold_mult', -4.5)
+        self.parameters.setdefault('rms_window_s', 1.0)
+        self.parameters.setdefault('glm_link', 'exp')
+        self.parameters.setdefault('refractory_period', 60)
+        self.parameters.setdefault('history_amp', [-4.0, -0.5])
+        self.parameters.setdefault('history_tau_ms', [1.0, 20.0])
+        self.parameters.setdefault('coupling_amp', 0)
+        self.parameters.setdefault('coupling_tau_ms', 5.0)
+        self.parameters.setdefault('n_threads', 1)
+        self.parameters.setdefault('publish_mode', 'per_ms')
+        self.parameters.setdefault('async_io', False)
+        self.parameters.setdefault('pace_output', False)
+        self.parameters.setdefault('spin_us', 50)
+        self.parameters.setdefault('stream_format', 'fields')
+        self.parameters.setdefault('latency_stream', 'latency_stats')
+        self.parameters.setdefault('latency_interval', 1.0)
+        # processing must be done before the next firing-rate sample
+        self.parameters.setdefault('loop_deadline_ms',
+                                   1000 / self.parameters['fr_sample_rate'])
+
         # load parameters
         self.fr_sample_rate = self.parameters['fr_sample_rate']
         self.sample_rate = self.parameters['sample_rate']
@@ -26,13 +67,41 @@ class SpikeGenerator30k(BRANDNode):
         self.n_start = self.parameters['n_start']
         self.n_end = self.parameters['n_end']
         self.max_samples = self.parameters['max_samples']
+        self.spike_sampler = self.parameters['spike_sampler']
+        self.synthesis = self.parameters['synthesis']
+        self.waveform_file = self.parameters['waveform_file']
+        self.n_waveforms = self.parameters['n_waveforms']
+        self.waveform_dtype = self.parameters['waveform_dtype']
+        self.n_units = self.parameters['units_per_channel']
+        self.noise_rms = self.parameters['noise_rms']
+        self.noise_type = self.parameters['noise_type']
+        self.noise_band = self.parameters['noise_band']
+        self.lfp_rms = self.parameters['lfp_rms']
+        self.noise_buffer_s = self.parameters['noise_buffer_s']
+        self.threshold_source = self.parameters['threshold_source']
+        self.threshold_mult = self.parameters['threshold_mult']
+        self.rms_window_s = self.parameters['rms_window_s']
+        self.refractory_period = self.parameters['refractory_period'] # samples, used by the 'glm' spike_sampler
+        self.publish_mode = self.parameters['publish_mode']
+        self.async_io = self.parameters['async_io']
+        self.pace_output = self.parameters['pace_output']
+        self.spin_us = self.parameters['spin_us']
+        self.stream_format = self.parameters['stream_format']
+        self.latency_stream = self.parameters['latency_stream']
+        self.latency_interval = self.parameters['latency_interval']
+        self.loop_deadline_ms = self.parameters['loop_deadline_ms']
 
         # compute derived parameters
         self.period = 1/self.sample_rate
         self.fr_iterations = int(self.sample_rate/self.fr_sample_rate) # process loops per firing rate sample 
         self.ms_iterations = int(self.continuous_rate/self.sample_rate) # 30khz samples per process loop
-        self.buffer_window = int(self.continuous_rate*0.001) # 1ms buffer for 30khz samples
         self.n_neurons = self.n_end - self.n_start
+        self.loop_deadline = self.loop_deadline_ms / 1e3
+
+        # the binary format stamps integer ns instead of float seconds
+        self.binary = self.stream_format == 'binary'
+        self.clock = time.monotonic_ns if self.binary else time.monotonic
+        self.fr_dtype = None
 
         logging.info(f'Sampling period: {self.period}')
 
@@ -43,26 +112,12 @@ class SpikeGenerator30k(BRANDNode):
         self.last_time = time.monotonic()
 
         self.rates = None
-        self.rates_sub = None
-        self.rates_rep = None
-        self.modified_rates = None
-        self.spike_counts = None
-        self.spikes = None
-
-        self.refractory_period = 60 # refractory period of 2ms
-        self.spike_last_samples = self.refractory_period
+        self.rates_buf = None  # decoded rates, sized by the first input
 
-        self.buffer30k_spikes = np.zeros((self.fr_iterations*self.ms_iterations+self.buffer_window, self.n_neurons))
-        self.buffer30k_continuous = np.zeros((self.fr_iterations*self.ms_iterations+self.buffer_window, self.n_neurons))
-        self.buffer30k_window = np.zeros((self.buffer_window, self.n_neurons))
-
-        self.ap = np.array([[0, -0.1, -0.2, -0.3, -0.4, -0.5, -0.6, -0.7, -0.8, 
-                            -0.7, -0.6, -0.5, -0.4, -0.3, -0.2, -0.1, 0,
-                            0.05, 0.1, 0.15, 0.2,
-                            0.19, 0.18, 0.17, 0.16, 0.15, 0.14, 0.13, 0.12, 0.11, 0.10, 
-                            0.09, 0.08, 0.07, 0.06, 0.05, 0.04, 0.03, 0.02, 0.01, 0]]).T
-
-        self.ap = np.tile(self.ap, (1, self.n_neurons))
+        # spike sampling and continuous data synthesis, shared with the
+        # offline engine (brand_simulator.offline); with n_threads > 1, the
+        # channels are split across a pool of threads
+        self.generator = make_generator(self.parameters)
 
         self.sample = {
             'ts_start': float(),  # time at which we start XREAD
@@ -71,11 +126,70 @@ class SpikeGenerator30k(BRANDNode):
             'ts_end': float(),  # time at which XADD is complete
             'i': int(),
             'i_in': int(),
+            'origin_i': int(),  # index of the originating mouse sample
+            'origin_ts': int(),  # time (ns) of the originating mouse sample
         }
 
     def build(self):
 
-        np.random.seed(self.random_seed)
+        self.generator.build()
+        self.generator.start()
+
+        # all fields are sent from these buffers, one block at a time
+        self.records = None
+        detect = self.generator.threshold_source == 'continuous'
+        if self.binary:
+            payload = [('thresholds', 'i1', (self.n_neurons, ))]
+            if detect:
+                payload.append(('spike_counts', 'i1', (self.n_neurons, )))
+            self.records = new_records(record_dtype(payload), self.fr_iterations)
+            publish_schema(self.r, self.output_stream, self.records.dtype)
+            fields = {'continuous': self.generator.continuous}
+        elif detect:
+            fields = {
+                'continuous': self.generator.continuous,
+                'thresholds': self.generator.thresholds,
+                'spike_counts': self.generator.spike_counts,
+            }
+        else:
+            fields = {
+                'continuous': self.generator.continuous,
+                'thresholds': self.generator.spike_counts,
+            }
+        # optionally spread writes over absolute deadlines, re-anchored on
+        # each input, instead of sending them back-to-back when it arrives
+        self.scheduler = None
+        if self.pace_output:
+            write_period = self.period if self.publish_mode == 'per_ms' else self.period * self.fr_iterations
+            self.scheduler = DeadlineScheduler(write_period, spin=self.spin_us * 1e-6)
+            self.pacing_log_interval = int(10 / self.period)
+        # optionally overlap the next read and this block's writes with
+        # computation, on separate connections
+        self.io = None
+        if self.async_io:
+            self.io = OverlappedIO.from_client(self.r,
+                                               self.fr_stream,
+                                               last_id=self.last_id)
+        writer = self.r if self.io is None else self.io
+        self.publisher = BlockPublisher(writer,
+                                        self.output_stream,
+                                        self.fr_iterations,
+                                        fields,
+                                        mode=self.publish_mode,
+                                        maxlen=self.max_samples,
+                                        scheduler=self.scheduler,
+                                        records=self.records)
+        logging.info(f'Publishing in {self.publish_mode} mode ({self.stream_format} format)')
+
+        # per-phase loop timing, summarized to the latency stream
+        self.recorder = LoopRecorder(self.r,
+                                     self.NAME,
+                                     stream=self.latency_stream,
+                                     interval=self.latency_interval,
+                                     deadline=self.loop_deadline)
+
+        if self.io is not None:
+            self.io.start()
 
     def run(self):
             
@@ -87,47 +201,65 @@ class SpikeGenerator30k(BRANDNode):
 
         # send samples to Redis
         while True:
-            self.sample['ts_start'] = time.monotonic()
-            self.streams = self.r.xread(streams={self.fr_stream: self.last_id}, block=0, count=1)
+            self.sample['ts_start'] = self.clock()
+            self.recorder.begin()
+            if self.io is not None:
+                self.streams = self.io.read()
+            else:
+                self.streams = self.r.xread(streams={self.fr_stream: self.last_id}, block=0, count=1)
             
             self.last_time = time.monotonic()
-            self.sample['ts_in'] = self.last_time
+            self.sample['ts_in'] = self.clock()
             
             self.stream_name, self.stream_entries = self.streams[0]
             self.entry_id, self.entry_dict = self.stream_entries[0]
             self.last_id = self.entry_id
 
-            # TODO: pre-allocate self.rates
-            self.rates = np.frombuffer(self.entry_dict[b'rates'],
-                                        dtype=np.float32)
-            self.rates_sub = self.rates[self.n_start:self.n_end]
-            self.rate_rep = np.tile(self.rates_sub, (self.fr_iterations*self.ms_iterations,1))
-            
-            self.sample['i_in'] = self.entry_dict[b'i_in']
-
-            # copy spikes from last segment of previous loop to from segment of current loop
-            self.buffer30k_spikes[:self.buffer_window,:] = self.buffer30k_spikes[-self.buffer_window:,:]
-            # generate spikes for samples after intial segment buffer (rates scaled to spks/30khz-window) 
-            self.buffer30k_spikes[self.buffer_window:,:] = np.random.binomial(1, self.rate_rep / self.continuous_rate)
-            # generate continuous data, by convolving spikes with AP waveform, and scaling voltage
-            self.buffer30k_continuous = self.scale*fftconvolve(self.buffer30k_spikes, self.ap, 
-                mode='full', axes=0)[:self.fr_iterations*self.ms_iterations+self.buffer_window]
-
-            self.ii = self.buffer_window # start indexing from after buffer window
-            for s in range(0, self.fr_iterations):
-
-                self.sample['i'] = self.i
-                # senf data in 'ms_iterations' (1ms) chunks
-                self.sample['continuous'] = (self.buffer30k_continuous[self.ii:self.ii+self.ms_iterations,:]).astype(np.int16).tobytes()
-                self.sample['thresholds'] = self.buffer30k_spikes[self.ii:self.ii+self.ms_iterations,:].sum(axis=0).astype(np.int8).tobytes()                    
-
-                self.sample['ts'] = time.monotonic()
-                self.r.xadd(self.output_stream, self.sample, maxlen=self.max_samples, approximate=True)
-                
-                self.sample['ts_end'] = time.monotonic()
-                
-                self.i += 1
-                self.ii += self.ms_iterations
+            rec = self.entry_dict.get(RECORD_FIELD)
+            if rec is not None:
+                # binary input, decoded in place
+                if self.fr_dtype is None:
+                    self.fr_dtype = load_schema(self.r, self.fr_stream)
+                self.fr_record = decode(rec, self.fr_dtype)
+                self.rates = self.fr_record['rates'][0]
+                i_in = int(self.fr_record['i_in'][0])
+            else:
+                self.fr_record = None
+                rates = np.frombuffer(self.entry_dict[b'rates'],
+                                      dtype=np.float32)
+                if self.rates_buf is None or self.rates_buf.shape != rates.shape:
+                    self.rates_buf = np.zeros(rates.shape, dtype=np.float32)
+                np.copyto(self.rates_buf, rates)
+                self.rates = self.rates_buf
+                i_in = self.entry_dict[b'i_in']
+
+            self.sample['i_in'] = int(i_in) if self.binary else i_in
+            self.sample['origin_i'], self.sample['origin_ts'] = read_origin(
+                self.entry_dict, self.fr_record)
+            self.recorder.lap()
+
+            # this block's writes are due every write period from the
+            # input's arrival
+            if self.scheduler is not None:
+                self.scheduler.start(int(self.last_time * 1e9))
+
+            # generate spikes and continuous data for this block
+            self.generator.process(self.rates)
+            if self.records is not None:
+                self.records['thresholds'] = self.generator.thresholds
+                if self.generator.threshold_source == 'continuous':
+                    self.records['spike_counts'] = self.generator.spike_counts
+
+            self.recorder.lap()
+
+            # send data in 'ms_iterations' (1ms) chunks
+            self.sample['i'] = self.i
+            self.publisher.publish(self.sample)
+            self.i = self.sample['i']
+            self.recorder.lap()
+
+            if self.scheduler is not None and self.i % self.pacing_log_interval == 0:
+                logging.info(f'Output lateness: {self.scheduler.summary()}')
 
 
         logging.info('Exiting')
@@ -0,0 +1,247 @@
+import gc
+import logging
+import time
+import numpy as np
+from brand import BRANDNode
+from brand_simulator.aio import OverlappedIO
+from brand_simulator.instrumentation import LoopRecorder
+from brand_simulator.lineage import read_origin
+from brand_simulator.pacing import DeadlineScheduler
+from brand_simulator.publish import BlockPublisher
+from brand_simulator.schema import (RECORD_FIELD, decode, load_schema,
+                                    new_records, publish_schema,
+                                    record_dtype)
+from brand_simulator.sharding import ShardPool
+
+class SpikeGenerator30kMP(BRANDNode):
+    """
+    spike_gen_30k with its channels split across worker processes. The
+    node reads each firing-rate sample once, shares it with the workers
+    through shared memory, and publishes the block they fill as a single
+    stream, so one node covers all channels.
+    """
+    def __init__(self):
+
+        super().__init__()
+
+        # set defaults
+        self.parameters.setdefault('n_workers', 2)
+        self.parameters.setdefault('worker_cpus', None)
+        self.parameters.setdefault('spike_sampler', 'bernoulli')
+        self.parameters.setdefault('synthesis', 'sparse')
+        self.parameters.setdefault('waveform_file', None)
+        self.parameters.setdefault('n_waveforms', 1)
+        self.parameters.setdefault('waveform_dtype', 'float32')
+        self.parameters.setdefault('units_per_channel', 1)
+        self.parameters.setdefault('noise_rms', 0)
+        self.parameters.setdefault('noise_type', 'pink')
+        self.parameters.setdefault('noise_band', [1, 7500])
+        self.parameters.setdefault('lfp_rms', 0)
+        self.parameters.setdefault('noise_buffer_s', 2.0)
+        self.parameters.setdefault('threshold_source', 'spikes')
+        self.parameters.setdefault('threshold_mult', -4.5)
+        self.parameters.setdefault('rms_window_s', 1.0)
+        self.parameters.setdefault('glm_link', 'exp')
+        self.parameters.setdefault('refractory_period', 60)
+        self.parameters.setdefault('history_amp', [-4.0, -0.5])
+        self.parameters.setdefault('history_tau_ms', [1.0, 20.0])
+        self.parameters.setdefault('coupling_amp', 0)
+        self.parameters.setdefault('coupling_tau_ms', 5.0)
+        self.parameters.setdefault('publish_mode', 'per_ms')
+        self.parameters.setdefault('async_io', False)
+        self.parameters.setdefault('pace_output', False)
+        self.parameters.setdefault('spin_us', 50)
+        self.parameters.setdefault('stream_format', 'fields')
+        self.parameters.setdefault('latency_stream', 'latency_stats')
+        self.parameters.setdefault('latency_interval', 1.0)
+        # processing must be done before the next firing-rate sample
+        self.parameters.setdefault('loop_deadline_ms',
+                                   1000 / self.parameters['fr_sample_rate'])
+
+        # load parameters
+        self.fr_sample_rate = self.parameters['fr_sample_rate']
+        self.sample_rate = self.parameters['sample_rate']
+        self.fr_stream = self.parameters['input_stream']
+        self.output_stream = self.parameters['output_stream']
+        self.n_start = self.parameters['n_start']
+        self.n_end = self.parameters['n_end']
+        self.max_samples = self.parameters['max_samples']
+        self.n_workers = self.parameters['n_workers']
+        self.publish_mode = self.parameters['publish_mode']
+        self.async_io = self.parameters['async_io']
+        self.pace_output = self.parameters['pace_output']
+        self.spin_us = self.parameters['spin_us']
+        self.stream_format = self.parameters['stream_format']
+        self.latency_stream = self.parameters['latency_stream']
+        self.latency_interval = self.parameters['latency_interval']
+        self.loop_deadline_ms = self.parameters['loop_deadline_ms']
+
+        # compute derived parameters
+        self.period = 1/self.sample_rate
+        self.fr_iterations = int(self.sample_rate/self.fr_sample_rate) # process loops per firing rate sample
+        self.n_neurons = self.n_end - self.n_start
+        self.loop_deadline = self.loop_deadline_ms / 1e3
+
+        # the binary format stamps integer ns instead of float seconds
+        self.binary = self.stream_format == 'binary'
+        self.clock = time.monotonic_ns if self.binary else time.monotonic
+        self.fr_dtype = None
+
+        logging.info(f'Sampling period: {self.period}')
+
+        self.i = 0  # initialize sample # variable
+
+        self.last_id = b'$'
+
+        self.rates = None
+
+        # channel shards, generated in worker processes
+        self.generator = ShardPool.from_parameters(self.parameters)
+
+        self.sample = {
+            'ts_start': float(),  # time at which we start XREAD
+            'ts_in': float(),  # time at which the input is received
+            'ts': float(),  # time at which the output is written
+            'ts_end': float(),  # time at which XADD is complete
+            'i': int(),
+            'i_in': int(),
+            'origin_i': int(),  # index of the originating mouse sample
+            'origin_ts': int(),  # time (ns) of the originating mouse sample
+        }
+
+    def build(self):
+
+        # fork the workers before anything else holds memory
+        self.generator.build()
+
+        # all fields are sent from the shared output blocks
+        self.records = None
+        detect = self.generator.threshold_source == 'continuous'
+        if self.binary:
+            payload = [('thresholds', 'i1', (self.n_neurons, ))]
+            if detect:
+                payload.append(('spike_counts', 'i1', (self.n_neurons, )))
+            self.records = new_records(record_dtype(payload), self.fr_iterations)
+            publish_schema(self.r, self.output_stream, self.records.dtype)
+            fields = {'continuous': self.generator.continuous}
+        elif detect:
+            fields = {
+                'continuous': self.generator.continuous,
+                'thresholds': self.generator.thresholds,
+                'spike_counts': self.generator.spike_counts,
+            }
+        else:
+            fields = {
+                'continuous': self.generator.continuous,
+                'thresholds': self.generator.spike_counts,
+            }
+        # optionally spread writes over absolute deadlines, instead of
+        # sending them back-to-back when the input arrives
+        self.scheduler = None
+        if self.pace_output:
+            write_period = self.period if self.publish_mode == 'per_ms' else self.period * self.fr_iterations
+            self.scheduler = DeadlineScheduler(write_period, spin=self.spin_us * 1e-6)
+            self.pacing_log_interval = int(10 / self.period)
+        # optionally overlap the next read and this block's writes with
+        # computation, on separate connections
+        self.io = None
+        if self.async_io:
+            self.io = OverlappedIO.from_client(self.r,
+                                               self.fr_stream,
+                                               last_id=self.last_id)
+        writer = self.r if self.io is None else self.io
+        self.publisher = BlockPublisher(writer,
+                                        self.output_stream,
+                                        self.fr_iterations,
+                                        fields,
+                                        mode=self.publish_mode,
+                                        maxlen=self.max_samples,
+                                        scheduler=self.scheduler,
+                                        records=self.records)
+        logging.info(f'Publishing in {self.publish_mode} mode ({self.stream_format} format)')
+
+        # per-phase loop timing, summarized to the latency stream
+        self.recorder = LoopRecorder(self.r,
+                                     self.NAME,
+                                     stream=self.latency_stream,
+                                     interval=self.latency_interval,
+                                     deadline=self.loop_deadline)
+
+        if self.io is not None:
+            self.io.start()
+
+    def run(self):
+
+        logging.info(f'Publishing continuous neural data for {self.n_neurons} channels: ({self.n_start} thru {self.n_end}) '
+                     f'with {self.n_workers} workers...')
+
+        self.build()
+
+        # send samples to Redis
+        while True:
+            self.sample['ts_start'] = self.clock()
+            self.recorder.begin()
+            if self.io is not None:
+                self.streams = self.io.read()
+            else:
+                self.streams = self.r.xread(streams={self.fr_stream: self.last_id}, block=0, count=1)
+
+            self.sample['ts_in'] = self.clock()
+
+            self.stream_name, self.stream_entries = self.streams[0]
+            self.entry_id, self.entry_dict = self.stream_entries[0]
+            self.last_id = self.entry_id
+
+            rec = self.entry_dict.get(RECORD_FIELD)
+            if rec is not None:
+                # binary input, decoded in place
+                if self.fr_dtype is None:
+                    self.fr_dtype = load_schema(self.r, self.fr_stream)
+                self.fr_record = decode(rec, self.fr_dtype)
+                self.rates = self.fr_record['rates'][0]
+                i_in = int(self.fr_record['i_in'][0])
+            else:
+                self.fr_record = None
+                self.rates = np.frombuffer(self.entry_dict[b'rates'],
+                                           dtype=np.float32)
+                i_in = self.entry_dict[b'i_in']
+
+            self.sample['i_in'] = int(i_in) if self.binary else i_in
+            self.sample['origin_i'], self.sample['origin_ts'] = read_origin(
+                self.entry_dict, self.fr_record)
+            self.recorder.lap()
+
+            # the workers generate their shards of this block
+            self.generator.process(self.rates)
+            if self.records is not None:
+                self.records['thresholds'] = self.generator.thresholds
+                if self.generator.threshold_source == 'continuous':
+                    self.records['spike_counts'] = self.generator.spike_counts
+
+            self.recorder.lap()
+
+            # send data in 'ms_iterations' (1ms) chunks
+            self.sample['i'] = self.i
+            self.publisher.publish(self.sample)
+            self.i = self.sample['i']
+            self.recorder.lap()
+
+            if self.scheduler is not None and self.i % self.pacing_log_interval == 0:
+                logging.info(f'Output lateness: {self.scheduler.summary()}')
+
+    def terminate(self, sig, frame):
+        # stop the workers and free the shared memory
+        self.generator.stop()
+        super().terminate(sig, frame)
+
+
+if __name__ == "__main__":
+    gc.disable()
+
+    # setup
+    spike_generator = SpikeGenerator30kMP()
+
+    # main
+    spike_generator.run()
+
+    gc.collect()
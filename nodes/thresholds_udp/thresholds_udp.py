@@ -11,6 +11,11 @@ import time
 import numpy as np
 
 from brand import BRANDNode
+from brand_simulator.aio import OverlappedIO
+from brand_simulator.instrumentation import LoopRecorder
+from brand_simulator.lineage import read_origin
+from brand_simulator.pacing import DeadlineScheduler
+from brand_simulator.schema import RECORD_FIELD, decode, load_schema
 
 
 class SpikeGenerator(BRANDNode):
@@ -18,6 +23,14 @@ class SpikeGenerator(BRANDNode):
 
         super().__init__()
 
+        self.parameters.setdefault('spin_us', 50)
+        self.parameters.setdefault('async_io', False)
+        self.parameters.setdefault('latency_stream', 'latency_stats')
+        self.parameters.setdefault('latency_interval', 1.0)
+        # processing must be done before the next firing-rate sample
+        self.parameters.setdefault('loop_deadline_ms',
+                                   1000 / self.parameters['fr_sample_rate'])
+
         self.fr_sample_rate = self.parameters['fr_sample_rate']
         self.sample_rate = self.parameters['sample_rate']
         self.random_seed = self.parameters['random_seed']
@@ -29,9 +42,15 @@ class SpikeGenerator(BRANDNode):
         self.UDP_IP = self.parameters['udp_ip']
         self.UDP_PORT = self.parameters['udp_port']
         self.UDP_INTERFACE = self.parameters['udp_interface']
+        self.spin_us = self.parameters['spin_us']
+        self.async_io = self.parameters['async_io']
+        self.latency_stream = self.parameters['latency_stream']
+        self.latency_interval = self.parameters['latency_interval']
+        self.loop_deadline_ms = self.parameters['loop_deadline_ms']
 
         self.period = 1/self.sample_rate
         self.fr_iterations = int(self.sample_rate/self.fr_sample_rate)
+        self.loop_deadline = self.loop_deadline_ms / 1e3
         
         logging.info(f'Sampling period: {self.period}')
 
@@ -40,7 +59,9 @@ class SpikeGenerator(BRANDNode):
         self.last_id = '$'
         self.last_time = time.monotonic()
 
+        self.fr_dtype = None
         self.rates = None
+        self.rates_buf = np.zeros(self.n_neurons, dtype=np.float32)  # decoded rates
         self.rates_sub = None
         self.rates_rep = None
         self.modified_rates = None
@@ -59,7 +80,9 @@ class SpikeGenerator(BRANDNode):
             'ts': float(),  # time at which the output is written
             'ts_end': float(),  # time at which XADD is complete
             'i': int(),
-            'i_in': int()
+            'i_in': int(),
+            'origin_i': int(),  # index of the originating mouse sample
+            'origin_ts': int()  # time (ns) of the originating mouse sample
         }
  
         self.sock = socket.socket(
@@ -98,6 +121,30 @@ class SpikeGenerator(BRANDNode):
 
         np.random.seed(self.random_seed)
 
+        # one absolute deadline per output sample, re-anchored on each input
+        self.scheduler = DeadlineScheduler(self.period, spin=self.spin_us * 1e-6)
+        self.pacing_log_interval = int(10 / self.period)
+
+        # loop timing, summarized to the latency stream; samples are drawn
+        # and sent in one paced phase
+        self.recorder = LoopRecorder(self.r,
+                                     self.NAME,
+                                     phases=('read', 'publish'),
+                                     stream=self.latency_stream,
+                                     interval=self.latency_interval,
+                                     deadline=self.loop_deadline)
+
+        # optionally overlap the next read and the writes with the paced
+        # sends, on separate connections
+        self.io = None
+        self.writer = self.r
+        if self.async_io:
+            self.io = OverlappedIO.from_client(self.r,
+                                               self.fr_stream,
+                                               last_id=self.last_id)
+            self.io.start()
+            self.writer = self.io
+
     def run(self):
 
         logging.info(f'Publishing continuous neural data for {self.n_neurons} channels...')
@@ -110,7 +157,11 @@ class SpikeGenerator(BRANDNode):
         # send samples to Redis
         while True:
             self.sample['ts_start'] = time.monotonic()
-            self.streams = self.r.xread(streams={self.fr_stream: self.last_id}, block=0, count=1)
+            self.recorder.begin()
+            if self.io is not None:
+                self.streams = self.io.read()
+            else:
+                self.streams = self.r.xread(streams={self.fr_stream: self.last_id}, block=0, count=1)
 
             self.last_time = time.monotonic()
 
@@ -120,10 +171,27 @@ class SpikeGenerator(BRANDNode):
             self.entry_id, self.entry_dict = self.stream_entries[0]
             self.last_id = self.entry_id
 
-            # TODO: pre-allocate self.rates
-            self.rates = np.frombuffer(self.entry_dict[b'rates'], dtype=np.float32)            
-
-            self.sample['i_in'] = self.entry_dict[b'i_in']
+            rec = self.entry_dict.get(RECORD_FIELD)
+            if rec is not None:
+                # binary input, decoded in place
+                if self.fr_dtype is None:
+                    self.fr_dtype = load_schema(self.r, self.fr_stream)
+                self.fr_record = decode(rec, self.fr_dtype)
+                self.rates = self.fr_record['rates'][0]
+                self.sample['i_in'] = int(self.fr_record['i_in'][0])
+            else:
+                self.fr_record = None
+                np.copyto(self.rates_buf,
+                          np.frombuffer(self.entry_dict[b'rates'], dtype=np.float32))
+                self.rates = self.rates_buf
+                self.sample['i_in'] = self.entry_dict[b'i_in']
+            self.sample['origin_i'], self.sample['origin_ts'] = read_origin(
+                self.entry_dict, self.fr_record)
+            self.recorder.lap()
+
+            # this block's samples are due every period from the input's
+            # arrival, as with the original busy-wait loop
+            self.scheduler.start(int(self.last_time * 1e9))
 
             for s in range(0, self.fr_iterations):
 
@@ -132,14 +200,13 @@ class SpikeGenerator(BRANDNode):
                 self.sample['i'] = self.i
                 self.sample['thresholds'] = self.buffer1k_spikes.astype(np.int8).tobytes()                    
 
-                # wait before sending sample (should replace with clock_nanosleep)
-                while time.monotonic() < self.last_time + s*self.period: 
-                    time.sleep(1e-6)
+                # wait for this sample's deadline
+                self.scheduler.wait()
 
                 self.sample['ts'] = time.monotonic()
                 sync_dict['count'] += 1
                 self.sample['sync'] = json.dumps(sync_dict)
-                self.r.xadd(self.output_stream, self.sample, maxlen=self.max_samples, approximate=True)
+                self.writer.xadd(self.output_stream, self.sample, maxlen=self.max_samples, approximate=True)
                 
                 self.sample['ts_end'] = time.monotonic()
                 
@@ -147,6 +214,11 @@ class SpikeGenerator(BRANDNode):
 
                 self.i += 1
 
+                if self.i % self.pacing_log_interval == 0:
+                    logging.info(f'Output lateness: {self.scheduler.summary()}')
+
+            self.recorder.lap()
+
 
         logging.info('Exiting')
 
@@ -10,12 +10,11 @@ import json
 import logging
 import coloredlogs
 import subprocess
-from tqdm.auto import tqdm
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
-from brand.timing import timespecs_to_timestamps, timevals_to_timestamps
-from struct import unpack
+from brand_simulator.alignment import align
+from brand_simulator.streams import Field, read_stream
 import pickle
 from datetime import datetime
 
@@ -42,118 +41,81 @@ N_CHANNELS_ARRAY = int(N_CHANNELS)
 # %%
 # Load stream data
 
-decoded_streams  = {}
+def spike_gen_fields(suffix):
+    return {
+        f'ts_start_{suffix}': Field(kind='text', key=b'ts_start'),
+        f'ts_in_{suffix}': Field(kind='text', key=b'ts_in'),
+        f'ts_{suffix}': Field(kind='text', key=b'ts'),
+        f'ts_end_{suffix}': Field(kind='text', key=b'ts_end'),
+        f'i_{suffix}': Field(np.int64, kind='text', key=b'i'),
+        f'i_in_{suffix}': Field(np.int64, kind='text', key=b'i_in'),
+        f'continuous_{suffix}': Field(np.int16, (-1, N_CHANNELS_ARRAY), key=b'continuous'),
+        f'thresholds_{suffix}': Field(np.int8, (-1, ), key=b'thresholds'),
+    }
+
+def scalar_frame(columns, index):
+    # only 1-D columns go in the DataFrame, arrays stay in `columns`
+    df = pd.DataFrame({name: col for name, col in columns.items() if col.ndim == 1})
+    return df.set_index(index)
+
+streams = {}
 
 if b'mouse_vel' in r.keys('*'):
-    stream_data = r.xrange(b'mouse_vel')
-    out = [None] * len(stream_data)
-    for i, (entry_id, entry_data) in tqdm(enumerate(stream_data)):
-        mouse_dict = {
-            'i': int.from_bytes(entry_data[b'index'], "little", signed=True),
-            'mouse_data': unpack('3h', entry_data[b'samples'])
-        }
-        entry_dec = {
-            'i_in': mouse_dict['i'],
-            'ts_mouse': timespecs_to_timestamps(entry_data[b'timestamps'])[0],
-            'mouse_vel_x': mouse_dict['mouse_data'][0],
-            'mouse_vel_y': mouse_dict['mouse_data'][1],
-        }
-        out[i] = entry_dec
-    decoded_streams['mouse_vel'] = out
-
-mouse_df = pd.DataFrame(decoded_streams['mouse_vel'])
-mouse_df.set_index('i_in', inplace=True)
+    streams['mouse_vel'] = read_stream(r, b'mouse_vel', {
+        'i_mouse': Field(np.int32, key=b'index'),
+        'ts_mouse': Field(kind='timespec', key=b'timestamps'),
+        'mouse_data': Field(np.int16, (3, ), key=b'samples'),
+    })
+    streams['mouse_vel']['mouse_vel_x'] = streams['mouse_vel']['mouse_data'][:, 0]
+    streams['mouse_vel']['mouse_vel_y'] = streams['mouse_vel']['mouse_data'][:, 1]
 
 if b'firing_rates' in r.keys('*'):
-    stream_data = r.xrange(b'firing_rates')
-    out = [None] * len(stream_data)
-    for i, (entry_id, entry_data) in tqdm(enumerate(stream_data)):
-        entry_dec = {
-            'ts_start_fr': float(entry_data[b'ts_start']),
-            'ts_fr': float(entry_data[b'ts']),
-            'ts_end_fr': float(entry_data[b'ts_end']),
-            'rates': np.frombuffer(entry_data[b'rates'], dtype=np.float32),
-            'prep_subspace': np.frombuffer(entry_data[b'prep_subspace'], dtype=np.float),
-            'move_subspace': np.frombuffer(entry_data[b'move_subspace'], dtype=np.float),
-            'speed_subspace': np.frombuffer(entry_data[b'speed_subspace'], dtype=np.float),
-            'target_state': np.frombuffer(entry_data[b'target_state'], dtype=np.int32)[0],
-            'moving': float(entry_data[b'moving']),
-            't_t': float(entry_data[b't_t']),
-            'i_fr': np.frombuffer(entry_data[b'i'], dtype=np.int32)[0],
-            'i_in': int(entry_data[b'i_in']),
-        }
-        out[i] = entry_dec
-    decoded_streams['firing_rates'] = out
-
-fr_df = pd.DataFrame(decoded_streams['firing_rates'])
-fr_df.set_index('i_in', inplace=True)
+    streams['firing_rates'] = read_stream(r, b'firing_rates', {
+        'ts_start_fr': Field(kind='text', key=b'ts_start'),
+        'ts_fr': Field(kind='text', key=b'ts'),
+        'ts_end_fr': Field(kind='text', key=b'ts_end'),
+        'rates': Field(np.float32, (-1, )),
+        'prep_subspace': Field(np.float64, (-1, )),
+        'move_subspace': Field(np.float64, (-1, )),
+        'speed_subspace': Field(np.float64, (-1, )),
+        'target_state': Field(np.int32),
+        'moving': Field(kind='text'),
+        't_t': Field(kind='text'),
+        'i_fr': Field(np.uint32, key=b'i'),
+        'i_in_fr': Field(np.int64, kind='text', key=b'i_in'),
+    })
 
 if b'spike_gen_1' in r.keys('*'):
-    stream_data = r.xrange(b'spike_gen_1')
-    out = [None] * len(stream_data)
-    for i, (entry_id, entry_data) in tqdm(enumerate(stream_data)):
-        entry_dec = {
-            'ts_start_spk1': float(entry_data[b'ts_start']),
-            'ts_in_spk1': float(entry_data[b'ts_in']),
-            'ts_spk1': float(entry_data[b'ts']),
-            'ts_end_spk1': float(entry_data[b'ts_end']),
-            'i_spk1': int(entry_data[b'i']),
-            'i_in': int(entry_data[b'i_in']),
-            'continuous_spk1': np.frombuffer(entry_data[b'continuous'], dtype=np.int16).reshape(-1,N_CHANNELS_ARRAY),
-            'thresholds_spk1': np.frombuffer(entry_data[b'thresholds'], dtype=np.int8),
-        }
-        out[i] = entry_dec
-    decoded_streams['spike_gen_1'] = out
-
-spk1_df = pd.DataFrame(decoded_streams['spike_gen_1'])
-spk1_df.set_index('i_in', inplace=True)
+    streams['spike_gen_1'] = read_stream(r, b'spike_gen_1', spike_gen_fields('spk1'))
 
 if b'spike_gen_2' in r.keys('*'):
-    stream_data = r.xrange(b'spike_gen_2')
-    out = [None] * len(stream_data)
-    for i, (entry_id, entry_data) in tqdm(enumerate(stream_data)):
-        entry_dec = {
-            'ts_start_spk2': float(entry_data[b'ts_start']),
-            'ts_in_spk2': float(entry_data[b'ts_in']),
-            'ts_spk2': float(entry_data[b'ts']),
-            'ts_end_spk2': float(entry_data[b'ts_end']),
-            'i_spk2': int(entry_data[b'i']),
-            'i_in': int(entry_data[b'i_in']),
-            'continuous_spk2': np.frombuffer(entry_data[b'continuous'], dtype=np.int16).reshape(-1,N_CHANNELS_ARRAY),
-            'thresholds_spk2': np.frombuffer(entry_data[b'thresholds'], dtype=np.int8),
-        }
-        out[i] = entry_dec
-    decoded_streams['spike_gen_2'] = out
-
-spk2_df = pd.DataFrame(decoded_streams['spike_gen_2'])
-spk2_df.set_index('i_in', inplace=True)
-
-graph_df1 = spk1_df.join(fr_df.join(mouse_df)).set_index('i_spk1')
-graph_df2 = spk2_df.join(fr_df.join(mouse_df)).set_index('i_spk2')
+    streams['spike_gen_2'] = read_stream(r, b'spike_gen_2', spike_gen_fields('spk2'))
+
+# trace each spike_gen sample to its firing rates and mouse sample (the
+# spike generators forward the i_in of the firing rates)
+graph1 = align(streams['spike_gen_1'],
+               ('i_in_spk1', streams['firing_rates'], 'i_in_fr'),
+               ('i_in_fr', streams['mouse_vel'], 'i_mouse'))
+graph2 = align(streams['spike_gen_2'],
+               ('i_in_spk2', streams['firing_rates'], 'i_in_fr'),
+               ('i_in_fr', streams['mouse_vel'], 'i_mouse'))
+
+graph_df1 = scalar_frame(graph1, 'i_spk1')
+graph_df2 = scalar_frame(graph2, 'i_spk2')
 
 if b'cb_gen_1' in r.keys('*'):
-    stream_data = r.xrange(b'cb_gen_1')
-    out = [None] * len(stream_data)
-    for i, (entry_id, entry_data) in tqdm(enumerate(stream_data)):
-        entry_dec = {
-            'ts': timespecs_to_timestamps(entry_data[b'timestamps'])[0],
-        }
-        out[i] = entry_dec
-    decoded_streams['cb_gen_1'] = out
+    streams['cb_gen_1'] = read_stream(r, b'cb_gen_1', {
+        'ts': Field(kind='timespec', key=b'timestamps'),
+    })
 
-cb_1_df = pd.DataFrame(decoded_streams['cb_gen_1'])
+cb_1_df = pd.DataFrame(streams['cb_gen_1'])
 
 if b'cb_gen_2' in r.keys('*'):
-    stream_data = r.xrange(b'cb_gen_2')
-    out = [None] * len(stream_data)
-    for i, (entry_id, entry_data) in tqdm(enumerate(stream_data)):
-        entry_dec = {
-            'ts': timespecs_to_timestamps(entry_data[b'timestamps'])[0],
-        }
-        out[i] = entry_dec
-    decoded_streams['cb_gen_2'] = out
+    streams['cb_gen_2'] = read_stream(r, b'cb_gen_2', {
+        'ts': Field(kind='timespec', key=b'timestamps'),
+    })
 
-cb_2_df = pd.DataFrame(decoded_streams['cb_gen_2'])
+cb_2_df = pd.DataFrame(streams['cb_gen_2'])
 
 # %%
 # Plot timing of output packets
@@ -196,18 +158,18 @@ cb_2_df.to_pickle(os.path.join(out_dir,'cb_gen_2.pkl'))
 
 # %%
 
-# concatenate all prep_space
-prep_subspace = np.vstack(graph_df1['prep_subspace'].tolist())
+# latent subspaces at each spike_gen_1 sample
+prep_subspace = graph1['prep_subspace']
 
 plt.figure()
 plt.plot(prep_subspace)
 
-move_subspace = np.vstack(graph_df1['move_subspace'].tolist())
+move_subspace = graph1['move_subspace']
 
 plt.figure()
 plt.plot(move_subspace)
 
-speed_subspace = np.vstack(graph_df1['speed_subspace'].tolist())
+speed_subspace = graph1['speed_subspace']
 
 plt.figure()
 plt.plot(speed_subspace)
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# bench_encoders.py
+# Times the firing-rate encoding models of brand_simulator.encoder at
+# several population sizes, one state per call (x_t) and in batches, and
+# reports the bytes allocated per call in steady state
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+from brand_simulator.encoder import ENCODERS
+
+argp = argparse.ArgumentParser()
+argp.add_argument('-m', '--models', type=str, nargs='+',
+                  default=list(ENCODERS))
+argp.add_argument('-n', '--n_neurons', type=int, nargs='+',
+                  default=[1000, 2000, 5000, 10000])
+argp.add_argument('-k', '--batch', type=int, nargs='+', default=[1, 10, 100])
+argp.add_argument('-s', '--n_states', type=int, default=2000,
+                  help='number of states encoded per measurement')
+argp.add_argument('--seed', type=int, default=42)
+args = argp.parse_args()
+
+
+def time_calls(encode, n_calls):
+    encode()  # warm up
+    times = np.zeros(n_calls)
+    for j in range(n_calls):
+        t0 = time.perf_counter()
+        encode()
+        times[j] = time.perf_counter() - t0
+    tracemalloc.start()
+    encode()
+    tracemalloc.clear_traces()
+    encode()
+    alloc = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return times, alloc
+
+
+for model in args.models:
+    for n_neurons in args.n_neurons:
+        encoder = ENCODERS[model].from_parameters({
+            'n_neurons': n_neurons,
+            'max_batch': max(args.batch),
+        })
+        encoder.build()
+        rng = np.random.default_rng(args.seed)
+        encoder.states[:] = rng.uniform(-1, 1, encoder.states.shape)
+        encoder.clicks[:] = rng.integers(0, 2, encoder.max_batch)
+        encoder.x_t[:, 0] = encoder.states[:, 0]
+
+        # one state per call, on the (n_neurons, 1) buffers
+        times, alloc = time_calls(encoder.encode, args.n_states)
+        print(f'{model}, {n_neurons} neurons, x_t: '
+              f'{np.mean(times) * 1e6:.1f} us/state, {alloc} B/call')
+
+        for k in args.batch:
+            X = encoder.states[:, :k]
+            clicks = encoder.clicks[:k]
+            times, alloc = time_calls(lambda: encoder.encode(X, clicks),
+                                      max(args.n_states // k, 1))
+            print(f'{model}, {n_neurons} neurons, batch of {k}: '
+                  f'{np.mean(times) * 1e6 / k:.1f} us/state, '
+                  f'{np.percentile(times, 99) * 1e6:.1f} us p99/call, '
+                  f'{alloc} B/call')
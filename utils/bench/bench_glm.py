@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# bench_glm.py
+# Times spike_gen_30k's block generation with the GLM spike sampler
+# (spike-history, refractory and optional coupling filters) against the
+# Bernoulli sampler, per ms of data, and reports the firing rate of the
+# drawn spikes relative to the input rates
+import argparse
+import time
+
+import numpy as np
+
+from brand_simulator.sharding import make_generator
+
+argp = argparse.ArgumentParser()
+argp.add_argument('-c', '--n_channels', type=int, nargs='+',
+                  default=[96, 192, 384])
+argp.add_argument('-r', '--rate', type=float, nargs=2, default=[5.0, 60.0],
+                  help='range of firing rates (Hz)')
+argp.add_argument('-l', '--link', type=str, default='exp')
+argp.add_argument('--coupling_amp', type=float, default=1.0,
+                  help='coupling weight SD of the coupled GLM')
+argp.add_argument('-b', '--n_blocks', type=int, default=2000)
+argp.add_argument('--seed', type=int, default=42)
+args = argp.parse_args()
+
+fr_iterations = 5
+ms_samples = 30
+
+configs = {
+    'bernoulli': {'spike_sampler': 'bernoulli'},
+    'glm': {'spike_sampler': 'glm', 'glm_link': args.link},
+    'glm coupled': {
+        'spike_sampler': 'glm',
+        'glm_link': args.link,
+        'coupling_amp': args.coupling_amp
+    },
+}
+
+for n_channels in args.n_channels:
+    rates = np.random.default_rng(args.seed).uniform(
+        *args.rate, size=n_channels).astype(np.float32)
+    for name, config in configs.items():
+        parameters = {
+            'fr_sample_rate': 200,
+            'sample_rate': 1000,
+            'continuous_rate': 30000,
+            'random_seed': args.seed,
+            'scale': 600,
+            'n_start': 0,
+            'n_end': n_channels,
+            **config,
+        }
+        generator = make_generator(parameters)
+        generator.build()
+        times = np.zeros(args.n_blocks)
+        n_spikes = np.zeros(n_channels)
+        for b in range(args.n_blocks):
+            t0 = time.perf_counter()
+            generator.process(rates)
+            times[b] = time.perf_counter() - t0
+            n_spikes += generator.spike_counts.sum(axis=0)
+
+        # each block holds 'fr_iterations' ms of data
+        per_ms = times * 1e6 / fr_iterations
+        duration = args.n_blocks * fr_iterations / 1e3
+        print(f'{n_channels} channels, {name}: '
+              f'{np.mean(per_ms):.1f} us/ms mean, '
+              f'{np.percentile(per_ms, 99):.1f} us/ms p99, '
+              f'rate {np.mean(n_spikes / duration / rates):.2f}x input')
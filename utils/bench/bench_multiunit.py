@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# bench_multiunit.py
+# Times the multi-unit generation path of spike_gen_30k (sampling, waveform
+# synthesis, int16 conversion and threshold counts) against the 1 ms budget
+import argparse
+import os
+import time
+
+import numpy as np
+
+from brand_simulator.sampling import BernoulliSampler
+from brand_simulator.synthesis import MultiUnitSynthesizer, quantize
+from brand_simulator.waveforms import WaveformBank
+
+argp = argparse.ArgumentParser()
+argp.add_argument('-c', '--n_channels', type=int, default=192)
+argp.add_argument('-u', '--n_units', type=int, nargs='+', default=[1, 2, 4])
+argp.add_argument('-r', '--rate', type=float, nargs=2, default=[5.0, 60.0],
+                  help='range of unit firing rates (Hz)')
+argp.add_argument('-w', '--n_waveforms', type=int, default=8)
+argp.add_argument('-b', '--n_blocks', type=int, default=2000)
+argp.add_argument('--seed', type=int, default=42)
+args = argp.parse_args()
+
+continuous_rate = 30000
+ms_iterations = 30
+fr_iterations = 5
+block_len = fr_iterations * ms_iterations
+
+print(f'Running on CPU(s) {sorted(os.sched_getaffinity(0))}')
+
+for n_units in args.n_units:
+    rng = np.random.default_rng(args.seed)
+    shape = (args.n_channels, n_units)
+    rates = rng.uniform(*args.rate, size=shape).astype(np.float32)
+
+    sampler = BernoulliSampler(block_len, shape, continuous_rate, seed=args.seed)
+    bank = WaveformBank.generate(args.n_waveforms, args.n_channels * n_units,
+                                 seed=args.seed, scale=600)
+    synthesizer = MultiUnitSynthesizer(bank, args.n_channels, n_units,
+                                       amplitudes=rng.uniform(0.5, 1.5, size=shape))
+    crossings = np.zeros((block_len, args.n_channels), dtype=bool)
+    continuous = np.zeros((block_len, args.n_channels), dtype=np.int16)
+
+    times = np.zeros(args.n_blocks)
+    for b in range(args.n_blocks):
+        t0 = time.perf_counter()
+        spikes = sampler.sample(rates)
+        np.any(spikes, axis=2, out=crossings)
+        quantize(synthesizer.process(spikes), continuous)
+        thresholds = crossings.reshape(fr_iterations, ms_iterations,
+                                       -1).sum(axis=1).astype(np.int8)
+        times[b] = time.perf_counter() - t0
+
+    # each block holds 'fr_iterations' ms of data
+    per_ms = times * 1e6 / fr_iterations
+    print(f'{args.n_channels} channels x {n_units} units: '
+          f'{np.mean(per_ms):.1f} us/ms mean, '
+          f'{np.percentile(per_ms, 99):.1f} us/ms p99, '
+          f'{np.max(times) * 1e6:.1f} us worst 5 ms block '
+          f'({"within" if np.percentile(per_ms, 99) < 1000 else "OVER"} 1 ms budget)')
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# bench_pacing.py
+# Compares the old thresholds_udp pacing (time.sleep(1e-6) busy loop) with
+# DeadlineScheduler, reporting lateness and CPU time per second of pacing
+import argparse
+import os
+import time
+
+import numpy as np
+
+from brand_simulator.pacing import DeadlineScheduler
+
+argp = argparse.ArgumentParser()
+argp.add_argument('-p', '--period', type=float, default=1e-3)
+argp.add_argument('-n', '--n_deadlines', type=int, default=5000)
+argp.add_argument('-s', '--spin_us', type=float, nargs='+',
+                  default=[0, 20, 50, 200])
+args = argp.parse_args()
+
+print(f'Running on CPU(s) {sorted(os.sched_getaffinity(0))}')
+
+
+def report(name, lateness, cpu, wall):
+    lateness = np.asarray(lateness) / 1e3
+    print(f'{name}: lateness p50 {np.median(lateness):.1f} us, '
+          f'p99 {np.percentile(lateness, 99):.1f} us, '
+          f'max {np.max(lateness):.1f} us, '
+          f'CPU {100 * cpu / wall:.0f}%')
+
+
+# old pacing, anchored at the start of each 5-sample block
+lateness = np.zeros(args.n_deadlines)
+c0, t0 = time.process_time(), time.monotonic()
+period_ns = int(args.period * 1e9)
+for k in range(args.n_deadlines):
+    if k % 5 == 0:
+        last_time = time.monotonic()
+        anchor = time.monotonic_ns()
+    while time.monotonic() < last_time + (k % 5) * args.period:
+        time.sleep(1e-6)
+    lateness[k] = time.monotonic_ns() - (anchor + (k % 5) * period_ns)
+report('sleep(1e-6) loop', lateness, time.process_time() - c0,
+       time.monotonic() - t0)
+
+for spin_us in args.spin_us:
+    scheduler = DeadlineScheduler(args.period, spin=spin_us * 1e-6)
+    lateness = np.zeros(args.n_deadlines)
+    c0, t0 = time.process_time(), time.monotonic()
+    for k in range(args.n_deadlines):
+        lateness[k] = scheduler.wait()
+    report(f'DeadlineScheduler, {spin_us:g} us spin', lateness,
+           time.process_time() - c0,
+           time.monotonic() - t0)
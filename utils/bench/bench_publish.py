@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# bench_publish.py
+# Measures Redis write throughput of the spike_gen_30k publish modes
+# (per_ms, pipeline, packed) for 5 ms blocks of 30 kHz int16 data. Needs a
+# running Redis server.
+import argparse
+import time
+
+import numpy as np
+import redis
+
+from brand_simulator.publish import PUBLISH_MODES, BlockPublisher
+
+argp = argparse.ArgumentParser()
+argp.add_argument('--host', type=str, default='127.0.0.1')
+argp.add_argument('--port', type=int, default=6379)
+argp.add_argument('-s', '--socket', type=str, default=None,
+                  help='unix socket path, used instead of host/port')
+argp.add_argument('-c', '--n_channels', type=int, nargs='+',
+                  default=[192, 384])
+argp.add_argument('-m', '--modes', type=str, nargs='+',
+                  default=list(PUBLISH_MODES))
+argp.add_argument('-b', '--n_blocks', type=int, default=4000)
+argp.add_argument('--stream', type=str, default='bench_publish')
+args = argp.parse_args()
+
+ms_iterations = 30
+fr_iterations = 5
+
+if args.socket is not None:
+    r = redis.Redis(unix_socket_path=args.socket)
+else:
+    r = redis.Redis(host=args.host, port=args.port)
+
+rng = np.random.default_rng(42)
+for n_channels in args.n_channels:
+    continuous = rng.integers(-1000, 1000,
+                              size=(fr_iterations * ms_iterations, n_channels),
+                              dtype=np.int16)
+    thresholds = rng.integers(0, 2, size=(fr_iterations, n_channels),
+                              dtype=np.int8)
+
+    for mode in args.modes:
+        r.delete(args.stream)
+        publisher = BlockPublisher(r,
+                                   args.stream, fr_iterations, {
+                                       'continuous': continuous,
+                                       'thresholds': thresholds
+                                   },
+                                   mode=mode,
+                                   maxlen=2000)
+        sample = {
+            'ts_start': float(),
+            'ts_in': float(),
+            'ts': float(),
+            'ts_end': float(),
+            'i': 0,
+            'i_in': 0,
+        }
+
+        times = np.zeros(args.n_blocks)
+        t_start = time.perf_counter()
+        for b in range(args.n_blocks):
+            t0 = time.perf_counter()
+            publisher.publish(sample)
+            times[b] = time.perf_counter() - t0
+        elapsed = time.perf_counter() - t_start
+
+        n_entries = r.xlen(args.stream)
+        blocks_per_s = args.n_blocks / elapsed
+        print(f'{n_channels} channels, {mode}: '
+              f'{blocks_per_s * fr_iterations:.0f} ms of data/s '
+              f'({blocks_per_s * fr_iterations / 1000:.1f}x real time), '
+              f'{np.median(times) * 1e6:.1f} us p50, '
+              f'{np.percentile(times, 99) * 1e6:.1f} us p99 per 5 ms block, '
+              f'{n_entries} entries kept')
+
+r.delete(args.stream)
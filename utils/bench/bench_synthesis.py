@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# bench_synthesis.py
+# Compares sparse spike-waveform stamping against streaming fftconvolve, the
+# two synthesis paths of spike_gen_30k, for speed and for equality of the
+# int16 continuous data
+import argparse
+import time
+
+import numpy as np
+from scipy.signal import fftconvolve
+
+from brand_simulator.synthesis import (AP_WAVEFORM, SparseSpikeSynthesizer,
+                                       StreamingConvolver, quantize)
+
+argp = argparse.ArgumentParser()
+argp.add_argument('-n', '--n_channels', type=int, nargs='+', default=[96, 192, 384])
+argp.add_argument('-r', '--rate', type=float, default=50.0, help='firing rate (Hz)')
+argp.add_argument('-b', '--n_blocks', type=int, default=2000)
+argp.add_argument('--scale', type=float, default=600)
+argp.add_argument('--seed', type=int, default=42)
+args = argp.parse_args()
+
+continuous_rate = 30000
+block_len = 150  # 5 ms at 30 kHz
+
+for n in args.n_channels:
+    rng = np.random.default_rng(args.seed)
+    spikes = rng.random((args.n_blocks, block_len, n)) < args.rate / continuous_rate
+
+    # streaming fftconvolve
+    convolver = StreamingConvolver(AP_WAVEFORM, n, scale=args.scale)
+    fft_out = np.zeros((args.n_blocks, block_len, n), dtype=np.int16)
+    t0 = time.perf_counter()
+    for b in range(args.n_blocks):
+        quantize(convolver.process(spikes[b]), fft_out[b])
+    t_fft = (time.perf_counter() - t0) / args.n_blocks
+
+    # sparse stamping
+    synthesizer = SparseSpikeSynthesizer(AP_WAVEFORM, n, scale=args.scale)
+    sparse_out = np.zeros((args.n_blocks, block_len, n), dtype=np.int16)
+    t0 = time.perf_counter()
+    for b in range(args.n_blocks):
+        quantize(synthesizer.process(spikes[b]), sparse_out[b])
+    t_sparse = (time.perf_counter() - t0) / args.n_blocks
+
+    # reference: one fftconvolve over the whole spike train
+    spikes_all = spikes.reshape(-1, n).astype(np.float64)
+    ref = args.scale * fftconvolve(spikes_all, AP_WAVEFORM[:, None], mode='full',
+                                   axes=0)[:spikes_all.shape[0]]
+    ref = quantize(ref, np.zeros(ref.shape, dtype=np.int16))
+
+    n_diff_sparse = np.count_nonzero(sparse_out.reshape(-1, n) != ref)
+    n_diff_fft = np.count_nonzero(fft_out.reshape(-1, n) != ref)
+
+    print(f'{n} channels, {args.rate} Hz, {spikes.sum()} spikes in '
+          f'{args.n_blocks} blocks')
+    print(f'  fftconvolve: {t_fft * 1e6:8.1f} us/block, '
+          f'{n_diff_fft} samples differ from reference '
+          f'({"bit-identical" if n_diff_fft == 0 else "MISMATCH"})')
+    print(f'  sparse:      {t_sparse * 1e6:8.1f} us/block, '
+          f'{n_diff_sparse} samples differ from reference '
+          f'({"bit-identical" if n_diff_sparse == 0 else "MISMATCH"})')
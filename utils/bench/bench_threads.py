@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# bench_threads.py
+# Times spike_gen_30k's block generation with its channels split across a
+# pool of threads (n_threads), against the single-threaded generator, and
+# checks that the threaded data only depends on the seed and thread count
+import argparse
+import os
+import time
+
+import numpy as np
+
+from brand_simulator.sharding import make_generator
+
+argp = argparse.ArgumentParser()
+argp.add_argument('-c', '--n_channels', type=int, nargs='+',
+                  default=[96, 192, 384])
+argp.add_argument('-t', '--n_threads', type=int, nargs='+', default=[1, 2, 4])
+argp.add_argument('-r', '--rate', type=float, nargs=2, default=[5.0, 60.0],
+                  help='range of firing rates (Hz)')
+argp.add_argument('-n', '--noise_rms', type=float, default=0)
+argp.add_argument('--threshold_source', type=str, default='spikes')
+argp.add_argument('-b', '--n_blocks', type=int, default=2000)
+argp.add_argument('--seed', type=int, default=42)
+args = argp.parse_args()
+
+fr_iterations = 5
+
+
+def generate(parameters, rates, n_blocks):
+    generator = make_generator(parameters)
+    generator.build()
+    generator.start()
+    times = np.zeros(n_blocks)
+    try:
+        for b in range(n_blocks):
+            t0 = time.perf_counter()
+            generator.process(rates)
+            times[b] = time.perf_counter() - t0
+        return times, generator.continuous.copy()
+    finally:
+        generator.stop()
+
+
+print(f'Running on CPU(s) {sorted(os.sched_getaffinity(0))}')
+
+for n_channels in args.n_channels:
+    rates = np.random.default_rng(args.seed).uniform(
+        *args.rate, size=n_channels).astype(np.float32)
+    base = None
+    for n_threads in args.n_threads:
+        parameters = {
+            'fr_sample_rate': 200,
+            'sample_rate': 1000,
+            'continuous_rate': 30000,
+            'random_seed': args.seed,
+            'scale': 600,
+            'n_start': 0,
+            'n_end': n_channels,
+            'noise_rms': args.noise_rms,
+            'threshold_source': args.threshold_source,
+            'n_threads': n_threads,
+        }
+        times, last = generate(parameters, rates, args.n_blocks)
+        # a second run with the same seed must give the same data
+        _, again = generate(parameters, rates, args.n_blocks)
+
+        # each block holds 'fr_iterations' ms of data
+        per_ms = times * 1e6 / fr_iterations
+        if base is None:
+            base = np.mean(per_ms)
+        print(f'{n_channels} channels, {n_threads} thread(s): '
+              f'{np.mean(per_ms):.1f} us/ms mean, '
+              f'{np.percentile(per_ms, 99):.1f} us/ms p99, '
+              f'{base / np.mean(per_ms):.2f}x, '
+              f'{"reproducible" if np.array_equal(last, again) else "NOT reproducible"}')
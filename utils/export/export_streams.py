@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# export_streams.py
+# Exports Redis streams to memory-mappable column files (one directory per
+# stream), paging through each stream so memory use stays constant. Running
+# it again on the same output directory appends the entries added since.
+# Load an export with brand_simulator.export.open_export.
+import argparse
+import os
+import sys
+
+from redis import Redis
+
+from brand_simulator.export import export_stream
+
+# types of the binary fields written by the simulator nodes
+SIMULATOR_DTYPES = {
+    b'rates': '<f4',
+    b'prep_subspace': '<f8',
+    b'move_subspace': '<f8',
+    b'speed_subspace': '<f8',
+    b'target_state': '<i4',
+    b'alloc_bytes': '<i8',
+    b'continuous': '<i2',
+    b'thresholds': '<i1',
+    b'spike_counts': '<i1',
+    b'ms_offsets': '<u4',
+    b'samples': '<i2',
+    b'index': '<i4',
+    b'timestamps': 'timespec',
+}
+
+# fields that are binary in some streams only (e.g. 'i' is text in the
+# spike generator streams)
+STREAM_DTYPES = {
+    'firing_rates': {
+        b'i': '<u4'
+    },
+}
+
+argp = argparse.ArgumentParser()
+argp.add_argument('-i', '--redis_host', type=str, default='localhost')
+argp.add_argument('-p', '--redis_port', type=int, default=6379)
+argp.add_argument('-s', '--redis_socket', type=str)
+argp.add_argument('-o', '--out_dir', type=str, default='./sim_outputs')
+argp.add_argument('-c', '--count', type=int, default=10000,
+                  help='entries per XRANGE page')
+argp.add_argument('-x', '--exclude', type=str, nargs='*',
+                  default=['sync'], help='fields to leave out')
+argp.add_argument('streams', type=str, nargs='*',
+                  help='streams to export (default: all)')
+args = argp.parse_args()
+
+if args.redis_socket:
+    r = Redis(unix_socket_path=args.redis_socket)
+else:
+    r = Redis(args.redis_host, args.redis_port, retry_on_timeout=True)
+
+streams = args.streams or sorted(
+    key.decode() for key in r.scan_iter(_type='STREAM'))
+if not streams:
+    print('No streams to export')
+    sys.exit(1)
+
+for stream in streams:
+    path = os.path.join(args.out_dir, stream)
+    n = export_stream(r,
+                      stream,
+                      path,
+                      dtypes={
+                          **SIMULATOR_DTYPES,
+                          **STREAM_DTYPES.get(stream, {})
+                      },
+                      exclude=args.exclude,
+                      count=args.count)
+    print(f'{stream}: {n} entries exported to {path}')
+
+r.close()
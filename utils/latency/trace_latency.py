@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# trace_latency.py
+# Computes per-hop and end-to-end latency distributions of a simulator
+# graph, from the mouse sample (mouseAdapter) to the Cerebus packets
+# (cb_generator). Each node forwards the index and time of the mouse sample
+# its output derives from (origin_i, origin_ts), and cb_generator logs the
+# ID of the entry it sent, so every sample is traced without per-sample
+# Python code. Streams may use either the 'fields' or 'binary' format.
+import argparse
+import sys
+
+import numpy as np
+from redis import Redis
+
+from brand_simulator.lineage import follow_entries, hop_latencies, summarize
+from brand_simulator.schema import load_schema
+from brand_simulator.streams import Field, read_records, read_stream
+
+argp = argparse.ArgumentParser()
+argp.add_argument('-i', '--redis_host', type=str, default='localhost')
+argp.add_argument('-p', '--redis_port', type=int, default=6379)
+argp.add_argument('-s', '--redis_socket', type=str)
+argp.add_argument('--mouse', type=str, default='mouse_vel')
+argp.add_argument('--rates', type=str, default='firing_rates')
+argp.add_argument('--spikes', type=str, default='spike_gen_1')
+argp.add_argument('--cb', type=str, default='cb_gen_1',
+                  help='cb_generator stream (empty to stop at --spikes)')
+argp.add_argument('-c', '--count', type=int, default=10000,
+                  help='entries per XRANGE page')
+args = argp.parse_args()
+
+if args.redis_socket:
+    r = Redis(unix_socket_path=args.redis_socket)
+else:
+    r = Redis(args.redis_host, args.redis_port, retry_on_timeout=True)
+
+
+def load_mouse(stream):
+    columns = read_stream(r, stream, {
+        'origin_i': Field(np.int32, key=b'index'),
+        'origin_ts': Field(kind='timespec', key=b'timestamps'),
+    },
+                          count=args.count)
+    columns['ts'] = columns['origin_ts']
+    return columns
+
+
+def load_node(stream):
+    """
+    Output time (s), origin and entry IDs of a Python node's stream, one row
+    per entry
+    """
+    if load_schema(r, stream) is not None:
+        columns = read_records(r, stream, count=args.count, ids=True)
+        # packed entries hold several records with the same header
+        step = max(1, columns['origin_i'].shape[0] // columns['id'].shape[0])
+        return {
+            'id': columns['id'],
+            'origin_i': columns['origin_i'][::step],
+            'origin_ts': columns['origin_ts'][::step] / 1e9,
+            'ts': columns['ts'][::step] / 1e9,
+        }
+
+    first = r.xrange(stream, count=1)
+    if not first:
+        print(f'Stream {stream} is empty')
+        sys.exit(1)
+    entry = first[0][1]
+    if b'origin_i' not in entry:
+        print(f'Stream {stream} has no lineage fields')
+        sys.exit(1)
+    # 'ts' is float seconds, or uint64 ns bytes (sim2D)
+    try:
+        float(entry[b'ts'])
+        ts_field, ts_scale = Field(kind='text'), 1
+    except ValueError:
+        ts_field, ts_scale = Field(np.uint64), 1e-9
+
+    columns = read_stream(r, stream, {
+        'origin_i': Field(np.int64, kind='text'),
+        'origin_ts': Field(np.int64, kind='text'),
+        'ts': ts_field,
+    },
+                          count=args.count,
+                          ids=True)
+    columns['origin_ts'] = columns['origin_ts'] / 1e9
+    columns['ts'] = columns['ts'] * ts_scale
+    return columns
+
+
+stages = [
+    (args.mouse, load_mouse(args.mouse)),
+    (args.rates, load_node(args.rates)),
+    (args.spikes, load_node(args.spikes)),
+]
+if args.cb:
+    cb = read_stream(r, args.cb, {
+        'ts': Field(kind='timespec', key=b'timestamps'),
+        'input_id': Field(kind='id'),
+    },
+                     count=args.count)
+    stages.append((args.cb, follow_entries(cb, stages[-1][1])))
+r.close()
+
+for name, columns in stages:
+    print(f'{name}: {columns["ts"].shape[0]} samples')
+
+summary = summarize(hop_latencies(stages))
+print(f'{"hop":<40} {"n":>10} {"p50":>10} {"p99":>10} {"p99.9":>10} '
+      f'{"max":>10}  (us)')
+for name, stats in summary.items():
+    if not stats['n']:
+        print(f'{name:<40} {0:>10}')
+        continue
+    print(f'{name:<40} {stats["n"]:>10} {stats["p50"]:>10.1f} '
+          f'{stats["p99"]:>10.1f} {stats["p99.9"]:>10.1f} '
+          f'{stats["max"]:>10.1f}')
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# compare_exports.py
+# Compares two exports of the same streams (see brand_simulator.export),
+# e.g. a live run and its offline regeneration (run_offline.py). Entries
+# are matched on a key column ('i' by default), and every column present in
+# both exports is compared, a block of rows at a time.
+import argparse
+import os
+import sys
+
+import numpy as np
+
+from brand_simulator.alignment import match
+from brand_simulator.export import ID_COLUMNS, INDEX_FILE, open_export
+
+argp = argparse.ArgumentParser()
+argp.add_argument('reference', type=str, help='export directory (e.g. live)')
+argp.add_argument('other', type=str, help='export directory (e.g. offline)')
+argp.add_argument('--streams', type=str, nargs='*', default=None,
+                  help='streams to compare (default: all in both)')
+argp.add_argument('-k', '--key', type=str, default='i',
+                  help='column to match entries on')
+argp.add_argument('-b', '--block', type=int, default=100000,
+                  help='rows compared at once')
+args = argp.parse_args()
+
+
+def exported(path):
+    return {
+        name for name in os.listdir(path)
+        if os.path.exists(os.path.join(path, name, INDEX_FILE))
+    }
+
+
+streams = args.streams or sorted(exported(args.reference) & exported(args.other))
+if not streams:
+    print('No streams to compare')
+    sys.exit(1)
+
+n_failed = 0
+for stream in streams:
+    ref = open_export(os.path.join(args.reference, stream))
+    other = open_export(os.path.join(args.other, stream))
+    rows = match(np.asarray(other[args.key]).reshape(-1),
+                 np.asarray(ref[args.key]).reshape(-1))
+    found = np.flatnonzero(rows >= 0)
+    print(f'{stream}: {found.shape[0]} of {rows.shape[0]} entries matched on '
+          f'{args.key}')
+
+    columns = sorted((set(ref) & set(other)) - set(ID_COLUMNS) - {args.key})
+    for name in columns:
+        a, b = ref[name], other[name]
+        if a.shape[1:] != b.shape[1:]:
+            print(f'  {name}: shape {a.shape[1:]} != {b.shape[1:]}')
+            n_failed += 1
+            continue
+        n_diff = 0
+        max_diff = 0
+        first = None
+        for start in range(0, found.shape[0], args.block):
+            sel = found[start:start + args.block]
+            diff = (np.asarray(a[sel], dtype=np.float64) -
+                    np.asarray(b[rows[sel]], dtype=np.float64))
+            diff = np.abs(diff.reshape(sel.shape[0], -1)).max(axis=1,
+                                                               initial=0)
+            bad = np.flatnonzero(diff > 0)
+            if bad.shape[0] and first is None:
+                first = sel[bad[0]]
+            n_diff += bad.shape[0]
+            max_diff = max(max_diff, diff.max(initial=0))
+        if n_diff:
+            n_failed += 1
+            print(f'  {name}: {n_diff} entries differ (max abs diff '
+                  f'{max_diff:g}, first at row {first})')
+        else:
+            print(f'  {name}: identical')
+
+sys.exit(1 if n_failed else 0)
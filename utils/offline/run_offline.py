@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# run_offline.py
+# Regenerates a simulator dataset without Redis or a mouse: runs the
+# firing-rate (rate_encoder) and spike generator nodes (spike_gen_30k,
+# spike_gen_30k_mp) of a graph in process, as fast as the CPU allows, over a
+# synthetic velocity trace or a recorded one (a .npy file or an export of
+# mouse_vel), and writes every stream to disk as an export (see
+# brand_simulator.export). To regression-test a live run, export its
+# streams, pass the mouse_vel export with --first_index set to the first
+# mouse sample the graph read (the 'i_in' of the first firing_rates entry),
+# and compare both exports with compare_exports.py.
+import argparse
+import logging
+import time
+
+import numpy as np
+import yaml
+
+from brand_simulator.offline import (OfflineSimulator, load_velocity,
+                                     synthetic_velocity)
+
+argp = argparse.ArgumentParser()
+argp.add_argument('graph', type=str, help='graph YAML file')
+argp.add_argument('-o', '--out_dir', type=str, default='./sim_offline')
+argp.add_argument('-d', '--duration', type=float, default=60.0,
+                  help='duration (s) of the synthetic velocity trace')
+argp.add_argument('-v', '--velocity', type=str, default=None,
+                  help='recorded velocity: .npy file or mouse_vel export')
+argp.add_argument('--first_index', type=int, default=None,
+                  help='first mouse sample of the recorded velocity')
+argp.add_argument('--seed', type=int, default=0,
+                  help='seed of the synthetic velocity trace')
+argp.add_argument('--streams', type=str, nargs='*', default=None,
+                  help="spike generators' output streams (default: all)")
+argp.add_argument('-c', '--chunk', type=int, default=1000,
+                  help='input samples processed and written at once')
+args = argp.parse_args()
+
+logging.basicConfig(format='%(asctime)s %(message)s', level=logging.INFO)
+
+with open(args.graph) as f:
+    graph = yaml.safe_load(f)
+simulator = OfflineSimulator.from_graph(graph, streams=args.streams)
+
+if args.velocity is not None:
+    index, samples = load_velocity(args.velocity, args.first_index)
+else:
+    n_samples = int(args.duration * simulator.sample_rate)
+    samples = synthetic_velocity(n_samples,
+                                 max_v=simulator.max_v,
+                                 sample_rate=simulator.sample_rate,
+                                 seed=args.seed)
+    index = np.arange(n_samples)
+
+t0 = time.perf_counter()
+n = simulator.run(index, samples, args.out_dir, chunk=args.chunk)
+elapsed = time.perf_counter() - t0
+print(f'{n / simulator.sample_rate:.1f} s of data '
+      f'({", ".join(simulator.generators)}) written to {args.out_dir} in '
+      f'{elapsed:.1f} s ({n / simulator.sample_rate / elapsed:.1f}x real time)')